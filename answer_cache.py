@@ -0,0 +1,266 @@
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from config import ANSWER_CACHE_SIMILARITY_THRESHOLD, ANSWER_CACHE_TTL, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_DB_FILE
+from db_pool import open_connection
+
+
+def _normalize(vector: List[float]) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticAnswerCache:
+    """
+    In-memory cache of answers, keyed by embeddings of questions.
+
+    Answer is returned for a new question, if cosine similarity of its embedding to the embedding of
+    a cached question is at least `similarity_threshold`. Entries expire after `ttl` seconds, and
+    the least recently used entry is evicted when the cache is full.
+    Cache must be cleared, when the documents are embedded again, see chain_manager.ChainManager.
+    """
+
+    def __init__(self,
+                 embed: Callable[[str], List[float]],
+                 similarity_threshold: float = ANSWER_CACHE_SIMILARITY_THRESHOLD,
+                 ttl: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        """
+        :param embed:                   Blocking function, that embeds the question.
+        :param similarity_threshold:    Minimal cosine similarity of questions to return cached answer.
+        :param ttl:                     Seconds, for which answer is kept.
+        :param max_entries:             Maximum number of cached answers.
+        """
+        self._embed = embed
+        self._similarity_threshold = similarity_threshold
+        self._ttl = ttl
+        self._max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None  # Normalized embeddings, one row per slot.
+        self._answers: List[Optional[str]] = [None] * max_entries
+        self._expires_at = np.zeros(max_entries)  # 0 for empty slot.
+        self._last_used_at = np.zeros(max_entries)
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, question: str) -> Tuple[Optional[str], np.ndarray]:
+        """
+        Blocking lookup.
+        :return: Cached answer or None, and the embedding of the question, to `put` the answer with.
+        """
+        embedding = _normalize(self._embed(question))
+        now = time.monotonic()
+
+        with self._lock:
+            answer = None
+            if self._vectors is not None:
+                similarities = self._vectors @ embedding
+                similarities[self._expires_at <= now] = -np.inf
+                slot = int(np.argmax(similarities))
+                if similarities[slot] >= self._similarity_threshold:
+                    answer = self._answers[slot]
+                    self._last_used_at[slot] = now
+
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return answer, embedding
+
+    def put(self, embedding: np.ndarray, answer: str):
+        """
+        :param embedding:   Embedding of the question, as returned by `get`.
+        :param answer:      Answer to cache.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self._max_entries, embedding.shape[0]), dtype=np.float32)
+
+            # Empty and expired slots have the oldest expiration, otherwise the least recently used slot is taken.
+            free = self._expires_at <= now
+            slot = int(np.argmax(free)) if free.any() else int(np.argmin(self._last_used_at))
+
+            self._vectors[slot] = embedding
+            self._answers[slot] = answer
+            self._expires_at[slot] = now + self._ttl
+            self._last_used_at[slot] = now
+
+    def clear(self):
+        with self._lock:
+            self._answers = [None] * self._max_entries
+            self._expires_at[:] = 0
+            self._last_used_at[:] = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = int(np.count_nonzero(self._expires_at > time.monotonic()))
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class SharedAnswerCache:
+    """
+    Same cache as SemanticAnswerCache, but kept in SQLite, so that it is shared by all workers of serve.py.
+
+    Every worker keeps a copy of the cached embeddings in memory, and on lookup reads only rows, added since
+    its previous lookup, so lookup costs one indexed query. Clearing is noticed by the generation number.
+    Answers are evicted in order they were cached (not least recently used), so that lookups do not write.
+    Workers reload their chains at slightly different times, and every one of them clears the cache, when it does,
+    so answers to the old documents, which a worker may still cache, are dropped too.
+    """
+
+    def __init__(self,
+                 embed: Callable[[str], List[float]],
+                 db_file: str = ANSWER_CACHE_DB_FILE,
+                 similarity_threshold: float = ANSWER_CACHE_SIMILARITY_THRESHOLD,
+                 ttl: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        """
+        :param embed:                   Blocking function, that embeds the question.
+        :param db_file:                 SQLite file of the cache.
+        :param similarity_threshold:    Minimal cosine similarity of questions to return cached answer.
+        :param ttl:                     Seconds, for which answer is kept.
+        :param max_entries:             Maximum number of cached answers.
+        """
+        self._embed = embed
+        self._db_file = db_file
+        self._similarity_threshold = similarity_threshold
+        self._ttl = ttl
+        self._max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._connection = None
+        self._reset_copy(generation=None)
+
+        # Lookups of this worker.
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, question: str) -> Tuple[Optional[str], np.ndarray]:
+        """
+        Blocking lookup.
+        :return: Cached answer or None, and the embedding of the question, to `put` the answer with.
+        """
+        embedding = _normalize(self._embed(question))
+
+        with self._lock:
+            self._sync()
+            answer = None
+            if self._answers:
+                similarities = self._vectors @ embedding
+                similarities[self._expires_at <= time.time()] = -np.inf
+                slot = int(np.argmax(similarities))
+                if similarities[slot] >= self._similarity_threshold:
+                    answer = self._answers[slot]
+
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return answer, embedding
+
+    def put(self, embedding: np.ndarray, answer: str):
+        """
+        :param embedding:   Embedding of the question, as returned by `get`.
+        :param answer:      Answer to cache.
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._get_connection()
+            with connection:
+                cursor = connection.execute('INSERT INTO Answer (vector, answer, expires_at) VALUES (?, ?, ?)',
+                                            (embedding.astype(np.float32).tobytes(), answer, now + self._ttl))
+                connection.execute('DELETE FROM Answer WHERE expires_at <= ? OR id <= ?',
+                                   (now, cursor.lastrowid - self._max_entries))
+
+    def clear(self):
+        with self._lock:
+            connection = self._get_connection()
+            with connection:
+                connection.execute('DELETE FROM Answer')
+                connection.execute('UPDATE AnswerCacheGeneration SET generation = generation + 1 WHERE id = 0')
+            self._reset_copy(generation=None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._sync()
+            entries = int(np.count_nonzero(self._expires_at > time.time()))
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _get_connection(self):
+        if self._connection is None:
+            self._connection = open_connection(self._db_file)
+            with self._connection:
+                self._connection.execute('''CREATE TABLE IF NOT EXISTS Answer
+                             (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                              vector BLOB NOT NULL,
+                              answer TEXT NOT NULL,
+                              expires_at REAL NOT NULL)''')
+                # Single row. Is bumped, when the cache is cleared, so that workers drop their copies.
+                self._connection.execute('''CREATE TABLE IF NOT EXISTS AnswerCacheGeneration
+                             (id INTEGER PRIMARY KEY CHECK (id = 0),
+                              generation INTEGER NOT NULL)''')
+                self._connection.execute('INSERT OR IGNORE INTO AnswerCacheGeneration (id, generation) VALUES (0, 0)')
+        return self._connection
+
+    def _reset_copy(self, generation: Optional[int]):
+        self._generation = generation
+        self._last_id = 0
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._vectors: Optional[np.ndarray] = None
+        self._answers: List[str] = []
+        self._expires_at = np.zeros(0)
+
+    def _sync(self):
+        """
+        Brings the copy of this worker up to date with the database.
+        """
+        connection = self._get_connection()
+        with connection:
+            generation = connection.execute('SELECT generation FROM AnswerCacheGeneration WHERE id = 0').fetchone()[0]
+            if generation != self._generation:
+                self._reset_copy(generation)
+            rows = connection.execute('SELECT id, vector, answer, expires_at FROM Answer WHERE id > ? ORDER BY id',
+                                      (self._last_id,)).fetchall()
+        if not rows:
+            return
+
+        ids, vectors, answers, expires_at = zip(*rows)
+        vectors = np.stack([np.frombuffer(vector, dtype=np.float32) for vector in vectors])
+        self._ids = np.concatenate([self._ids, ids])
+        self._vectors = vectors if self._vectors is None else np.concatenate([self._vectors, vectors])
+        self._answers.extend(answers)
+        self._expires_at = np.concatenate([self._expires_at, expires_at])
+        self._last_id = ids[-1]
+
+        # Rows, evicted by their writers. Expired ones are skipped by lookups, until they are evicted here too.
+        keep = self._ids > self._last_id - self._max_entries
+        if not keep.all():
+            self._ids, self._vectors, self._expires_at = self._ids[keep], self._vectors[keep], self._expires_at[keep]
+            self._answers = [answer for answer, kept in zip(self._answers, keep) if kept]
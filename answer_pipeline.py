@@ -0,0 +1,204 @@
+import re
+import time
+from enum import Enum
+from typing import Dict, List, Optional
+
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+from langchain.docstore.document import Document
+from langchain.prompts.base import StringPromptValue
+from langchain.prompts.chat import ChatPromptValue
+from langchain.schema import BaseMessage, HumanMessage, LLMResult, PromptValue, SystemMessage
+
+from config import CONDENSE_MODE
+from metrics import LLM_CALLS, LLM_TOKENS, observe_stage
+from tokens import count_tokens
+
+ANSWER_INSTRUCTIONS = """Greet user with calling yourself "NiftyBridge AI assistant".
+Give answers only from the answer from vectorstore documents.
+You should not answer questions, that are not related to "Nifty Bridge" program, described in the document.
+In the case, that the answer is not provided within the context, say: "i don't know please contact with support by email support@nifty-bridge.com".
+"""  # noqa
+
+# Prompts are formatted by concatenation and str.format of templates, prepared once, instead of building
+# PromptTemplate (and validating it) on every request.
+_ANSWER_PREFIX = f"{ANSWER_INSTRUCTIONS}\nDocuments:\n"
+_DOCUMENT_SEPARATOR = "\n\n"
+_CONDENSE_TEMPLATE = CONDENSE_QUESTION_PROMPT.template
+_ROLE_PREFIXES = {"human": "Human: ", "ai": "Assistant: ", "system": "System: "}
+
+_WORD = re.compile(r"[\w']+")
+_FOLLOW_UP_WORDS = frozenset((
+    "it", "its", "it's", "this", "that", "these", "those", "they", "them", "their", "he", "she", "him", "her",
+    "one", "ones", "former", "latter", "above", "same", "else", "also", "more", "other",
+))
+_FOLLOW_UP_STARTS = ("and ", "but ", "also ", "so ", "then ", "what about ", "how about ", "why not")
+
+
+class CondenseMode(str, Enum):
+    NEVER = 'never'  # Retrieve with the question as is. The answer model still sees the chat history.
+    HEURISTIC = 'heuristic'  # Rephrase only questions, which look like follow-ups, see `looks_like_follow_up`.
+    ALWAYS = 'always'  # Rephrase every question, asked with chat history, as ConversationalRetrievalChain does.
+
+
+def looks_like_follow_up(question: str) -> bool:
+    """
+    :return: Whether the question may not be understood without the chat history: it is very short,
+             refers to something (it, that, them...), or continues the previous one (and..., what about...).
+    """
+    text = question.strip().lower()
+    words = _WORD.findall(text)
+    return len(words) < 4 or text.startswith(_FOLLOW_UP_STARTS) or any(word in _FOLLOW_UP_WORDS for word in words)
+
+
+def _text(result) -> str:
+    return result.generations[0][0].text
+
+
+def format_chat_history(chat_history: List[BaseMessage]) -> str:
+    """
+    :return: Chat history as text, a message per line, prefixed with its role, as ConversationalRetrievalChain
+             formats it for the condense prompt.
+    """
+    return "".join(f"\n{_ROLE_PREFIXES.get(message.type, f'{message.type}: ')}{message.content}"
+                   for message in chat_history)
+
+
+def record_llm_call(stage: str, model, prompt: PromptValue, result: LLMResult,
+                    usage: Optional[Dict[str, int]] = None) -> str:
+    """
+    Counts the model call and its tokens, as reported by the API. Streamed responses have no usage reported,
+    so their tokens are counted with the tokenizer.
+    :param usage: Tokens of the call are added to its "prompt_tokens" and "completion_tokens", if it is given.
+    :return: Text of the response.
+    """
+    text = _text(result)
+    reported = (result.llm_output or {}).get("token_usage") or {}
+    prompt_tokens = reported.get("prompt_tokens")
+    if prompt_tokens is None:
+        prompt_tokens = count_tokens(prompt.to_string())
+    completion_tokens = reported.get("completion_tokens")
+    if completion_tokens is None:
+        completion_tokens = count_tokens(text)
+
+    model_name = getattr(model, "model_name", None) or type(model).__name__
+    LLM_CALLS.inc(stage=stage, model=model_name)
+    LLM_TOKENS.inc(prompt_tokens, stage=stage, model=model_name, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, stage=stage, model=model_name, kind="completion")
+    if usage is not None:
+        usage["prompt_tokens"] += prompt_tokens
+        usage["completion_tokens"] += completion_tokens
+    return text
+
+
+class AnswerPipeline:
+    """
+    Retrieval and answer, with an optional rephrasing ("condensing") of the follow-up question first.
+
+    Unlike ConversationalRetrievalChain, it does not rephrase every follow-up question (which is an extra round-trip
+    to the model before retrieval), and gives the chat history to the answer model, so the answer model can
+    resolve references of follow-ups, which were not rephrased.
+
+    Is called as the chain: `pipeline(inputs)` or `await pipeline.acall(inputs, callbacks)`, with "question" and
+    "chat_history" inputs. Result has "answer", "source_documents", "question" (the one documents were retrieved
+    with), "timings" (seconds spent by stages: "condense", "retrieve" and "answer", also observed as metrics)
+    and "token_usage" ("prompt_tokens" and "completion_tokens" of both model calls).
+    Callbacks get tokens of the answer model only.
+    """
+
+    def __init__(self, retriever, answer_model, condense_model, condense_mode: CondenseMode = CONDENSE_MODE):
+        """
+        :param retriever:       Retriever of documents.
+        :param answer_model:    Chat model (or LLM) to answer with.
+        :param condense_model:  Chat model (or LLM) to rephrase follow-up questions with.
+        :param condense_mode:   When to rephrase follow-up questions.
+        """
+        self.retriever = retriever
+        self.answer_model = answer_model
+        self.condense_model = condense_model
+        self.condense_mode = CondenseMode(condense_mode)
+
+    def _condense_prompt(self, question: str, chat_history: List[BaseMessage]) -> Optional[StringPromptValue]:
+        """
+        :return: Prompt to rephrase the question with, or None, if the question is used as is.
+        """
+        if not chat_history or self.condense_mode == CondenseMode.NEVER:
+            return None
+        if self.condense_mode == CondenseMode.HEURISTIC and not looks_like_follow_up(question):
+            return None
+        return StringPromptValue(text=_CONDENSE_TEMPLATE.format(chat_history=format_chat_history(chat_history),
+                                                                question=question))
+
+    @staticmethod
+    def _answer_prompt(question: str, chat_history: List[BaseMessage], documents: List[Document]) -> ChatPromptValue:
+        context = _DOCUMENT_SEPARATOR.join(document.page_content for document in documents)
+        return ChatPromptValue(messages=[
+            SystemMessage(content=_ANSWER_PREFIX + context),
+            *chat_history,
+            HumanMessage(content=question),
+        ])
+
+    def __call__(self, inputs: dict, callbacks=None) -> dict:
+        run = _PipelineRun(self, inputs)
+        result = None
+        if run.condense_prompt is not None:
+            result = self.condense_model.generate_prompt([run.condense_prompt])
+        run.condensed(result)
+        run.retrieved(self.retriever.get_relevant_documents(run.retrieval_question))
+        return run.answered(self.answer_model.generate_prompt([run.answer_prompt], callbacks=callbacks))
+
+    async def acall(self, inputs: dict, callbacks=None) -> dict:
+        run = _PipelineRun(self, inputs)
+        result = None
+        if run.condense_prompt is not None:
+            result = await self.condense_model.agenerate_prompt([run.condense_prompt])
+        run.condensed(result)
+        run.retrieved(await self.retriever.aget_relevant_documents(run.retrieval_question))
+        return run.answered(await self.answer_model.agenerate_prompt([run.answer_prompt], callbacks=callbacks))
+
+
+class _PipelineRun:
+    """
+    One call of AnswerPipeline: its prompts, timings of the stages and token usage. Shared by the sync and the async
+    calls, which only call the models and the retriever, and pass the results here, stage by stage.
+    """
+
+    def __init__(self, pipeline: AnswerPipeline, inputs: dict):
+        self.pipeline = pipeline
+        self.question, self.chat_history = inputs["question"], inputs["chat_history"]
+        self.timings = {}
+        self.usage = {"prompt_tokens": 0, "completion_tokens": 0}
+        self._started_at = time.perf_counter()
+        self.condense_prompt = pipeline._condense_prompt(self.question, self.chat_history)
+        self.retrieval_question = self.question
+        self.documents: List[Document] = []
+        self.answer_prompt: Optional[ChatPromptValue] = None
+
+    def _finish_stage(self, stage: str):
+        now = time.perf_counter()
+        self.timings[stage] = now - self._started_at
+        self._started_at = now
+
+    def condensed(self, result: Optional[LLMResult]):
+        """
+        :param result: Response to `condense_prompt`, or None, if the question is used as is.
+        """
+        if result is not None:
+            self.retrieval_question = record_llm_call("condense", self.pipeline.condense_model, self.condense_prompt,
+                                                      result, self.usage).strip()
+        self._finish_stage("condense")
+
+    def retrieved(self, documents: List[Document]):
+        self.documents = documents
+        self._finish_stage("retrieve")
+        self.answer_prompt = self.pipeline._answer_prompt(self.question, self.chat_history, documents)
+
+    def answered(self, result: LLMResult) -> dict:
+        """
+        :return: Result of the pipeline.
+        """
+        answer = record_llm_call("answer", self.pipeline.answer_model, self.answer_prompt, result, self.usage)
+        self._finish_stage("answer")
+        for stage, seconds in self.timings.items():
+            observe_stage(stage, seconds)
+        return {"answer": answer, "source_documents": self.documents, "question": self.retrieval_question,
+                "timings": self.timings, "token_usage": self.usage}
@@ -0,0 +1,397 @@
+"""
+Endpoints of the assistant, and its state: the chain, caches, and connections to the database.
+Imports langchain (and everything it imports), which takes seconds, so main imports this module in the background,
+after the server has started, see main.warm_up.
+"""
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Tuple, Optional, AsyncIterator
+
+import numpy as np
+
+from app_types import OKResponse, BadRequestResponse, UnauthorizedResponse
+from config import USERS_API_KEYS_DB_FILE, CHAT_HISTORY_TRIM_POLICY, ANSWER_CACHE_ENABLED, COALESCE_QUESTIONS, \
+    PROFILING_HEADER, VECTOR_STORE_BACKEND
+from fastapi import APIRouter, Depends, Request, Header, HTTPException, status
+from fastapi.responses import StreamingResponse
+from http import HTTPStatus
+from langchain.schema import AIMessage, HumanMessage
+from answer_pipeline import ANSWER_INSTRUCTIONS, looks_like_follow_up
+from auth import ApiKeyCache, MISSING
+from chain_manager import ChainManager
+from coalescing import SingleFlight, normalize_question
+from db_pool import ConnectionPool
+from embedding_cache import CachedEmbeddings
+from concurrency import run_blocking, llm_semaphore, use_blocking_executor_by_default
+from history_trimming import TrimPolicy, SummaryCache, select_chat_history, add_summary
+from startup import Readiness
+from tokens import get_encoding, count_tokens
+from metrics import CallbackMetric, TimedIterator, registry, span, observe_stage, get_request_timings
+from utils import make_chain, make_embeddings, make_answer_cache, make_history_summarizer, agenerate_ai_response, \
+    astream_ai_response
+from db_services import get_user_id_by_api_key, iter_chat_history_newest_first, re_initialize_db, \
+    save_to_chat_history, get_api_keys_revision
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+# Shared by the answer cache and the retriever, so that their queries are batched together.
+embeddings = make_embeddings()
+answer_cache = make_answer_cache(embed=embeddings.embed_query) if ANSWER_CACHE_ENABLED else None
+chain_manager = ChainManager(chain_factory=partial(make_chain, embedding=embeddings),
+                             on_reload=answer_cache.clear if answer_cache else None)
+answer_flights = SingleFlight()
+history_summarizer = make_history_summarizer() if CHAT_HISTORY_TRIM_POLICY == TrimPolicy.SUMMARIZE else None
+summary_cache = SummaryCache()
+db_pool = ConnectionPool(USERS_API_KEYS_DB_FILE)
+
+
+def _initialize_db():
+    with db_pool.connection() as db_connection:
+        re_initialize_db(db_connection)
+
+
+def _get_user_id(api_key: str):
+    with db_pool.connection() as db_connection:
+        return get_user_id_by_api_key(db_connection, api_key)
+
+
+def _get_api_keys_revision() -> int:
+    with db_pool.connection() as db_connection:
+        return get_api_keys_revision(db_connection)
+
+
+api_key_cache = ApiKeyCache(lookup=_get_user_id, get_revision=_get_api_keys_revision)
+
+
+def _read_cache_counters() -> dict:
+    caches = {"api_key": api_key_cache}
+    if answer_cache is not None:
+        caches["answer"] = answer_cache
+    if isinstance(embeddings, CachedEmbeddings):
+        caches["embedding"] = embeddings
+    values = {}
+    for name, cache in caches.items():
+        values[(("cache", name), ("result", "hit"))] = cache.hits
+        values[(("cache", name), ("result", "miss"))] = cache.misses
+    return values
+
+
+registry.register(CallbackMetric("assistant_cache_lookups_total", "Lookups of caches: result is hit or miss.",
+                                 "counter", _read_cache_counters))
+registry.register(CallbackMetric(
+    "assistant_coalesced_requests_total",
+    "Requests, which generated the answer (leader), or got the answer of a concurrent one (follower).",
+    "counter", lambda: {(("role", "leader"),): answer_flights.leaders,
+                        (("role", "follower"),): answer_flights.followers}))
+
+
+def preload():
+    """
+    Loads read-only state, so that workers, forked by serve.py, share it instead of loading own copies.
+    """
+    get_encoding()
+    _initialize_db()
+    # sqlite3 connections must not be used by several processes, so workers open own ones.
+    db_pool.close()
+    # Chroma client runs a database with own threads, which do not survive fork, so workers load own chains then.
+    if VECTOR_STORE_BACKEND != 'chroma':
+        chain_manager.load()
+
+
+async def start(readiness: Readiness):
+    """
+    Warms up everything, the first request would wait for otherwise: the database schema, the tokenizer, and the
+    chain with its vector index (which may be preloaded already, see `preload`).
+    :param readiness: Steps of the warm-up are reported to it.
+    """
+    use_blocking_executor_by_default()
+    with readiness.step("database"):
+        await run_blocking(_initialize_db)
+    with readiness.step("tokenizer"):
+        await run_blocking(get_encoding)
+    with readiness.step("chain"):
+        await run_blocking(chain_manager.get_chain)
+
+
+def stop():
+    db_pool.close()
+
+
+def _load_limited_chat_history(user_id: int, question: str) -> Tuple[list, list]:
+    """
+    :return: Chat history, limited to fit the model, and messages to summarize, see `_add_summary`.
+    """
+    with db_pool.connection() as db_connection:
+        # History is read lazily, while it is limited, so the time of reading is split out.
+        recent_chat_history = TimedIterator(iter_chat_history_newest_first(db_connection, user_id))
+        started_at = time.perf_counter()
+        try:
+            return select_chat_history(question_tokens=count_tokens(question), recent_chat_history=recent_chat_history)
+        finally:
+            observe_stage("history_load", recent_chat_history.seconds)
+            observe_stage("history_limit", time.perf_counter() - started_at - recent_chat_history.seconds)
+
+
+def _save_to_chat_history(user_id: int, messages: list):
+    with span("history_save"), db_pool.connection() as db_connection:
+        save_to_chat_history(db_connection=db_connection, messages=messages, user_id=user_id)
+
+
+async def check_api_key(X_API_KEY_Token: str = Header(None, convert_underscores=True)):  # noqa.
+    with span("auth"):
+        user_id = api_key_cache.get_cached(X_API_KEY_Token)
+        if user_id is MISSING:
+            user_id = await run_blocking(api_key_cache.resolve, X_API_KEY_Token)
+
+    if user_id is None:
+        raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED)
+    return user_id
+
+
+def _is_shareable(request_question: str, limited_chat_history: list) -> bool:
+    """
+    :return: Whether the answer does not depend on the chat history, so it may be shared with other requests of the
+             question: by the answer cache, and by coalescing.
+    """
+    # Answer to a follow-up ("and the fees?") depends on the chat history, so it must not be given to other users.
+    # Users, who ask a standalone question, get the same answer, whether they have chat history or not.
+    return not limited_chat_history or not looks_like_follow_up(request_question)
+
+
+async def _get_cached_answer(request_question: str,
+                             limited_chat_history: list) -> Tuple[Optional[str], Optional[np.ndarray]]:
+    """
+    :return: Cached answer or None, and embedding of the question to cache the answer with (None, if the answer
+             must not be cached).
+    """
+    # Follow-ups are not even looked up, see `_is_shareable`.
+    if answer_cache is None or not _is_shareable(request_question, limited_chat_history):
+        return None, None
+    with span("answer_cache"):
+        return await run_blocking(answer_cache.get, request_question)
+
+
+@asynccontextmanager
+async def _llm_slot():
+    """
+    Holds one of MAX_CONCURRENT_LLM_REQUESTS slots. Time of waiting for it is the "llm_queue" stage.
+    """
+    with span("llm_queue"):
+        await llm_semaphore.acquire()
+    try:
+        yield
+    finally:
+        llm_semaphore.release()
+
+
+async def _add_summary(user_id: int, limited_chat_history: list, dropped_messages: list) -> list:
+    """
+    Summarizes messages, dropped from the chat history, unless they were summarized for the user already.
+    The model is called after the database connection is returned, and waits for its slot as other model calls.
+    :return: Chat history with the summary.
+    """
+    summary = summary_cache.get(user_id, dropped_messages)
+    if summary is None:
+        async with _llm_slot():
+            with span("summarize"):
+                summary = await run_blocking(history_summarizer, dropped_messages)
+        summary_cache.put(user_id, dropped_messages, summary)
+    return add_summary(limited_chat_history, summary)
+
+
+def _cache_answer(question_embedding: Optional[np.ndarray], ai_response: str):
+    # There is no embedding, if the answer must not be cached, see `_get_cached_answer`.
+    if question_embedding is not None:
+        answer_cache.put(question_embedding, ai_response)
+
+
+def _coalescing_key(request_question: str, limited_chat_history: list) -> Optional[str]:
+    """
+    :return: Key, by which concurrent requests of the same question share one answer, or None, if it is not shared.
+    """
+    # As with the answer cache, answers to follow-ups are not shared.
+    if not COALESCE_QUESTIONS or not _is_shareable(request_question, limited_chat_history):
+        return None
+    return normalize_question(request_question)
+
+
+async def _generate_answer(chain, request_question: str, limited_chat_history: list) -> str:
+    ai_response, question_embedding = await _get_cached_answer(request_question, limited_chat_history)
+    if ai_response is None:
+        async with _llm_slot():
+            ai_response = await agenerate_ai_response(
+                chain=chain,
+                question=request_question,
+                chat_history=limited_chat_history,
+            )
+        _cache_answer(question_embedding, ai_response)
+    return ai_response
+
+
+async def _prepare_request(request: Request, user_id: int) -> Tuple[str, list]:
+    """
+    :return: Question, and chat history, limited to fit the model.
+    """
+    data = await request.json()
+    request_question = data.get('message', None) if isinstance(data, dict) else None
+
+    # Message is counted in tokens and sent to the model as text, so anything else is rejected here.
+    if not isinstance(request_question, str) or not request_question.strip():
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST)
+
+    # Instructions are sent along with the question (see answer_pipeline.AnswerPipeline),
+    # so they take the token budget of the chat history too.
+    try:
+        limited_chat_history, dropped_messages = await run_blocking(_load_limited_chat_history, user_id,
+                                                                    ANSWER_INSTRUCTIONS + request_question)
+    except ValueError:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST,
+                            detail="The question is too long. Server not process this.")
+    if dropped_messages:
+        limited_chat_history = await _add_summary(user_id, limited_chat_history, dropped_messages)
+
+    return request_question, limited_chat_history
+
+
+@router.post(
+    "/api/send",
+    summary="Send a message to the AI assistant",
+    description="Send a message to the AI assistant and receive a response. The AI assistant will generate a"
+                " response based on the message and the chat history.",
+    tags=['/api/send'],
+    responses={
+        status.HTTP_200_OK: {
+            "description": "OK: The AI assistant successfully processed the message and generated a response.",
+            "model": OKResponse,
+        },
+        status.HTTP_400_BAD_REQUEST: {
+            "description": "Bad Request: The provided message is invalid or not found.",
+            "model": BadRequestResponse,
+        },
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "Unauthorized: The provided API key is invalid or not found.",
+            "model": UnauthorizedResponse,
+        },
+    },
+)
+async def send(request: Request, user_id: int = Depends(check_api_key)):
+    request_question, limited_chat_history = await _prepare_request(request, user_id)
+
+    chain = await run_blocking(chain_manager.get_chain)
+
+    # Concurrent requests of the same question wait for the answer of the first one.
+    ai_response = await answer_flights.run(_coalescing_key(request_question, limited_chat_history),
+                                           partial(_generate_answer, chain, request_question, limited_chat_history))
+
+    new_messages = [
+        HumanMessage(content=request_question),
+        AIMessage(content=ai_response),
+    ]
+
+    await run_blocking(_save_to_chat_history, user_id, new_messages)
+
+    # Return answer
+    return {"message": ai_response}
+
+
+def _sse_event(data: dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+@router.post(
+    "/api/send/stream",
+    summary="Send a message to the AI assistant and stream the response",
+    description="Same as /api/send, but the response is streamed with Server-Sent Events, as the AI assistant"
+                " generates it. Every `data` event holds the next piece of the answer in the `token` field."
+                " The final `end` event holds the whole answer in the `message` field. If generation fails,"
+                " `error` event is sent instead. If the request has the profiling header (`X-Profile: 1`), the"
+                " `end` event holds milliseconds, spent by the request in every stage, in the `timings` field.",
+    tags=['/api/send'],
+    responses={
+        status.HTTP_200_OK: {
+            "description": "OK: Stream of the response (text/event-stream).",
+        },
+        status.HTTP_400_BAD_REQUEST: {
+            "description": "Bad Request: The provided message is invalid or not found.",
+            "model": BadRequestResponse,
+        },
+        status.HTTP_401_UNAUTHORIZED: {
+            "description": "Unauthorized: The provided API key is invalid or not found.",
+            "model": UnauthorizedResponse,
+        },
+    },
+)
+async def send_stream(request: Request, user_id: int = Depends(check_api_key)):
+    request_question, limited_chat_history = await _prepare_request(request, user_id)
+
+    chain = await run_blocking(chain_manager.get_chain)
+
+    coalescing_key = _coalescing_key(request_question, limited_chat_history)
+    profile = request.headers.get(PROFILING_HEADER, "0") not in ("", "0")
+    timings = get_request_timings() or {}
+
+    async def event_stream() -> AsyncIterator[str]:
+        # If the same question is being answered for another request, its answer is sent at once, when it is ready.
+        ai_response = await answer_flights.wait(coalescing_key)
+        if ai_response is not None:
+            yield _sse_event({"token": ai_response})
+        else:
+            with answer_flights.lead(coalescing_key) as flight:
+                ai_response, question_embedding = await _get_cached_answer(request_question, limited_chat_history)
+                if ai_response is not None:
+                    yield _sse_event({"token": ai_response})
+                else:
+                    tokens = []
+                    try:
+                        async with _llm_slot():
+                            async for token in astream_ai_response(
+                                chain=chain,
+                                question=request_question,
+                                chat_history=limited_chat_history,
+                            ):
+                                tokens.append(token)
+                                yield _sse_event({"token": token})
+                    except Exception:
+                        logger.exception("Failed to stream the response")
+                        yield _sse_event({"detail": "Failed to generate the response."}, event="error")
+                        return
+
+                    ai_response = "".join(tokens)
+                    _cache_answer(question_embedding, ai_response)
+                flight.set_result(ai_response)
+
+        new_messages = [
+            HumanMessage(content=request_question),
+            AIMessage(content=ai_response),
+        ]
+        await run_blocking(_save_to_chat_history, user_id, new_messages)
+
+        end = {"message": ai_response}
+        if profile:
+            # Server-Timing header was sent before the answer was generated, so the whole breakdown is here.
+            end["timings"] = {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()}
+        yield _sse_event(end, event="end")
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get(
+    "/api/cache/stats",
+    summary="Statistics of the answer cache",
+    description="Number of cached answers, hits, misses and hit rate of the semantic answer cache, and numbers of"
+                " requests, which generated the answer (leaders), and which got the answer of a concurrent request"
+                " of the same question (followers).",
+    tags=['/api/cache'],
+)
+async def answer_cache_stats():
+    coalescing = {"coalescing": answer_flights.stats()}
+    if answer_cache is None:
+        return {"enabled": False, **coalescing}
+    return {"enabled": True, **answer_cache.stats(), **coalescing}
+
@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from config import API_KEY_CACHE_TTL, API_KEY_CACHE_MAX_SIZE, API_KEY_REVISION_CHECK_INTERVAL
+
+MISSING = object()
+
+
+class ApiKeyCache:
+    """
+    TTL/LRU cache of API key -> user id.
+
+    Unknown keys are cached as well, so repeated requests with a wrong key do not reach the database.
+    Whole cache is dropped, when revision of API keys changes (keys are registered or revoked),
+    so that changes made by user_api_key_registrator.py are noticed within `revision_check_interval`.
+    """
+
+    def __init__(self,
+                 lookup: Callable[[str], Optional[int]],
+                 get_revision: Callable[[], int],
+                 ttl: float = API_KEY_CACHE_TTL,
+                 max_size: int = API_KEY_CACHE_MAX_SIZE,
+                 revision_check_interval: float = API_KEY_REVISION_CHECK_INTERVAL):
+        """
+        :param lookup:                      Blocking function, that finds user id by API key in the database.
+        :param get_revision:                Blocking function, that reads current revision of API keys.
+        :param ttl:                         Seconds, for which resolved key is kept.
+        :param max_size:                    Maximum number of cached keys. Least recently used are evicted.
+        :param revision_check_interval:     How often (in seconds) revision of API keys is checked.
+        """
+        self._lookup = lookup
+        self._get_revision = get_revision
+        self._ttl = ttl
+        self._max_size = max_size
+        self._revision_check_interval = revision_check_interval
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()  # API key -> (user id, expires at)
+        self._revision: Optional[int] = None
+        self._next_revision_check_at = 0.0
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_cached(self, api_key: str):
+        """
+        Non-blocking lookup, safe to call from the event loop.
+        :return: Cached user id (None for unknown key), or MISSING if `resolve` should be called.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_revision_check_at:
+                return MISSING
+
+            entry = self._entries.get(api_key)
+            if entry is None or entry[1] <= now:
+                return MISSING
+
+            self._entries.move_to_end(api_key)
+            self.hits += 1
+            return entry[0]
+
+    def resolve(self, api_key: str) -> Optional[int]:
+        """
+        Blocking lookup. Checks revision of API keys, if it is time to, and queries the database on cache miss.
+        :return: User id, or None for unknown key.
+        """
+        self._check_revision()
+
+        user_id = self.get_cached(api_key)
+        if user_id is not MISSING:
+            return user_id
+
+        user_id = self._lookup(api_key)
+        with self._lock:
+            self.misses += 1
+            self._entries[api_key] = (user_id, time.monotonic() + self._ttl)
+            self._entries.move_to_end(api_key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+        return user_id
+
+    def invalidate(self):
+        """
+        Drops all cached keys.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def _check_revision(self):
+        if time.monotonic() < self._next_revision_check_at:
+            return
+
+        revision = self._get_revision()
+        with self._lock:
+            if revision != self._revision:
+                self._entries.clear()
+                self._revision = revision
+            self._next_revision_check_at = time.monotonic() + self._revision_check_interval
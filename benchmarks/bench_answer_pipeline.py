@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Compares ConversationalRetrievalChain (rephrases every follow-up question, then retrieves and answers) with
+answer_pipeline.AnswerPipeline in every condense mode, on a conversation of standalone and follow-up questions.
+Models are fake_models.FakeChatModel, which answers after a fixed delay, so the numbers show round-trips saved, not model quality.
+Reports model calls and mean time of every stage per question.
+
+Run from the repository root: `python -m benchmarks.bench_answer_pipeline --model-latency 0.3 --turns 40`
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+from langchain.chains import ConversationalRetrievalChain, LLMChain
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+from langchain.chains.question_answering import load_qa_chain
+from langchain.docstore.document import Document
+from langchain.schema import AIMessage, HumanMessage, BaseRetriever
+
+from answer_pipeline import AnswerPipeline, CondenseMode
+from fake_models import FakeChatModel
+
+QUESTIONS = [
+    "What are the fees of the Nifty Bridge card?",
+    "Can I avoid them?",
+    "How do I close my account?",
+    "What happens to my balance then?",
+    "Is my personal information shared with third parties?",
+    "And with the bank?",
+    "How are disputes between members and Nifty Bridge resolved?",
+    "How long does a refund take?",
+]
+
+
+class StaticRetriever(BaseRetriever):
+    def get_relevant_documents(self, query: str) -> List[Document]:
+        return [Document(page_content=f"Chunk {i} of the terms of service.") for i in range(4)]
+
+    async def aget_relevant_documents(self, query: str) -> List[Document]:
+        return self.get_relevant_documents(query)
+
+
+def make_old_chain(model: FakeChatModel) -> ConversationalRetrievalChain:
+    # As utils.make_chain built it before the answer pipeline.
+    return ConversationalRetrievalChain(
+        retriever=StaticRetriever(),
+        combine_docs_chain=load_qa_chain(model, chain_type="stuff"),
+        question_generator=LLMChain(llm=model, prompt=CONDENSE_QUESTION_PROMPT),
+        return_source_documents=True
+    )
+
+
+async def run_conversation(chain, turns: int) -> List[dict]:
+    chat_history = []
+    results = []
+    for turn in range(turns):
+        question = QUESTIONS[turn % len(QUESTIONS)]
+        started_at = time.perf_counter()
+        result = await chain.acall({"question": question, "chat_history": chat_history})
+        results.append({"total": time.perf_counter() - started_at, **result.get("timings", {})})
+        chat_history = chat_history[-4:] + [HumanMessage(content=question), AIMessage(content=result["answer"])]
+    return results
+
+
+def report(name: str, results: List[dict], calls: int):
+    def mean_ms(stage: str) -> str:
+        values = [result[stage] for result in results if stage in result]
+        return f"{statistics.mean(values) * 1000:>9.1f}" if values else f"{'-':>9}"
+
+    print(f"{name:>18} {calls / len(results):>12.2f} {mean_ms('condense')} {mean_ms('retrieve')} "
+          f"{mean_ms('answer')} {mean_ms('total')}")
+
+
+def main(args):
+    print(f"{args.turns} turns, model latency {args.model_latency * 1000:.0f} ms")
+    print(f"{'pipeline':>18} {'calls/turn':>12} {'condense':>9} {'retrieve':>9} {'answer':>9} {'total':>9}  (ms)")
+
+    model = FakeChatModel(latency=args.model_latency)
+    report("conversational", asyncio.run(run_conversation(make_old_chain(model), args.turns)), model.calls)
+
+    for mode in CondenseMode:
+        model = FakeChatModel(latency=args.model_latency)
+        pipeline = AnswerPipeline(retriever=StaticRetriever(), answer_model=model, condense_model=model,
+                                  condense_mode=mode)
+        report(f"pipeline {mode.value}", asyncio.run(run_conversation(pipeline, args.turns)), model.calls)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model-latency', type=float, default=0.3, help='Seconds per model call')
+    parser.add_argument('--turns', type=int, default=40)
+    main(parser.parse_args())
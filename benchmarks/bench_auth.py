@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Measures authentication overhead per request: the old path (new connection, schema re-initialization
+and key query on every request) against ApiKeyCache hits and misses.
+
+Run from the repository root: `python -m benchmarks.bench_auth --requests 10000`
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from auth import ApiKeyCache
+from db_services import re_initialize_db, register_new_api_key, get_user_id_by_api_key, get_api_keys_revision
+
+
+def measure(name: str, func, requests: int):
+    started_at = time.perf_counter()
+    for _ in range(requests):
+        func()
+    elapsed = time.perf_counter() - started_at
+    print(f"{name:<36} {elapsed / requests * 1e6:10.2f} us/request")
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as work_dir:
+        db_file = os.path.join(work_dir, 'users.sqlite3')
+        with sqlite3.connect(db_file) as db_connection:
+            re_initialize_db(db_connection)
+            keys = [register_new_api_key(db_connection) for _ in range(args.users)]
+        key = keys[-1]
+
+        def uncached_with_schema_init():
+            with sqlite3.Connection(db_file) as db_connection:
+                re_initialize_db(db_connection)
+                get_user_id_by_api_key(db_connection, key)
+
+        def lookup(api_key: str):
+            with sqlite3.Connection(db_file) as db_connection:
+                return get_user_id_by_api_key(db_connection, api_key)
+
+        def get_revision() -> int:
+            with sqlite3.Connection(db_file) as db_connection:
+                return get_api_keys_revision(db_connection)
+
+        cache = ApiKeyCache(lookup=lookup, get_revision=get_revision)
+        cache.resolve(key)
+        no_cache = ApiKeyCache(lookup=lookup, get_revision=get_revision, ttl=0, revision_check_interval=0)
+
+        print(f"{args.requests} requests, {args.users} registered users")
+        measure("old: connect + schema init + query", uncached_with_schema_init, args.requests)
+        measure("cache miss: connect + query", lambda: no_cache.resolve(key), args.requests)
+        measure("cache hit", lambda: cache.get_cached(key), args.requests)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark API key authentication overhead')
+    parser.add_argument('--requests', type=int, default=10000, help='Number of simulated requests')
+    parser.add_argument('--users', type=int, default=1000, help='Number of registered users')
+
+    main(parser.parse_args())
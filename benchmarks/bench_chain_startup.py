@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Compares cost of building the retrieval chain for every request (old behaviour of /api/send)
+with getting it from ChainManager, which builds it once at startup.
+
+No requests to OpenAI are made: only the chain construction is measured.
+Run from the repository root: `python -m benchmarks.bench_chain_startup --requests 50`
+"""
+import argparse
+import os
+import statistics
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from chain_manager import ChainManager  # noqa: E402
+from utils import make_chain  # noqa: E402
+
+
+def measure(get_chain, requests: int) -> list:
+    timings = []
+    for _ in range(requests):
+        started_at = time.perf_counter()
+        get_chain()
+        timings.append(time.perf_counter() - started_at)
+    return timings
+
+
+def report(name: str, timings: list):
+    print(f"{name:<28} mean {statistics.mean(timings) * 1000:9.3f} ms   "
+          f"max {max(timings) * 1000:9.3f} ms   total {sum(timings) * 1000:9.1f} ms")
+
+
+def main(args):
+    per_request = measure(make_chain, args.requests)
+
+    manager = ChainManager(chain_factory=make_chain)
+    started_at = time.perf_counter()
+    manager.load()
+    startup = time.perf_counter() - started_at
+    shared = measure(manager.get_chain, args.requests)
+
+    print(f"{args.requests} requests")
+    report("make_chain() per request", per_request)
+    print(f"{'ChainManager startup':<28} {startup * 1000:14.3f} ms")
+    report("ChainManager.get_chain()", shared)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark retrieval chain setup cost')
+    parser.add_argument('--requests', type=int, default=50, help='Number of simulated requests')
+
+    main(parser.parse_args())
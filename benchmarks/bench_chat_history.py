@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Compares loading of the chat history for a request, for users with long histories:
+full load (load_chat_history + limit_tokens_for_request) against windowed load
+(iter_chat_history_newest_first + limit_recent_chat_history), which stops once the token budget is full
+and uses token counts, stored with the messages, instead of encoding them again.
+
+Run from the repository root: `python -m benchmarks.bench_chat_history --messages 10000 20000`
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from db_pool import open_connection
+from db_services import re_initialize_db, register_new_api_key, get_user_id_by_api_key, load_chat_history, \
+    iter_chat_history_newest_first
+from tokens import count_tokens
+from utils import limit_tokens_for_request, limit_recent_chat_history
+
+QUESTION = "What are the fees of Nifty Bridge program?"
+MESSAGE = "This is one of many messages of the long discussion with the assistant about Nifty Bridge terms. " * 3
+
+
+def fill_history(db_connection, user_id: int, messages: int):
+    texts = [f"{i}. {MESSAGE}" for i in range(messages)]
+    with db_connection:
+        db_connection.executemany(
+            "INSERT INTO Message (user_id, sender, text, token_count) VALUES (?, ?, ?, ?)",
+            ((user_id, 'user' if i % 2 == 0 else 'AI', text, count_tokens(text)) for i, text in enumerate(texts))
+        )
+
+
+def measure(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started_at)
+    return statistics.median(timings)
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as work_dir:
+        db_connection = open_connection(os.path.join(work_dir, 'users.sqlite3'))
+        re_initialize_db(db_connection)
+
+        print(f"{'messages':>9} {'full load, ms':>14} {'full + limit, ms':>17} "
+              f"{'windowed + limit, ms':>21} {'kept':>5}")
+        for messages in args.messages:
+            user_id = get_user_id_by_api_key(db_connection, register_new_api_key(db_connection))
+            fill_history(db_connection, user_id, messages)
+
+            def full():
+                chat_history = load_chat_history(db_connection, user_id)
+                return limit_tokens_for_request(question=QUESTION, chat_history=chat_history)
+
+            def windowed():
+                recent_chat_history = iter_chat_history_newest_first(db_connection, user_id)
+                return limit_recent_chat_history(question=QUESTION, recent_chat_history=recent_chat_history)
+
+            kept = len(windowed())
+            full_load = measure(lambda: load_chat_history(db_connection, user_id), args.repeat)
+            full_limited = measure(full, args.repeat)
+            windowed_limited = measure(windowed, args.repeat)
+
+            print(f"{messages:>9} {full_load * 1000:>14.2f} {full_limited * 1000:>17.2f} "
+                  f"{windowed_limited * 1000:>21.2f} {kept:>5}")
+
+        db_connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark chat history loading for long-lived users')
+    parser.add_argument('--messages', type=int, nargs='+', default=[1000, 10000, 50000],
+                        help='History lengths to test')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetitions per measurement')
+
+    main(parser.parse_args())
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Compares the old splitter (utils.iter_text_chunks: every page on its own, 2048 characters) with the token-aware
+cross-page chunker (chunking.iter_token_chunks): number of chunks, their sizes in tokens, utilisation of
+the token budget of a chunk (CHUNK_TOKENS), and time.
+
+Pages are synthetic (see benchmarks/synthetic_pdf.py), or are read from a PDF with `--pdf`.
+Needs tiktoken encoding of the chat model (downloaded on first use).
+
+Run from the repository root: `python -m benchmarks.bench_chunking --pages 2000`
+"""
+import argparse
+import random
+import statistics
+import time
+
+from app_types import PageData
+from benchmarks.synthetic_pdf import page_lines
+from chunking import iter_token_chunks
+from config import CHUNK_TOKENS
+from text_cleaning import clean_page_text
+from tokens import count_tokens_batch
+from utils import iter_text_chunks
+
+
+def synthetic_pages(pages: int):
+    rng = random.Random(0)
+    return [PageData(num=num, text=clean_page_text("\n".join(page_lines(num, rng)))) for num in range(pages)]
+
+
+def pdf_pages(file_path: str):
+    import pdfplumber
+    from persist_document import iter_pages_from_pdf
+
+    with pdfplumber.open(file_path) as pdf:
+        return [PageData(num=page.num, text=clean_page_text(page.text)) for page in iter_pages_from_pdf(pdf)]
+
+
+def main(args):
+    pages = pdf_pages(args.pdf) if args.pdf else synthetic_pages(args.pages)
+    print(f"{len(pages)} pages, chunk budget {CHUNK_TOKENS} tokens")
+
+    modes = {
+        "characters": lambda: list(iter_text_chunks(pages, {})),
+        "tokens": lambda: list(iter_token_chunks(pages, {})),
+    }
+    print(f"{'mode':>11} {'chunks':>7} {'ms':>8} {'pages/s':>8} {'mean tok':>9} {'max tok':>8} "
+          f"{'utilisation':>12} {'over budget':>12}")
+    for mode, make_chunks in modes.items():
+        timings = []
+        for _ in range(args.repeat):
+            started_at = time.perf_counter()
+            chunks = make_chunks()
+            timings.append(time.perf_counter() - started_at)
+        seconds = statistics.median(timings)
+
+        sizes = count_tokens_batch([chunk.page_content for chunk in chunks])
+        mean = statistics.mean(sizes)
+        over_budget = sum(size > CHUNK_TOKENS for size in sizes)
+        print(f"{mode:>11} {len(chunks):>7} {seconds * 1000:>8.1f} {len(pages) / seconds:>8.0f} {mean:>9.1f} "
+              f"{max(sizes):>8} {mean / CHUNK_TOKENS:>11.0%} {over_budget:>12}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--pdf', help='Take pages of this PDF, instead of synthetic ones')
+    parser.add_argument('--repeat', type=int, default=3)
+    main(parser.parse_args())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Cold start of the server: import time, and time to the first response, against the local stub of OpenAI API
+(see stub_openai_server.py).
+
+Import time is measured in fresh processes: of main (the app, which imports the assistant in the background),
+and of assistant_api (everything, main imported before).
+Time to the first response is measured from the start of the server process, which is started:
+- lazily, with `uvicorn main:app`: it accepts connections at once, and warms up in the background;
+- eagerly, with `serve.py --workers 1 --preload`: it loads everything, before it accepts connections.
+The first /api/send is sent as soon as the port accepts connections, so it waits for the warm-up either way;
+then it takes the cold path of the first request: the first retrieval, model call and history write.
+
+Run from the repository root: `python -m benchmarks.bench_cold_start --runs 5`
+"""
+import argparse
+import json
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.load_test_send import free_port, start_stub_server, make_server_env, seed
+
+IMPORT_SCRIPT = """
+import time
+started_at = time.perf_counter()
+import {module}
+print(time.perf_counter() - started_at)
+"""
+
+SERVER_COMMANDS = {
+    "lazy": [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--log-level', 'warning',
+             '--port'],
+    "eager": [sys.executable, 'serve.py', '--workers', '1', '--preload', '--host', '127.0.0.1', '--log-level',
+              'warning', '--port'],
+}
+
+
+def measure_import(module: str, env: dict) -> float:
+    output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT.format(module=module)], env=env, check=True,
+                            capture_output=True, text=True)
+    return float(output.stdout)
+
+
+def wait_for_port(port: int, started_at: float, timeout: float = 60.0) -> float:
+    """
+    :return: Seconds since `started_at`, when the port accepted a connection.
+    """
+    while time.perf_counter() - started_at < timeout:
+        with socket.socket() as sock:
+            if sock.connect_ex(('127.0.0.1', port)) == 0:
+                return time.perf_counter() - started_at
+        time.sleep(0.005)
+    raise TimeoutError(f"Nothing listens on port {port}")
+
+
+def post(url: str, data: dict, headers: dict) -> int:
+    request = urllib.request.Request(url, data=json.dumps(data).encode(),
+                                     headers={"Content-Type": "application/json", **headers})
+    with urllib.request.urlopen(request, timeout=120) as response:
+        response.read()
+        return response.status
+
+
+def measure_first_response(mode: str, env: dict, api_key: str) -> dict:
+    port = free_port()
+    started_at = time.perf_counter()
+    server = subprocess.Popen(SERVER_COMMANDS[mode] + [str(port)], env=env)
+    try:
+        accepting = wait_for_port(port, started_at)
+        status = post(f"http://127.0.0.1:{port}/api/send", {"message": "What is clause 1?"},
+                      {"X-API-KEY-Token": api_key})
+        first_response = time.perf_counter() - started_at
+        assert status == 200, f"/api/send answered {status}"
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz") as response:
+            steps = json.loads(response.read())["steps"]
+    finally:
+        server.terminate()
+        server.wait()
+    return {"accepting": accepting, "first_response": first_response, "steps": steps}
+
+
+def main(args):
+    stub_port = free_port()
+    stub = start_stub_server(stub_port, args.chat_latency, args.embedding_latency)
+
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            env = make_server_env(work_dir, stub_port, VECTOR_STORE_BACKEND=args.backend)
+            api_keys = seed(env, users=1)
+
+            print(f"Import time, median of {args.runs} runs")
+            for module in ("main", "assistant_api"):
+                timings = [measure_import(module, env) for _ in range(args.runs)]
+                print(f"  import {module:<15} {statistics.median(timings) * 1000:9.1f} ms")
+
+            print(f"Time since start of the server process, median of {args.runs} runs")
+            print(f"  {'mode':<6} {'accepting, ms':>14} {'first response, ms':>19}  warm-up steps (last run), ms")
+            for mode in args.modes:
+                results = [measure_first_response(mode, env, api_keys[0]) for _ in range(args.runs)]
+                accepting = statistics.median(result["accepting"] for result in results)
+                first_response = statistics.median(result["first_response"] for result in results)
+                print(f"  {mode:<6} {accepting * 1000:>14.1f} {first_response * 1000:>19.1f}  {results[-1]['steps']}")
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='Runs of every measurement')
+    parser.add_argument('--modes', nargs='+', choices=sorted(SERVER_COMMANDS), default=['lazy', 'eager'],
+                        help='How to start the server')
+    parser.add_argument('--backend', choices=['chroma', 'numpy'], default='numpy', help='VECTOR_STORE_BACKEND')
+    parser.add_argument('--chat-latency', type=float, default=0.2, help='Seconds per stub chat completion')
+    parser.add_argument('--embedding-latency', type=float, default=0.02, help='Seconds per stub embeddings call')
+    main(parser.parse_args())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Measures chat history write throughput with many simultaneous users.
+
+"ad hoc" is the old behaviour: new connection with default journal per operation, and two commits
+(add_user_message + add_ai_message) per exchange. "pool" uses ConnectionPool (WAL, tuned pragmas)
+and save_to_chat_history, which writes the exchange in a single transaction.
+
+Run from the repository root: `python -m benchmarks.bench_db_writes --users 32 --exchanges 50`
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain.schema import HumanMessage, AIMessage
+
+from db_pool import ConnectionPool
+from db_services import re_initialize_db, register_new_api_key, get_user_id_by_api_key, add_user_message, \
+    add_ai_message, save_to_chat_history
+
+ANSWER = "This is the answer of the assistant. " * 20
+
+
+def prepare_db(db_file: str, users: int) -> list:
+    with sqlite3.connect(db_file) as db_connection:
+        re_initialize_db(db_connection)
+        keys = [register_new_api_key(db_connection) for _ in range(users)]
+        return [get_user_id_by_api_key(db_connection, key) for key in keys]
+
+
+def ad_hoc_exchange(db_file: str, user_id: int):
+    with sqlite3.Connection(db_file) as db_connection:
+        add_user_message(db_connection, user_id, "What is Nifty Bridge?")
+        add_ai_message(db_connection, user_id, ANSWER)
+    db_connection.close()
+
+
+def pooled_exchange(pool: ConnectionPool, user_id: int):
+    with pool.connection() as db_connection:
+        save_to_chat_history(db_connection,
+                             [HumanMessage(content="What is Nifty Bridge?"), AIMessage(content=ANSWER)],
+                             user_id)
+
+
+def run(exchange, user_ids: list, exchanges: int, threads: int) -> float:
+    def user_session(user_id: int):
+        for _ in range(exchanges):
+            exchange(user_id)
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(user_session, user_ids))
+    elapsed = time.perf_counter() - started_at
+
+    return len(user_ids) * exchanges / elapsed
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as work_dir:
+        ad_hoc_db = os.path.join(work_dir, 'ad_hoc.sqlite3')
+        user_ids = prepare_db(ad_hoc_db, args.users)
+        ad_hoc = run(lambda user_id: ad_hoc_exchange(ad_hoc_db, user_id), user_ids, args.exchanges, args.users)
+
+        pooled_db = os.path.join(work_dir, 'pooled.sqlite3')
+        user_ids = prepare_db(pooled_db, args.users)
+        pool = ConnectionPool(pooled_db, size=args.pool_size)
+        pooled = run(lambda user_id: pooled_exchange(pool, user_id), user_ids, args.exchanges, args.users)
+        pool.close()
+
+    print(f"{args.users} simultaneous users, {args.exchanges} exchanges each")
+    print(f"{'ad hoc connections':<24} {ad_hoc:10.1f} exchanges/s")
+    print(f"{'pool (WAL)':<24} {pooled:10.1f} exchanges/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark chat history write throughput')
+    parser.add_argument('--users', type=int, default=32, help='Number of simultaneous users')
+    parser.add_argument('--exchanges', type=int, default=50, help='Exchanges (question + answer) per user')
+    parser.add_argument('--pool-size', type=int, default=8, help='Size of the connection pool')
+
+    main(parser.parse_args())
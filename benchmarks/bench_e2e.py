@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark suite, which runs offline: models are deterministic fakes with configurable latency
+(MODEL_BACKEND=fake, see fake_models.py), everything else does its real work. Phases:
+- ingest: persist_document.py persists synthetic PDFs (parsing, chunking, embedding, vector store, lexical index);
+- seed: synthetic users are registered, and part of them get chat histories;
+- startup: the app (main.py) is started by uvicorn in this process, and warms up (langchain is imported by then
+  already: see bench_cold_start.py for the cold start);
+- send and stream: concurrent clients ask /api/send and /api/send/stream questions, as the users. Requests are sent
+  with X-Profile, so the server reports time of every stage of every request (Server-Timing header, and `timings`
+  of the `end` event of the stream).
+
+Reports p50/p95/p99 latency of requests and of their stages, throughput, and memory (RSS) after every phase.
+Clients run in the same process (and event loop) as the server, so absolute numbers are lower, than of a dedicated
+server: compare runs with each other. Results are written as JSON with --output. With --compare, they are compared
+with the results of an earlier run (e.g. of the previous release), and metrics, which got worse by more than
+--threshold, are reported as regressions, with exit status 1.
+
+The tokenizer is not faked: tiktoken downloads its encoding on the first run, and caches it (TIKTOKEN_CACHE_DIR).
+
+Run from the repository root: `python -m benchmarks.bench_e2e --output baseline.json`,
+and after changes: `python -m benchmarks.bench_e2e --compare baseline.json`
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from benchmarks.load_test_send import free_port
+from benchmarks.synthetic_pdf import write_pdf, WORDS
+
+RESULTS_VERSION = 1
+FOLLOW_UPS = ["Can I avoid it?", "What happens then?", "And how long does it take?", "Is it the same for members?"]
+LOWER_IS_BETTER = ("_ms", "_mb", "seconds", "errors")
+HIGHER_IS_BETTER = ("_rps", "per_second")
+
+
+def configure(work_dir: str, args):
+    """
+    Settings are read from the environment, when config is imported, so this is done before importing the server.
+    """
+    os.environ.update({
+        "MODEL_BACKEND": "fake",
+        "OPENAI_API_KEY": "sk-fake",
+        "FAKE_CHAT_LATENCY": str(args.chat_latency),
+        "FAKE_EMBEDDING_LATENCY": str(args.embedding_latency),
+        "VECTOR_STORE_BACKEND": args.backend,
+        "VECTOR_STORE_PATH": os.path.join(work_dir, 'store'),
+        "USERS_API_KEYS_DB_FILE": os.path.join(work_dir, 'users.sqlite3'),
+        "EMBEDDING_CACHE_DB_FILE": os.path.join(work_dir, 'embeddings.sqlite3'),
+        "ANSWER_CACHE_DB_FILE": os.path.join(work_dir, 'answers.sqlite3'),
+        "MAX_CONCURRENT_LLM_REQUESTS": str(args.concurrency),
+    })
+
+
+def memory() -> dict:
+    """
+    :return: Current and peak RSS of this process, in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux.
+    try:
+        with open('/proc/self/statm') as file:
+            current = int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        current = peak
+    return {"rss_mb": round(current, 1), "peak_rss_mb": round(peak, 1)}
+
+
+def percentiles(values: List[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def nearest_rank(q: float) -> float:
+        return round(values[max(0, int(round(q * len(values))) - 1)], 2)
+
+    return {"count": len(values), "p50": nearest_rank(0.5), "p95": nearest_rank(0.95), "p99": nearest_rank(0.99),
+            "mean": round(sum(values) / len(values), 2)}
+
+
+def ingest(work_dir: str, args) -> dict:
+    import persist_document
+
+    files = []
+    for i in range(args.pdfs):
+        files.append(os.path.join(work_dir, f'terms-{i}.pdf'))
+        write_pdf(files[-1], pages=args.pages, seed=i)
+
+    before = memory()
+    started_at = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        persist_document.main(argparse.Namespace(paths=files, workers=args.ingestion_workers,
+                                                 batch_size=persist_document.EMBEDDING_BATCH_SIZE,
+                                                 max_concurrent_embeddings=args.concurrency))
+    seconds = time.perf_counter() - started_at
+
+    from utils import make_vector_store, make_embeddings
+    chunks = len(make_vector_store(make_embeddings()).get()['ids'])
+    after = memory()
+    return {
+        "seconds": round(seconds, 3),
+        "pages_per_second": round(args.pdfs * args.pages / seconds, 1),
+        "chunks": chunks,
+        "chunks_per_second": round(chunks / seconds, 1),
+        "rss_growth_mb": round(after["rss_mb"] - before["rss_mb"], 1),
+        # Parsing is done in worker processes.
+        "workers_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        **after,
+    }
+
+
+def seed(args) -> List[str]:
+    """
+    Registers users. Every user, but one in --history-every, gets --history-messages messages of chat history.
+    :return: API keys of the users.
+    """
+    from langchain.schema import HumanMessage, AIMessage
+    from config import USERS_API_KEYS_DB_FILE
+    from db_services import re_initialize_db, register_new_api_key, get_user_id_by_api_key, save_to_chat_history
+
+    rng = random.Random(args.seed)
+    api_keys = []
+    with contextlib.closing(sqlite3.connect(USERS_API_KEYS_DB_FILE)) as db_connection:
+        re_initialize_db(db_connection)
+        for user in range(args.users):
+            api_key = register_new_api_key(db_connection)
+            api_keys.append(api_key)
+            if args.history_every and user % args.history_every == 0:
+                continue
+            user_id = get_user_id_by_api_key(db_connection, api_key)
+            messages = [(HumanMessage if i % 2 == 0 else AIMessage)(
+                content=" ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 60))))
+                for i in range(args.history_messages)]
+            save_to_chat_history(db_connection, messages, user_id)
+    return api_keys
+
+
+def make_workload(args, users: int) -> List[tuple]:
+    """
+    :return: (user, question) of every request. The same for the same --seed.
+    """
+    rng = random.Random(args.seed)
+    questions = [f"What do the terms say about {rng.choice(WORDS)} and {rng.choice(WORDS)} in section {i + 1}?"
+                 for i in range(args.distinct_questions)]
+    workload = []
+    for _ in range(args.requests):
+        question = rng.choice(FOLLOW_UPS) if rng.random() < args.follow_up_share else rng.choice(questions)
+        workload.append((rng.randrange(users), question))
+    return workload
+
+
+def parse_server_timing(value: str) -> Dict[str, float]:
+    timings = {}
+    for item in value.split(","):
+        name, _, duration = item.strip().partition(";dur=")
+        if duration:
+            timings[name] = float(duration)
+    return timings
+
+
+async def request_send(session: aiohttp.ClientSession, url: str, question: str, headers: dict) -> tuple:
+    """
+    :return: Status, milliseconds to the first byte, and milliseconds of every stage.
+    """
+    started_at = time.perf_counter()
+    async with session.post(url, json={"message": question}, headers=headers) as response:
+        await response.content.readany()
+        first_byte = (time.perf_counter() - started_at) * 1000
+        await response.read()
+        return response.status, first_byte, parse_server_timing(response.headers.get("Server-Timing", ""))
+
+
+async def request_stream(session: aiohttp.ClientSession, url: str, question: str, headers: dict) -> tuple:
+    started_at = time.perf_counter()
+    first_byte = None
+    timings = {}
+    async with session.post(f"{url}/stream", json={"message": question}, headers=headers) as response:
+        event = None
+        async for line in response.content:
+            line = line.decode().strip()
+            if first_byte is None and line.startswith("data:"):
+                first_byte = (time.perf_counter() - started_at) * 1000
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:") and event == "end":
+                timings = json.loads(line[len("data:"):])["timings"]
+        status = response.status if event != "error" else 500
+        return status, first_byte, timings
+
+
+async def run_load(port: int, api_keys: List[str], workload: List[tuple], concurrency: int, stream: bool) -> dict:
+    url = f"http://127.0.0.1:{port}/api/send"
+    request = request_stream if stream else request_send
+    queue = list(reversed(workload))
+    latencies, first_bytes, stages = [], [], {}
+    errors = 0
+
+    async def client(session: aiohttp.ClientSession):
+        nonlocal errors
+        while queue:
+            user, question = queue.pop()
+            started_at = time.perf_counter()
+            status, first_byte, timings = await request(
+                session, url, question, {"X-API-KEY-Token": api_keys[user], "X-Profile": "1"})
+            if status != 200:
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - started_at) * 1000)
+            first_bytes.append(first_byte)
+            for stage, milliseconds in timings.items():
+                stages.setdefault(stage, []).append(milliseconds)
+
+    started_at = time.perf_counter()
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as session:
+        await asyncio.gather(*[client(session) for _ in range(concurrency)])
+    seconds = time.perf_counter() - started_at
+
+    return {
+        "requests": len(workload),
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "throughput_rps": round(len(workload) / seconds, 2),
+        "latency_ms": percentiles(latencies),
+        "ttfb_ms": percentiles(first_bytes),
+        "stages_ms": {stage: percentiles(values) for stage, values in sorted(stages.items())},
+        **memory(),
+    }
+
+
+async def serve(args, api_keys: List[str]) -> dict:
+    import uvicorn
+    from main import app, readiness
+
+    phases = {}
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning'))
+    started_at = time.perf_counter()
+    serving = asyncio.create_task(server.serve())
+    try:
+        while not server.started:
+            await asyncio.sleep(0.005)
+        accepting = time.perf_counter() - started_at
+        await readiness.wait()
+        phases["startup"] = {"accepting_ms": round(accepting * 1000, 1),
+                             "ready_ms": round((time.perf_counter() - started_at) * 1000, 1),
+                             "steps_ms": readiness.report()["steps"], **memory()}
+
+        for name in args.scenarios:
+            workload = make_workload(args, len(api_keys))
+            phases[name] = await run_load(port, api_keys, workload, args.concurrency, stream=name == 'stream')
+    finally:
+        server.should_exit = True
+        await serving
+    return phases
+
+
+def run(args) -> dict:
+    with tempfile.TemporaryDirectory() as work_dir:
+        configure(work_dir, args)
+        phases = {"ingest": ingest(work_dir, args)}
+        seed_started_at = time.perf_counter()
+        api_keys = seed(args)
+        phases["seed"] = {"seconds": round(time.perf_counter() - seed_started_at, 3), **memory()}
+        phases.update(asyncio.run(serve(args, api_keys)))
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    settings = {name: value for name, value in vars(args).items() if name not in ('output', 'compare', 'threshold', 'min_delta')}
+    return {
+        "version": RESULTS_VERSION,
+        "created_at": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": settings,
+        "phases": phases,
+    }
+
+
+def flatten(value, prefix: str = "") -> Dict[str, float]:
+    """
+    :return: Numeric metrics by their dotted paths, e.g. "send.latency_ms.p95".
+    """
+    if isinstance(value, dict):
+        metrics = {}
+        for name, item in value.items():
+            metrics.update(flatten(item, f"{prefix}.{name}" if prefix else name))
+        return metrics
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and not prefix.endswith(".count"):
+        return {prefix: float(value)}
+    return {}
+
+
+def direction(metric: str) -> Optional[int]:
+    """
+    :return: 1, if the metric is better when higher, -1, if it is better when lower, and None, if it is neither.
+    """
+    names = metric.split(".")
+    if any(name.endswith(HIGHER_IS_BETTER) for name in names):
+        return 1
+    if any(name.endswith(LOWER_IS_BETTER) for name in names):
+        return -1
+    return None
+
+
+def compare(baseline: dict, current: dict, threshold: float, min_delta: float) -> List[str]:
+    """
+    Prints metrics, which changed by more than `threshold` (relative) and `min_delta` (absolute, ms or MB).
+    :return: Regressed metrics.
+    """
+    if baseline["settings"] != current["settings"]:
+        print("warning: Settings of the runs differ, so the results are not comparable:", file=sys.stderr)
+        for name in sorted(set(baseline["settings"]) | set(current["settings"])):
+            if baseline["settings"].get(name) != current["settings"].get(name):
+                print(f"  {name}: {baseline['settings'].get(name)} -> {current['settings'].get(name)}",
+                      file=sys.stderr)
+
+    old, new = flatten(baseline["phases"]), flatten(current["phases"])
+    regressions = []
+    print(f"Compared with {baseline.get('commit')} of {baseline['created_at']}:")
+    print(f"  {'metric':<44} {'baseline':>10} {'current':>10} {'change':>8}")
+    for metric in sorted(set(old) & set(new)):
+        sign = direction(metric)
+        if sign is None or old[metric] == new[metric]:
+            continue
+        change = (new[metric] - old[metric]) / old[metric] if old[metric] else float('inf')
+        if abs(change) <= threshold or abs(new[metric] - old[metric]) < min_delta:
+            continue
+        regressed = change * sign < 0
+        if regressed:
+            regressions.append(metric)
+        print(f"  {metric:<44} {old[metric]:>10.1f} {new[metric]:>10.1f} {change:>+8.0%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def report(results: dict):
+    phases = results["phases"]
+    ingest_phase = phases["ingest"]
+    print(f"ingest   {ingest_phase['chunks']} chunks in {ingest_phase['seconds']:.1f} s: "
+          f"{ingest_phase['pages_per_second']:.1f} pages/s, {ingest_phase['chunks_per_second']:.1f} chunks/s, "
+          f"RSS +{ingest_phase['rss_growth_mb']:.1f} MB (workers peak {ingest_phase['workers_peak_rss_mb']:.1f} MB)")
+    print(f"seed     {phases['seed']['seconds']:.1f} s")
+    startup = phases["startup"]
+    print(f"startup  accepting in {startup['accepting_ms']:.0f} ms, ready in {startup['ready_ms']:.0f} ms, "
+          f"RSS {startup['rss_mb']:.1f} MB, steps (ms): {startup['steps_ms']}")
+    for name in results["settings"]["scenarios"]:
+        load = phases[name]
+        latency = load["latency_ms"]
+        print(f"{name:<8} {load['throughput_rps']:.1f} req/s, {load['errors']} errors, latency p50 {latency['p50']:.0f}"
+              f" p95 {latency['p95']:.0f} p99 {latency['p99']:.0f} ms, TTFB p50 {load['ttfb_ms']['p50']:.0f} ms, "
+              f"RSS {load['rss_mb']:.1f} MB (peak {load['peak_rss_mb']:.1f} MB)")
+        print(f"  {'stage, ms':<16} {'count':>6} {'p50':>9} {'p95':>9} {'p99':>9}")
+        for stage, stage_percentiles in load["stages_ms"].items():
+            print(f"  {stage:<16} {stage_percentiles['count']:>6} {stage_percentiles['p50']:>9.2f} "
+                  f"{stage_percentiles['p95']:>9.2f} {stage_percentiles['p99']:>9.2f}")
+
+
+def main(args):
+    results = run(args)
+    report(results)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"Results are written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(baseline, results, args.threshold, args.min_delta)
+        if regressions:
+            print(f"{len(regressions)} metrics regressed by more than {args.threshold:.0%}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pdfs', type=int, default=4, help='Synthetic PDFs to ingest')
+    parser.add_argument('--pages', type=int, default=50, help='Pages per PDF')
+    parser.add_argument('--ingestion-workers', type=int, default=2, help='Processes to parse PDFs with')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--history-messages', type=int, default=40, help='Messages in chat history of a user')
+    parser.add_argument('--history-every', type=int, default=2,
+                        help='Every that many users has no chat history, so their answers may be cached. '
+                             '0 gives history to every user')
+    parser.add_argument('--scenarios', nargs='+', choices=['send', 'stream'], default=['send', 'stream'])
+    parser.add_argument('--requests', type=int, default=500, help='Requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent clients')
+    parser.add_argument('--distinct-questions', type=int, default=100,
+                        help='Questions are drawn from that many, so fewer give more answer cache hits')
+    parser.add_argument('--follow-up-share', type=float, default=0.2, help='Share of follow-up questions')
+    parser.add_argument('--chat-latency', type=float, default=0.5, help='Seconds per fake chat completion')
+    parser.add_argument('--embedding-latency', type=float, default=0.05, help='Seconds per fake embeddings call')
+    parser.add_argument('--backend', choices=['chroma', 'numpy'], default='numpy', help='VECTOR_STORE_BACKEND')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data and of the workload')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare results with these, written by --output')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative change of a metric, which is a regression')
+    parser.add_argument('--min-delta', type=float, default=5.0,
+                        help='Smaller absolute changes (ms, MB, req/s) are ignored as noise')
+    main(parser.parse_args())
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Compares history trimming algorithms over histories of 100 to 100k messages.
+
+"legacy" is the algorithm, which limit_tokens_for_request used before: it scans the whole history,
+builds the result with insert(0, message.copy()) and may skip a large message and keep older ones.
+"engine" is history_trimming.trim_chat_history. Both get precounted tokens, so only trimming is measured.
+Larger --token-limit (long-context models) keeps more messages, which is where insert(0, ...) becomes quadratic.
+
+Run from the repository root: `python -m benchmarks.bench_history_trimming --token-limit 4096 128000`
+"""
+import argparse
+import statistics
+import time
+
+from langchain.schema import HumanMessage, AIMessage
+
+from history_trimming import trim_chat_history, TrimPolicy, MESSAGE_OVERHEAD_TOKENS, request_base_tokens
+
+MESSAGE_TOKENS = 40
+QUESTION_TOKENS = 20
+
+
+def legacy_limit(chat_history: list, token_counts: list, token_limit: int) -> list:
+    result_chat_history = []
+    tokens_count = request_base_tokens(QUESTION_TOKENS)
+    for message, message_tokens in zip(reversed(chat_history), reversed(token_counts)):
+        current_message_tokens = message_tokens + MESSAGE_OVERHEAD_TOKENS
+        if tokens_count + current_message_tokens < token_limit * 0.8:
+            result_chat_history.insert(0, message.copy())
+            tokens_count += current_message_tokens
+    return result_chat_history
+
+
+def engine_limit(chat_history: list, token_counts: list, token_limit: int) -> list:
+    return trim_chat_history(question_tokens=QUESTION_TOKENS,
+                             recent_chat_history=zip(reversed(chat_history), reversed(token_counts)),
+                             policy=TrimPolicy.RECENCY,
+                             token_limit=token_limit)
+
+
+def measure(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started_at)
+    return statistics.median(timings)
+
+
+def main(args):
+    print(f"{'token limit':>11} {'messages':>9} {'legacy, ms':>11} {'engine, ms':>11} {'kept':>6}")
+    for token_limit in args.token_limit:
+        for messages in args.messages:
+            chat_history = [HumanMessage(content=f"message {i}") if i % 2 == 0 else AIMessage(content=f"answer {i}")
+                            for i in range(messages)]
+            token_counts = [MESSAGE_TOKENS] * messages
+
+            kept = len(engine_limit(chat_history, token_counts, token_limit))
+            legacy = measure(lambda: legacy_limit(chat_history, token_counts, token_limit), args.repeat)
+            engine = measure(lambda: engine_limit(chat_history, token_counts, token_limit), args.repeat)
+            print(f"{token_limit:>11} {messages:>9} {legacy * 1000:>11.3f} {engine * 1000:>11.3f} {kept:>6}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark chat history trimming')
+    parser.add_argument('--messages', type=int, nargs='+', default=[100, 1000, 10000, 100000],
+                        help='History lengths to test')
+    parser.add_argument('--token-limit', type=int, nargs='+', default=[4096, 128000],
+                        help='Token limits of the model to test')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetitions per measurement')
+
+    main(parser.parse_args())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Measures peak memory (RSS) of parsing, cleaning and splitting of a large PDF.
+
+"eager" is the old behaviour: list of all pages (parsed objects of pdfplumber pages are kept), then list of
+cleaned pages, then list of chunks. "streaming" is persist_document.load_chunks, which passes pages through
+the stages one at a time and releases parsed objects of every page after its text is extracted.
+Every mode is run in a fresh process, so its peak RSS is not affected by the other one.
+
+Run from the repository root: `python -m benchmarks.bench_ingestion_memory --pages 1000`
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic_pdf import write_pdf
+
+
+def run_eager(file_path: str) -> int:
+    import pdfplumber
+    from app_types import PageData, PDFDocument
+    from persist_document import CLEANING_FUNCTIONS
+    from utils import clean_text, text_to_chunks
+
+    pdf_document = PDFDocument(title='', author='', creation_date='', pages=[])
+    with pdfplumber.open(file_path) as pdf:
+        for page_num, page in enumerate(pdf.pages):
+            text = page.extract_text()
+            if text.strip():
+                pdf_document.pages.append(PageData(num=page_num, text=text))
+        pdf_document.pages = clean_text(pdf_document.pages, CLEANING_FUNCTIONS)
+        return len(text_to_chunks(pdf_document))
+
+
+def run_streaming(file_path: str) -> int:
+    from persist_document import load_chunks
+
+    return len(load_chunks(file_path, current_file_hash=''))
+
+
+MODES = {
+    "eager": run_eager,
+    "streaming": run_streaming,
+}
+
+
+def run_mode(mode: str, file_path: str):
+    """
+    Is run in the child process. Prints result as JSON.
+    """
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started_at = time.perf_counter()
+    chunks = MODES[mode](file_path)
+    elapsed = time.perf_counter() - started_at
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KB on Linux.
+    print(json.dumps({"chunks": chunks, "seconds": elapsed, "peak_mb": peak / 1024,
+                      "growth_mb": (peak - baseline) / 1024}))
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as work_dir:
+        file_path = os.path.join(work_dir, 'synthetic.pdf')
+        write_pdf(file_path, pages=args.pages)
+        print(f"{args.pages} pages, {os.path.getsize(file_path) / 2 ** 20:.1f} MB PDF")
+
+        print(f"{'mode':>10} {'chunks':>7} {'seconds':>8} {'peak RSS, MB':>13} {'growth, MB':>11}")
+        for mode in MODES:
+            output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_ingestion_memory', '--run', mode,
+                                     file_path], check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{mode:>10} {result['chunks']:>7} {result['seconds']:>8.1f} {result['peak_mb']:>13.1f} "
+                  f"{result['growth_mb']:>11.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--run', nargs=2, metavar=('MODE', 'FILE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_mode(*args.run)
+    else:
+        main(args)
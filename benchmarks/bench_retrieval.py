@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Compares retrieval modes on the same chunks: lexical (BM25Index), vector (NumpyVectorStore) and hybrid
+(HybridRetriever). Measures latency, recall@k of the chunk, a query was made from, and number of embedding calls.
+
+By default the corpus is synthetic. Every chunk has a few unique identifiers (like clause numbers) and words of a few
+concepts. Half of the queries quote identifiers of their chunk, the other half paraphrase its concepts with synonyms.
+Embeddings are hashed bags of concepts, so synonyms get the same vector and no embedding model is called.
+Recall is fixed by construction there (lexical search finds quotes only, vector search - paraphrases only), so it
+only checks, that fusion keeps both, and the numbers to look at are latencies and embedding calls.
+
+With `--pdf`, chunks of the real document (as persist_document.py makes them) are searched with LABELED_QUESTIONS,
+embedded by utils.make_embeddings (so MODEL_BACKEND=openai for real numbers). Recall@k is reported for questions,
+which use the words of the document, and for paraphrases, and so is the share of questions, which the hybrid
+retriever answered from the lexical index alone, with recall@k of those.
+
+Run from the repository root: `python -m benchmarks.bench_retrieval --chunks 5000 --queries 400`
+or `MODEL_BACKEND=openai python -m benchmarks.bench_retrieval --pdf`
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+import zlib
+from typing import Callable, Dict, List, Set, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+
+from benchmarks.synthetic_pdf import WORDS
+from bm25_index import BM25Index, tokenize
+from hybrid_retriever import HybridRetriever
+from numpy_vector_store import NumpyVectorStore
+
+CONCEPTS = 400
+DIMENSIONS = 256
+
+# (question, phrase of the chunk, which answers it, kind). Phrases are short, so that they stay within one chunk,
+# however the document is split.
+LABELED_QUESTIONS = [
+    ("What are Minting Fees and can they be cancelled?", "All Minting Fees are non-cancellable", "terms"),
+    ("What is a Selected Subscription Plan?", '("Selected Subscription Plan")', "terms"),
+    ("What are the Usage Limits?", '"Usage Limits")', "terms"),
+    ("How does Nifty Bridge comply with the California Consumer Privacy Act?",
+     "California Consumer Privacy Act of 2018", "terms"),
+    ("Am I allowed to reverse engineer or decompile the Services?", "reverse engineer or decompile", "terms"),
+    ("Is Nifty Bridge liable under Force Majeure?", "Force Majeure", "terms"),
+    ("Which law governs this Agreement?", "laws of the State of Delaware", "terms"),
+    ("What license do you get to feedback, comments or suggestions?", "feedback, comments or suggestions", "terms"),
+    ("Can I get my money back for NFTs nobody bought?", "in the event of unsold NFTs", "paraphrase"),
+    ("Can the price go up while I am subscribed?", "Any increases to the fees shall apply", "paraphrase"),
+    ("Will I be warned before the platform goes down?", "guarantee notice prior to unplanned outages", "paraphrase"),
+    ("What happens to my account if I stop paying?", "failure to pay fees when due", "paraphrase"),
+    ("May I upload hateful or violent pictures?", "graphic or gratuitous violence", "paraphrase"),
+    ("Will you tell me if hackers steal my data?", "notify you of any security incident", "paraphrase"),
+    ("Can I show your logo on my site?", "display the Nifty Bridge Marks", "paraphrase"),
+    ("How will I find out that these rules have changed?", "amended Nifty Bridge Terms of Service shall be posted",
+     "paraphrase"),
+]
+
+Query = Tuple[str, Set[int], str]  # Query, rows of the chunks, which answer it, kind.
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+        self.calls = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        return self.embeddings.embed_query(text)
+
+
+class ConceptEmbeddings(Embeddings):
+    """
+    Hashed bag of concepts: both words of a concept (the one of documents and its synonym) get the same dimension.
+    """
+
+    def __init__(self, concepts: Dict[str, int]):
+        self.concepts = concepts
+        self.calls = 0
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(DIMENSIONS, dtype=np.float32)
+        for word in tokenize(text):
+            concept = self.concepts.get(word)
+            if concept is not None:
+                vector[concept % DIMENSIONS] += 1.0
+            else:
+                vector[zlib.crc32(word.encode()) % DIMENSIONS] += 0.3
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        return self._embed(text)
+
+
+def make_corpus(chunks: int, rng: random.Random):
+    document_words = [f"term{i}" for i in range(CONCEPTS)]
+    synonyms = [f"synonym{i}" for i in range(CONCEPTS)]
+    concepts = {**{word: i for i, word in enumerate(document_words)}, **{word: i for i, word in enumerate(synonyms)}}
+
+    texts, chunk_concepts, identifiers = [], [], []
+    for i in range(chunks):
+        chunk_concept_ids = rng.sample(range(CONCEPTS), 4)
+        chunk_identifiers = [f"clause{i}x{j}" for j in range(2)]
+        words = [rng.choice(WORDS) for _ in range(60)]
+        words += [document_words[concept] for concept in chunk_concept_ids for _ in range(2)] + chunk_identifiers
+        rng.shuffle(words)
+        texts.append(" ".join(words))
+        chunk_concepts.append(chunk_concept_ids)
+        identifiers.append(chunk_identifiers)
+
+    return texts, concepts, synonyms, chunk_concepts, identifiers
+
+
+def make_queries(count: int, rng: random.Random, synonyms, chunk_concepts, identifiers) -> List[Query]:
+    queries = []
+    for i in range(count):
+        row = rng.randrange(len(chunk_concepts))
+        if i % 2 == 0:
+            queries.append((f"What does {' and '.join(identifiers[row])} say about {rng.choice(WORDS)}?", {row},
+                            "quote"))
+        else:
+            words = " ".join(synonyms[concept] for concept in chunk_concepts[row])
+            queries.append((f"What is said about {words}?", {row}, "paraphrase"))
+    return queries
+
+
+def load_pdf_corpus(file_path: str) -> Tuple[List[str], List[Query]]:
+    """
+    :return: Texts of the chunks of the PDF, and LABELED_QUESTIONS with the rows of the chunks, which have the phrase.
+    """
+    from ingestion import file_hash
+    from persist_document import load_chunks
+
+    texts = [chunk.page_content for chunk in load_chunks(file_path, file_hash(file_path))]
+    normalized = [" ".join(text.split()) for text in texts]
+    queries = []
+    for question, phrase, kind in LABELED_QUESTIONS:
+        rows = {row for row, text in enumerate(normalized) if phrase in text}
+        if not rows:
+            raise ValueError(f"No chunk of {file_path} has the phrase, the question is labeled with: {phrase!r}")
+        queries.append((question, rows, kind))
+    return texts, queries
+
+
+def measure(name: str, search: Callable[[str], List[Document]], queries: List[Query], k: int, embeddings,
+            kinds: List[str]) -> List[bool]:
+    """
+    Prints latency, recall@k of every kind of queries and embedding calls.
+    :return: Whether every query found a chunk, which answers it.
+    """
+    calls_before = embeddings.calls
+    timings = []
+    hits = []
+    for query, rows, _ in queries:
+        started_at = time.perf_counter()
+        documents = search(query)
+        timings.append((time.perf_counter() - started_at) * 1000)
+        hits.append(any(document.metadata["row"] in rows for document in documents[:k]))
+
+    recalls = []
+    for kind in kinds:
+        kind_hits = [hit for hit, (_, _, query_kind) in zip(hits, queries) if query_kind == kind]
+        recalls.append(f"{sum(kind_hits) / len(kind_hits):>{len(kind) + 4}.3f}")
+    print(f"{name:>8} {statistics.median(timings):>8.2f} {statistics.quantiles(timings, n=20)[-1]:>8.2f} "
+          f"{' '.join(recalls)} {embeddings.calls - calls_before:>11}")
+    return hits
+
+
+def main(args):
+    if args.pdf:
+        from utils import make_embeddings
+
+        texts, queries = load_pdf_corpus(args.pdf)
+        embeddings = CountingEmbeddings(make_embeddings())
+        corpus = f"{len(texts)} chunks of {args.pdf}"
+    else:
+        rng = random.Random(0)
+        texts, concepts, synonyms, chunk_concepts, identifiers = make_corpus(args.chunks, rng)
+        queries = make_queries(args.queries, rng, synonyms, chunk_concepts, identifiers)
+        embeddings = ConceptEmbeddings(concepts)
+        corpus = f"{len(texts)} synthetic chunks"
+    kinds = sorted({kind for _, _, kind in queries})
+    ids = [str(i) for i in range(len(texts))]
+    metadatas = [{"file": "corpus.pdf", "row": i} for i in range(len(texts))]
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        store = NumpyVectorStore(persist_directory=os.path.join(work_dir, 'numpy'), embedding_function=embeddings)
+        store.add(ids, embeddings.embed_documents(texts), metadatas, texts)
+
+        started_at = time.perf_counter()
+        index = BM25Index.build(ids, texts, metadatas)
+        build_ms = (time.perf_counter() - started_at) * 1000
+        index_file = os.path.join(work_dir, 'bm25.json')
+        index.save(index_file)
+        started_at = time.perf_counter()
+        index = BM25Index.load(index_file)
+        load_ms = (time.perf_counter() - started_at) * 1000
+
+        print(f"{corpus}, {len(queries)} queries, k={args.k}. "
+              f"Lexical index: built in {build_ms:.0f} ms, loaded in {load_ms:.0f} ms, "
+              f"{os.path.getsize(index_file) / 2 ** 20:.1f} MB")
+        print(f"{'mode':>8} {'p50, ms':>8} {'p95, ms':>8} {' '.join(f'{kind} r@k' for kind in kinds)} "
+              f"{'embeddings':>11}")
+
+        hybrid = HybridRetriever(store, index, k=args.k)
+        lexical_only = []
+
+        def search_hybrid(query: str) -> List[Document]:
+            answered_lexically = hybrid.lexical_only
+            documents = hybrid.get_relevant_documents(query)
+            lexical_only.append(hybrid.lexical_only > answered_lexically)
+            return documents
+
+        measure("bm25", lambda query: [index.document(row) for row, _ in index.search(query, args.k)],
+                queries, args.k, embeddings, kinds)
+        measure("vector", lambda query: store.similarity_search(query, k=args.k), queries, args.k, embeddings, kinds)
+        hits = measure("hybrid", search_hybrid, queries, args.k, embeddings, kinds)
+
+        lexical_hits = [hit for hit, lexical in zip(hits, lexical_only) if lexical]
+        print(f"Hybrid: {len(lexical_hits)} of {len(queries)} queries ({len(lexical_hits) / len(queries):.1%}) "
+              f"answered by the lexical index alone, with recall@k "
+              f"{sum(lexical_hits) / len(lexical_hits) if lexical_hits else 0:.3f}; {hybrid.fused} fused")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunks', type=int, default=5000)
+    parser.add_argument('--queries', type=int, default=400)
+    parser.add_argument('-k', type=int, default=4)
+    parser.add_argument('--pdf', nargs='?', const="./Nifty Bridge Terms of Service.pdf",
+                        help='Search chunks of the PDF with labeled questions, instead of the synthetic corpus')
+    main(parser.parse_args())
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Measures throughput (MB/s) of cleaning of page texts: utils.clean_text with the cleaning functions
+(separate re.sub pass per function) against text_cleaning.clean_page_text (compiled rules, fused passes).
+Outputs are compared, so the benchmark also checks, that both give the same text.
+
+Run from the repository root: `python -m benchmarks.bench_text_cleaning --megabytes 50`
+"""
+import argparse
+import random
+import statistics
+import time
+
+from app_types import PageData
+from benchmarks.synthetic_pdf import page_lines
+from text_cleaning import clean_page_text
+from utils import clean_text, merge_hyphenated_words, fix_newlines, remove_multiple_newlines
+
+
+def make_pages(megabytes: float):
+    rng = random.Random(0)
+    pages = []
+    size = 0
+    while size < megabytes * 2 ** 20:
+        # Lines as extracted by pdfplumber: hyphenated words are split with "-\n".
+        text = "\n".join(page_lines(len(pages), rng))
+        pages.append(PageData(num=len(pages), text=text))
+        size += len(text.encode())
+    return pages, size
+
+
+def measure(func, repeat: int):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started_at)
+    return statistics.median(timings), result
+
+
+def main(args):
+    pages, size = make_pages(args.megabytes)
+    print(f"{len(pages)} pages, {size / 2 ** 20:.1f} MB")
+
+    modes = {
+        "functions": [merge_hyphenated_words, fix_newlines, remove_multiple_newlines],
+        "compiled": [clean_page_text],
+    }
+    results = {}
+    print(f"{'mode':>10} {'seconds':>8} {'MB/s':>8}")
+    for mode, cleaning_functions in modes.items():
+        seconds, results[mode] = measure(lambda: clean_text(pages, cleaning_functions), args.repeat)
+        print(f"{mode:>10} {seconds:>8.3f} {size / 2 ** 20 / seconds:>8.1f}")
+
+    assert results["functions"] == results["compiled"], "Cleaned texts differ"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--megabytes', type=float, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    main(parser.parse_args())
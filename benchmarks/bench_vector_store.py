@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Compares vector stores on the same embeddings: Chroma (through langchain, as the chain uses it) and
+NumpyVectorStore. Measures time to open the persisted store, query latency and recall@k against exact
+search. Embeddings are random clustered unit vectors, so no embedding model is called.
+
+Run from the repository root: `python -m benchmarks.bench_vector_store --chunks 5000 --queries 200`
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from numpy_vector_store import NumpyVectorStore
+
+
+class LookupEmbeddings(Embeddings):
+    """
+    Returns precomputed vectors of texts.
+    """
+
+    def __init__(self, vectors: dict):
+        self.vectors = vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.vectors[text] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.vectors[text]
+
+
+def make_vectors(count: int, dimensions: int, rng: np.random.Generator, centers: np.ndarray) -> np.ndarray:
+    vectors = centers[rng.integers(len(centers), size=count)] + rng.normal(scale=0.5, size=(count, dimensions))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def open_numpy(path: str, embeddings: Embeddings):
+    return NumpyVectorStore(persist_directory=path, embedding_function=embeddings)
+
+
+def open_chroma(path: str, embeddings: Embeddings):
+    from langchain.vectorstores import Chroma
+    return Chroma(collection_name='bench', embedding_function=embeddings, persist_directory=path)
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(50, args.dimensions))
+    chunk_vectors = make_vectors(args.chunks, args.dimensions, rng, centers)
+    query_vectors = make_vectors(args.queries, args.dimensions, rng, centers)
+
+    texts = [f"chunk {i}" for i in range(args.chunks)]
+    queries = [f"query {i}" for i in range(args.queries)]
+    embeddings = LookupEmbeddings({**dict(zip(texts, chunk_vectors.tolist())),
+                                   **dict(zip(queries, query_vectors.tolist()))})
+
+    exact = np.argsort(-(query_vectors @ chunk_vectors.T), axis=1)[:, :args.k]
+    print(f"{args.chunks} chunks of {args.dimensions} dimensions, {args.queries} queries, k={args.k}")
+    print(f"{'store':>7} {'open, ms':>9} {'p50, ms':>8} {'p95, ms':>8} {'recall@k':>9}")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, open_store in (("numpy", open_numpy), ("chroma", open_chroma)):
+            path = os.path.join(work_dir, name)
+            try:
+                store = open_store(path, embeddings)
+            except (ImportError, ValueError) as e:
+                print(f"{name:>7} unavailable: {e}")
+                continue
+
+            for start in range(0, args.chunks, 1000):
+                batch = texts[start:start + 1000]
+                store.add_texts(batch, ids=[str(i) for i in range(start, start + len(batch))])
+            store.persist()
+            del store
+
+            started_at = time.perf_counter()
+            store = open_store(path, embeddings)
+            store.similarity_search(queries[0], k=args.k)
+            open_ms = (time.perf_counter() - started_at) * 1000
+
+            timings = []
+            hits = 0
+            for query, expected in zip(queries, exact):
+                started_at = time.perf_counter()
+                documents = store.similarity_search(query, k=args.k)
+                timings.append((time.perf_counter() - started_at) * 1000)
+                found = {int(document.page_content.split()[1]) for document in documents}
+                hits += len(found & set(expected.tolist()))
+
+            print(f"{name:>7} {open_ms:>9.1f} {statistics.median(timings):>8.2f} "
+                  f"{statistics.quantiles(timings, n=20)[-1]:>8.2f} {hits / exact.size:>9.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunks', type=int, default=5000)
+    parser.add_argument('--dimensions', type=int, default=1536)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=4)
+    main(parser.parse_args())
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Load test of coalescing (see coalescing.py) against the local stub of OpenAI API (see stub_openai_server.py).
+
+Bursts of concurrent requests ask a few questions, written slightly differently ("What is clause 3?",
+"what is clause 3"), every request by a new user, so that no request has chat history. The server is run with
+coalescing and batching of embeddings disabled, and then enabled, and the upstream calls, counted by the stub,
+are compared. The answer cache and the embedding cache are disabled, so they do not hide the calls.
+
+Run from the repository root: `python -m benchmarks.load_test_coalescing --bursts 10 --burst-size 50`
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+
+import aiohttp
+
+from benchmarks.load_test_send import free_port, start_stub_server, start_api_server, make_server_env, seed
+
+SETTINGS = {
+    "off": {"COALESCE_QUESTIONS": 0, "EMBEDDING_BATCH_WINDOW": 0},
+    "on": {"COALESCE_QUESTIONS": 1, "EMBEDDING_BATCH_WINDOW": 0.005},
+}
+
+
+def question_variant(question: int, rng: random.Random) -> str:
+    text = f"What is clause {question}"
+    return rng.choice([text, text.lower(), text.upper(), f"  {text}?", f"{text} ?", f"{text}."])
+
+
+async def get_stub_stats(session: aiohttp.ClientSession, stub_port: int) -> dict:
+    async with session.get(f"http://127.0.0.1:{stub_port}/stats") as response:
+        return await response.json()
+
+
+async def run_bursts(port: int, stub_port: int, api_keys: list, bursts: int, burst_size: int, questions: int) -> dict:
+    url = f"http://127.0.0.1:{port}/api/send"
+    rng = random.Random(0)
+    keys = iter(api_keys)
+    latencies = []
+    errors = 0
+
+    async def ask(session: aiohttp.ClientSession, api_key: str, message: str):
+        nonlocal errors
+        started_at = time.perf_counter()
+        async with session.post(url, json={"message": message}, headers={"X-API-KEY-Token": api_key}) as response:
+            await response.read()
+            if response.status != 200:
+                errors += 1
+        latencies.append(time.perf_counter() - started_at)
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as session:
+        before = await get_stub_stats(session, stub_port)
+        for _ in range(bursts):
+            await asyncio.gather(*[ask(session, next(keys), question_variant(rng.randrange(questions), rng))
+                                   for _ in range(burst_size)])
+        after = await get_stub_stats(session, stub_port)
+
+    return {
+        "requests": bursts * burst_size,
+        "p50": statistics.median(latencies),
+        "errors": errors,
+        **{name: after[name] - before[name] for name in after},
+    }
+
+
+def main(args):
+    stub_port = free_port()
+    stub = start_stub_server(stub_port, args.chat_latency, args.embedding_latency)
+
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            requests = args.bursts * args.burst_size
+            api_keys = seed(make_server_env(work_dir, stub_port), users=requests * len(SETTINGS))
+
+            print(f"{args.bursts} bursts of {args.burst_size} concurrent requests of {args.questions} questions")
+            print(f"{'coalescing':>10} {'requests':>9} {'chat calls':>11} {'embedding calls':>16} "
+                  f"{'embedded inputs':>16} {'p50, ms':>8} {'errors':>7}")
+            for i, (name, settings) in enumerate(SETTINGS.items()):
+                env = make_server_env(work_dir, stub_port, ANSWER_CACHE_ENABLED=0, EMBEDDING_CACHE_ENABLED=0,
+                                      MAX_CONCURRENT_LLM_REQUESTS=args.burst_size,
+                                      BLOCKING_EXECUTOR_MAX_WORKERS=args.burst_size, **settings)
+                port = free_port()
+                server = start_api_server(port, env)
+                try:
+                    result = asyncio.run(run_bursts(port, stub_port, api_keys[i * requests:(i + 1) * requests],
+                                                    args.bursts, args.burst_size, args.questions))
+                finally:
+                    server.terminate()
+                    server.wait()
+
+                print(f"{name:>10} {result['requests']:>9} {result['chat_completions']:>11} "
+                      f"{result['embeddings']:>16} {result['embedded_inputs']:>16} {result['p50'] * 1000:>8.1f} "
+                      f"{result['errors']:>7}")
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bursts', type=int, default=10)
+    parser.add_argument('--burst-size', type=int, default=50, help='Concurrent requests per burst')
+    parser.add_argument('--questions', type=int, default=3, help='Distinct questions per burst')
+    parser.add_argument('--chat-latency', type=float, default=0.5, help='Seconds per stub chat completion')
+    parser.add_argument('--embedding-latency', type=float, default=0.05, help='Seconds per stub embeddings call')
+    main(parser.parse_args())
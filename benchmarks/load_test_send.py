@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Load test of /api/send against the local stub of OpenAI API (see stub_openai_server.py).
+
+For every concurrency setting the server is started with MAX_CONCURRENT_LLM_REQUESTS and
+BLOCKING_EXECUTOR_MAX_WORKERS set to that value, and is loaded by the same number of concurrent clients.
+Requests per second should grow with the setting, until the server itself becomes the bottleneck.
+With --stream the streaming endpoint is loaded; compare its time to first byte (TTFB) with /api/send.
+
+Run from the repository root: `python -m benchmarks.load_test_send --concurrency 1 4 16 --requests 200`
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(('127.0.0.1', port)) == 0:
+                return
+        time.sleep(0.1)
+    raise TimeoutError(f"Nothing listens on port {port}")
+
+
+def start_stub_server(port: int, chat_latency: float, embedding_latency: float) -> subprocess.Popen:
+    process = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.stub_openai_server',
+        '--port', str(port),
+        '--chat-latency', str(chat_latency),
+        '--embedding-latency', str(embedding_latency),
+    ])
+    wait_for_port(port)
+    return process
+
+
+def start_api_server(port: int, env: dict) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port)],
+        env=env,
+    )
+    wait_for_port(port)
+    return process
+
+
+def make_server_env(work_dir: str, stub_port: int, **settings) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "sk-load-test",
+        "OPENAI_API_BASE": f"http://127.0.0.1:{stub_port}/v1",
+        "VECTOR_STORE_PATH": os.path.join(work_dir, 'chroma'),
+        "USERS_API_KEYS_DB_FILE": os.path.join(work_dir, 'users.sqlite3'),
+    })
+    env.update({name: str(value) for name, value in settings.items()})
+    return env
+
+
+def seed(env: dict, users: int) -> list:
+    """
+    Persists small synthetic collection (in VECTOR_STORE_BACKEND of the environment), embedded by the stub server,
+    with its lexical index, and registers API keys.
+    Is run in a subprocess, so that config and openai pick up the environment.
+    :return: Registered API keys.
+    """
+    script = f"""
+import os
+import sqlite3
+
+from langchain.embeddings import OpenAIEmbeddings
+from chain_manager import mark_vector_store_updated
+from config import USERS_API_KEYS_DB_FILE, VECTOR_STORE_PATH
+from db_services import re_initialize_db, register_new_api_key
+from ingestion import build_lexical_index
+from utils import make_vector_store
+
+os.makedirs(VECTOR_STORE_PATH, exist_ok=True)
+texts = [f"Nifty Bridge terms of service, clause {{i}}. Synthetic text for load testing." for i in range(200)]
+vector_store = make_vector_store(OpenAIEmbeddings())
+vector_store.add_texts(texts, metadatas=[{{"file": "terms.pdf", "page": i // 10}} for i in range(len(texts))])
+vector_store.persist()
+build_lexical_index(vector_store).save()
+mark_vector_store_updated()
+
+with sqlite3.connect(USERS_API_KEYS_DB_FILE) as db_connection:
+    re_initialize_db(db_connection)
+    for _ in range({users}):
+        print(register_new_api_key(db_connection))
+"""
+    output = subprocess.run([sys.executable, '-c', script], env=env, check=True, capture_output=True, text=True)
+    return output.stdout.split()
+
+
+async def run_load(port: int, api_keys: list, concurrency: int, requests: int, stream: bool = False) -> dict:
+    url = f"http://127.0.0.1:{port}/api/send/stream" if stream else f"http://127.0.0.1:{port}/api/send"
+    latencies = []
+    first_byte_latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+
+    async def client(session: aiohttp.ClientSession, api_key: str):
+        nonlocal errors
+        while not queue.empty():
+            i = queue.get_nowait()
+            started_at = time.perf_counter()
+            async with session.post(url, json={"message": f"What is clause {i % 20}?"},
+                                    headers={"X-API-KEY-Token": api_key}) as response:
+                await response.content.readany()
+                first_byte_latencies.append(time.perf_counter() - started_at)
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+            latencies.append(time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    timeout = aiohttp.ClientTimeout(total=None)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        await asyncio.gather(*[client(session, api_keys[i % len(api_keys)]) for i in range(concurrency)])
+    elapsed = time.perf_counter() - started_at
+
+    latencies.sort()
+    return {
+        "rps": requests / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "ttfb_p50": statistics.median(first_byte_latencies),
+        "errors": errors,
+    }
+
+
+def main(args):
+    stub_port = free_port()
+    stub = start_stub_server(stub_port, args.chat_latency, args.embedding_latency)
+
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            api_keys = seed(make_server_env(work_dir, stub_port), users=max(args.concurrency))
+
+            print(f"{'concurrency':>11} {'req/s':>9} {'p50, ms':>9} {'p95, ms':>9} {'TTFB p50, ms':>13} {'errors':>7}")
+            for concurrency in args.concurrency:
+                env = make_server_env(work_dir, stub_port,
+                                      MAX_CONCURRENT_LLM_REQUESTS=concurrency,
+                                      BLOCKING_EXECUTOR_MAX_WORKERS=concurrency)
+                port = free_port()
+                server = start_api_server(port, env)
+                try:
+                    result = asyncio.run(run_load(port, api_keys, concurrency, args.requests, args.stream))
+                finally:
+                    server.terminate()
+                    server.wait()
+
+                print(f"{concurrency:>11} {result['rps']:>9.1f} {result['p50'] * 1000:>9.1f} "
+                      f"{result['p95'] * 1000:>9.1f} {result['ttfb_p50'] * 1000:>13.1f} {result['errors']:>7}")
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load test /api/send against the stub OpenAI server')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help='Settings to test')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per concurrency setting')
+    parser.add_argument('--chat-latency', type=float, default=0.2, help='Seconds per stub chat completion')
+    parser.add_argument('--embedding-latency', type=float, default=0.02, help='Seconds per stub embeddings call')
+    parser.add_argument('--stream', action='store_true', help='Load /api/send/stream instead of /api/send')
+
+    main(parser.parse_args())
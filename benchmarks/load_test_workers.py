@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Throughput of /api/send with 1 to N workers of serve.py, against the local stub of OpenAI API
+(see stub_openai_server.py).
+
+Model latency of the stub is low and the clients are many, so that the server spends its time on CPU (request
+handling, chat history, retrieval, prompt building), and one process is the bottleneck. Every worker should add
+about one core of throughput, until cores run out: the stub and the clients take cores too, so on a box with
+C cores, scaling is expected up to about C - 2 workers. Answer cache and coalescing are disabled, so that every
+request does the full work. The collection is in the numpy vector store, so that workers share the preloaded one.
+
+Run from the repository root: `python -m benchmarks.load_test_workers --workers 1 2 4 8 --concurrency 64`
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.load_test_send import free_port, wait_for_port, start_stub_server, make_server_env, seed, run_load
+
+
+def start_workers(port: int, workers: int, env: dict) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, 'serve.py', '--workers', str(workers), '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning'],
+        env=env,
+    )
+    wait_for_port(port)
+    return process
+
+
+def main(args):
+    stub_port = free_port()
+    stub = start_stub_server(stub_port, args.chat_latency, args.embedding_latency)
+
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            def server_env(**settings) -> dict:
+                return make_server_env(work_dir, stub_port, VECTOR_STORE_BACKEND='numpy',
+                                       EMBEDDING_CACHE_DB_FILE=os.path.join(work_dir, 'embeddings.sqlite3'),
+                                       ANSWER_CACHE_DB_FILE=os.path.join(work_dir, 'answers.sqlite3'), **settings)
+
+            api_keys = seed(server_env(), users=args.concurrency)
+
+            print(f"{os.cpu_count()} cores, {args.concurrency} concurrent clients, {args.requests} requests")
+            print(f"{'workers':>7} {'req/s':>9} {'speedup':>8} {'p50, ms':>9} {'p95, ms':>9} {'errors':>7}")
+            baseline = None
+            for workers in args.workers:
+                env = server_env(ANSWER_CACHE_ENABLED=0, COALESCE_QUESTIONS=0,
+                                 MAX_CONCURRENT_LLM_REQUESTS=args.concurrency,
+                                 BLOCKING_EXECUTOR_MAX_WORKERS=args.concurrency)
+                port = free_port()
+                server = start_workers(port, workers, env)
+                try:
+                    asyncio.run(run_load(port, api_keys, args.concurrency, args.concurrency))  # Warm up.
+                    result = asyncio.run(run_load(port, api_keys, args.concurrency, args.requests))
+                finally:
+                    server.terminate()
+                    server.wait()
+
+                baseline = baseline or result['rps']
+                print(f"{workers:>7} {result['rps']:>9.1f} {result['rps'] / baseline:>8.2f} "
+                      f"{result['p50'] * 1000:>9.1f} {result['p95'] * 1000:>9.1f} {result['errors']:>7}")
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='Numbers of workers to test')
+    parser.add_argument('--concurrency', type=int, default=64, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per setting')
+    parser.add_argument('--chat-latency', type=float, default=0.02, help='Seconds per stub chat completion')
+    parser.add_argument('--embedding-latency', type=float, default=0.005, help='Seconds per stub embeddings call')
+    main(parser.parse_args())
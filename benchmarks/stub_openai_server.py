@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI API, for load tests. Answers chat completions and embeddings
+after configurable delay, and counts the calls it received (GET /stats).
+
+Point the server or the benchmark at it with `OPENAI_API_BASE=http://127.0.0.1:<port>/v1`.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+
+from aiohttp import web
+
+EMBEDDING_SIZE = 1536
+STUB_ANSWER = "NiftyBridge AI assistant here. This is a stub answer, generated by the local stub server."
+
+
+def stub_embedding(value, size: int = EMBEDDING_SIZE) -> list:
+    """
+    Deterministic embedding of any value (string or list of tokens).
+    """
+    digest = hashlib.sha256(repr(value).encode()).digest()
+    return [(digest[i % len(digest)] - 128) / 128 for i in range(size)]
+
+
+class StubOpenAI:
+    def __init__(self, chat_latency: float, embedding_latency: float):
+        self.chat_latency = chat_latency
+        self.embedding_latency = embedding_latency
+        self.stats = {"chat_completions": 0, "embeddings": 0, "embedded_inputs": 0}
+
+    async def chat_completions(self, request: web.Request) -> web.Response:
+        self.stats["chat_completions"] += 1
+        body = await request.json()
+        if body.get("stream"):
+            return await self.stream_chat_completion(request, body)
+
+        await asyncio.sleep(self.chat_latency)
+        return web.json_response({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-3.5-turbo"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": STUB_ANSWER},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    async def stream_chat_completion(self, request: web.Request, body: dict) -> web.StreamResponse:
+        """
+        Streams the answer word by word. Chat latency is spread evenly between the words.
+        """
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        words = STUB_ANSWER.split(' ')
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.chat_latency / len(words))
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "gpt-3.5-turbo"),
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": word if i == 0 else f" {word}"},
+                    "finish_reason": None,
+                }],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def embeddings(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        inputs = body["input"]
+        if not isinstance(inputs, list) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+
+        self.stats["embeddings"] += 1
+        self.stats["embedded_inputs"] += len(inputs)
+        await asyncio.sleep(self.embedding_latency)
+        return web.json_response({
+            "object": "list",
+            "model": body.get("model", "text-embedding-ada-002"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": stub_embedding(value)}
+                for i, value in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_post("/v1/embeddings", self.embeddings)
+        # langchain OpenAIEmbeddings pass their deployment as the engine, so openai posts here.
+        app.router.add_post("/v1/engines/{engine}/embeddings", self.embeddings)
+        app.router.add_get("/stats", self.get_stats)
+        return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run local stub of OpenAI API')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--chat-latency', type=float, default=0.2, help='Seconds per chat completion')
+    parser.add_argument('--embedding-latency', type=float, default=0.02, help='Seconds per embeddings call')
+    args = parser.parse_args()
+
+    stub = StubOpenAI(chat_latency=args.chat_latency, embedding_latency=args.embedding_latency)
+    web.run_app(stub.make_app(), host='127.0.0.1', port=args.port)
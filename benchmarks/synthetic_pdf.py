@@ -0,0 +1,70 @@
+"""
+Writes large synthetic PDFs for benchmarks, without PDF libraries.
+Every page has lines of plain text (standard Helvetica font), with hyphenated words split across lines
+and paragraphs, so that cleaning and chunking have real work to do.
+"""
+import random
+from typing import List
+
+WORDS = ("terms", "service", "account", "card", "payment", "program", "agreement", "fees", "balance",
+         "transaction", "member", "bank", "notice", "privacy", "information", "dispute", "limit", "bridge")
+
+LINES_PER_PAGE = 50
+
+
+def page_lines(page_num: int, rng: random.Random) -> List[str]:
+    lines = [f"Section {page_num + 1}"]
+    while len(lines) < LINES_PER_PAGE:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 14))]
+        if rng.random() < 0.1:
+            words[-1] = words[-1][:3] + "-"  # Hyphenated word, continued on the next line.
+        elif rng.random() < 0.3:
+            words[-1] += "."
+        if rng.random() < 0.1:
+            lines.append("")
+        lines.append(" ".join(words))
+    return lines
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: int, seed: int = 0):
+    rng = random.Random(seed)
+    objects: List[bytes] = []  # Object number is index + 1.
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(b"")  # Placeholders, written when page numbers are known.
+    pages_object = add(b"")
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    page_objects = []
+    for page_num in range(pages):
+        text = "".join(f"({_escape(line)}) '\n" for line in page_lines(page_num, rng))
+        stream = f"BT /F1 10 Tf 12 TL 40 800 Td\n{text}ET".encode()
+        content = add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        page_objects.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 %d 0 R >> >> >>" % (pages_object, content, font)))
+
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_object
+    kids = b" ".join(b"%d 0 R" % number for number in page_objects)
+    objects[pages_object - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_objects))
+
+    with open(path, 'wb') as file:
+        file.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(file.tell())
+            file.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+
+        xref_offset = file.tell()
+        file.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            file.write(b"%010d 00000 n \n" % offset)
+        file.write(b"trailer\n<< /Size %d /Root %d 0 R /Info << /Title (Synthetic document) >> >>\n"
+                   b"startxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref_offset))
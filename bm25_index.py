@@ -0,0 +1,133 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from config import BM25_INDEX_FILE
+
+_WORD = re.compile(r"\w+")
+STOP_WORDS = frozenset((
+    "a", "about", "an", "and", "any", "are", "as", "at", "be", "by", "can", "do", "does", "explain", "for", "from",
+    "how", "i", "if", "in", "is", "it", "me", "my", "of", "on", "or", "say", "says", "tell", "that", "the", "there",
+    "this", "to", "was", "what", "when", "which", "will", "with", "you", "your",
+))
+
+
+def tokenize(text: str) -> List[str]:
+    return [word for word in _WORD.findall(text.lower()) if word not in STOP_WORDS]
+
+
+class BM25Index:
+    """
+    Inverted index of chunks, scored with Okapi BM25. Finds chunks by exact words (clause names, terms, numbers),
+    which embedding search often misses, and needs no embedding call.
+
+    Is built by persist_document.py from all stored chunks, and is saved to BM25_INDEX_FILE, next to the vector store.
+    """
+
+    def __init__(self,
+                 ids: List[str],
+                 documents: List[str],
+                 metadatas: List[dict],
+                 postings: Dict[str, List[Tuple[int, int]]],
+                 lengths: List[int],
+                 k1: float = 1.5,
+                 b: float = 0.75):
+        """
+        Use `build` or `load` instead.
+        :param postings:    Term -> (row of the chunk, frequency of the term in the chunk) pairs.
+        :param lengths:     Number of terms in every chunk.
+        """
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.k1 = k1
+        self.b = b
+        self._postings = postings
+        self._lengths = lengths
+
+        count = len(ids)
+        average_length = (sum(lengths) / count) if count else 0.0
+        # Length normalization of every chunk, precomputed: k1 * (1 - b + b * length / average length).
+        self._norms = k1 * (1 - b + b * np.asarray(lengths, dtype=np.float32) / (average_length or 1))
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray, float]] = {}
+        for term, term_postings in postings.items():
+            rows, frequencies = zip(*term_postings)
+            idf = math.log(1 + (count - len(rows) + 0.5) / (len(rows) + 0.5))
+            self._arrays[term] = (np.asarray(rows, dtype=np.int32), np.asarray(frequencies, dtype=np.float32), idf)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, ids: List[str], documents: List[str], metadatas: List[dict]) -> 'BM25Index':
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = []
+        for row, document in enumerate(documents):
+            terms = tokenize(document)
+            lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                postings.setdefault(term, []).append((row, frequency))
+        return cls(ids, documents, metadatas, postings, lengths)
+
+    def save(self, index_file: str = BM25_INDEX_FILE):
+        with open(f"{index_file}.tmp", 'w') as file:
+            json.dump({
+                "k1": self.k1,
+                "b": self.b,
+                "ids": self.ids,
+                "documents": self.documents,
+                "metadatas": self.metadatas,
+                "lengths": self._lengths,
+                "postings": self._postings,
+            }, file)
+        os.replace(f"{index_file}.tmp", index_file)
+
+    @classmethod
+    def load(cls, index_file: str = BM25_INDEX_FILE) -> Optional['BM25Index']:
+        """
+        :return: Saved index, or None if it was never built.
+        """
+        try:
+            with open(index_file, 'r') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return None
+        postings = {term: [tuple(posting) for posting in term_postings]
+                    for term, term_postings in data["postings"].items()}
+        return cls(data["ids"], data["documents"], data["metadatas"], postings, data["lengths"],
+                   k1=data["k1"], b=data["b"])
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[int, float]]:
+        """
+        :return: Up to `k` (row, score) pairs of chunks, which contain words of the query, best first.
+        """
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            arrays = self._arrays.get(term)
+            if arrays is None:
+                continue
+            rows, frequencies, idf = arrays
+            scores[rows] += idf * frequencies * (self.k1 + 1) / (frequencies + self._norms[rows])
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched])]
+        return [(int(row), float(scores[row])) for row in matched]
+
+    def max_score(self, query: str) -> float:
+        """
+        :return: Upper bound of the score of a chunk for the query: every known word with very high frequency.
+                 Score, divided by it, tells how well the chunk matches the query. Words, which no chunk has
+                 (mostly wording of the question, like "explain"), are not counted.
+        """
+        return sum(self._arrays[term][2] * (self.k1 + 1) for term in set(tokenize(query)) if term in self._arrays)
+
+    def document(self, row: int) -> Document:
+        return Document(page_content=self.documents[row], metadata=dict(self.metadatas[row]))
@@ -0,0 +1,111 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from config import VECTOR_STORE_VERSION_FILE, CHAIN_RELOAD_CHECK_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+def read_vector_store_version(version_file: str = VECTOR_STORE_VERSION_FILE) -> Optional[str]:
+    """
+    :param version_file: - Path of the file, written by persist_document.py.
+    :return: Current version of the persisted vector store, or None if it was never written.
+    """
+    try:
+        with open(version_file, 'r') as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def mark_vector_store_updated(version_file: str = VECTOR_STORE_VERSION_FILE) -> str:
+    """
+    Writes new version of the persisted vector store, so running servers reload their chains.
+    Written through temporary file and rename, so readers never see partially written version.
+    :return: New version.
+    """
+    version = str(time.time_ns())
+    tmp_file = f"{version_file}.tmp"
+    with open(tmp_file, 'w') as file:
+        file.write(version)
+    os.replace(tmp_file, version_file)
+    return version
+
+
+class ChainManager:
+    """
+    Holds single retrieval chain for the whole process.
+
+    Chain (model, embeddings and vector store client) is built once and shared by all requests.
+    Chain holds no per-request state, so it is safe to use it from concurrent requests.
+    When persist_document.py writes new collection, chain is rebuilt on next `get_chain` call
+    and swapped atomically. Requests which already got the old chain finish with it.
+    If the rebuild fails (e.g. the store is read, while it is written), the old chain is served,
+    and the rebuild is retried after the check interval.
+    """
+
+    def __init__(self,
+                 chain_factory: Callable,
+                 version_file: str = VECTOR_STORE_VERSION_FILE,
+                 reload_check_interval: float = CHAIN_RELOAD_CHECK_INTERVAL,
+                 on_reload: Optional[Callable[[], None]] = None):
+        """
+        :param chain_factory:           Callable without arguments, that builds new chain.
+        :param version_file:            File to watch for vector store updates.
+        :param reload_check_interval:   How often (in seconds) the version file is checked.
+        :param on_reload:               Called after the chain was rebuilt, because vector store was updated.
+                                         E.g. to drop caches, which depend on the documents.
+        """
+        self._chain_factory = chain_factory
+        self._on_reload = on_reload
+        self._version_file = version_file
+        self._reload_check_interval = reload_check_interval
+
+        self._lock = threading.Lock()
+        self._chain = None
+        self._version: Optional[str] = None
+        self._next_check_at = 0.0
+
+    def load(self):
+        """
+        Builds the chain. Is expected to be called once at application startup.
+        :return: Built chain.
+        """
+        with self._lock:
+            return self._build()
+
+    def get_chain(self):
+        """
+        :return: Shared chain. Rebuilds it first, if vector store was updated since the last build.
+        """
+        chain = self._chain
+        if chain is not None and time.monotonic() < self._next_check_at:
+            return chain
+
+        with self._lock:
+            if self._chain is None:
+                return self._build()
+
+            if read_vector_store_version(self._version_file) != self._version:
+                try:
+                    chain = self._build()
+                except Exception:
+                    logger.exception("Failed to reload the chain, the previous one is served")
+                    self._next_check_at = time.monotonic() + self._reload_check_interval
+                    return self._chain
+                if self._on_reload is not None:
+                    self._on_reload()
+                return chain
+
+            self._next_check_at = time.monotonic() + self._reload_check_interval
+            return self._chain
+
+    def _build(self):
+        version = read_vector_store_version(self._version_file)
+        self._chain = self._chain_factory()
+        self._version = version
+        self._next_check_at = time.monotonic() + self._reload_check_interval
+        return self._chain
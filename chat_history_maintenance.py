@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Maintenance of the chat history, which only grows otherwise: export, retention and compaction of the database.
+It is safe to run, while the server is running: messages are deleted in short transactions.
+
+Export history of all users (or of one, by --user-key) as JSON lines, one message per line, oldest first:
+`python chat_history_maintenance.py export --output history.jsonl`
+
+Keep 200 newest messages of every user, and delete older than 90 days (or replace them with their summary,
+written by the model, with --summarize), then compact the database:
+`python chat_history_maintenance.py retain --max-messages 200 --max-age-days 90`
+
+Only compact the database (return free pages to the file system and update statistics of the query planner):
+`python chat_history_maintenance.py compact`
+
+Database, created before compaction was added, has to be converted once, with the server stopped, as it is rewritten
+as a whole and locked meanwhile: `python chat_history_maintenance.py compact --convert`
+"""
+import argparse
+import json
+import sys
+from datetime import datetime, timedelta
+from typing import Optional, TextIO
+
+from config import USERS_API_KEYS_DB_FILE, CHAT_HISTORY_MAX_MESSAGES, CHAT_HISTORY_MAX_AGE_DAYS, \
+    CHAT_HISTORY_MAINTENANCE_BATCH_SIZE, SUMMARY_MAX_TOKENS, SUMMARY_SOURCE_MAX_MESSAGES
+from db_pool import open_connection
+from db_services import iter_chat_history_rows, get_chat_history_user_ids, find_expired_chat_history, \
+    delete_chat_history, replace_with_summary, compact_db, iter_chat_history_newest_first, get_user_id_by_api_key, \
+    get_oldest_chat_message
+from history_trimming import SUMMARY_PREFIX, Summarizer
+from tokens import truncate_to_tokens
+
+
+def export_chat_history(db_connection,
+                        out: TextIO,
+                        user_id: Optional[int] = None,
+                        page_size: int = CHAT_HISTORY_MAINTENANCE_BATCH_SIZE) -> int:
+    """
+    Writes messages as JSON lines. Messages are read page by page, so memory does not grow with the history.
+    :param user_id: User, whose messages are exported. All users by default.
+    :return: Number of exported messages.
+    """
+    exported = 0
+    for row in iter_chat_history_rows(db_connection, user_id=user_id, page_size=page_size):
+        out.write(json.dumps(row, ensure_ascii=False) + "\n")
+        exported += 1
+    return exported
+
+
+def apply_retention(db_connection,
+                    max_messages: Optional[int] = None,
+                    max_age_days: Optional[float] = None,
+                    summarize: Optional[Summarizer] = None,
+                    batch_size: int = CHAT_HISTORY_MAINTENANCE_BATCH_SIZE) -> dict:
+    """
+    Deletes messages of every user, which are beyond `max_messages` newest ones, or older than `max_age_days`.
+    :param summarize:   If given, deleted messages of the user are replaced with their summary (up to
+                        SUMMARY_SOURCE_MAX_MESSAGES newest of them are summarized, along with the summary of the
+                        previous run), as the server does with CHAT_HISTORY_TRIM_POLICY=summarize.
+                        Summary is kept in place of the newest deleted message.
+    :return: Numbers of users, whose history was trimmed, of deleted and of summarized messages.
+    """
+    created_before = None
+    if max_age_days:
+        created_before = (datetime.utcnow() - timedelta(days=max_age_days)).strftime('%Y-%m-%d %H:%M:%S')
+
+    stats = {"users": 0, "deleted": 0, "summarized": 0}
+    for user_id in get_chat_history_user_ids(db_connection):
+        last_id = find_expired_chat_history(db_connection, user_id, max_messages=max_messages or None,
+                                            created_before=created_before)
+        if last_id is None:
+            continue
+
+        if summarize is not None:
+            messages = []
+            for message, _ in iter_chat_history_newest_first(db_connection, user_id, before_id=last_id + 1):
+                if len(messages) >= SUMMARY_SOURCE_MAX_MESSAGES or message.content.startswith(SUMMARY_PREFIX):
+                    break
+                messages.append(message)
+            if not messages:
+                continue  # Only the summary of the previous run is left to trim.
+
+            # Summary of the previous run is the oldest message. It is deleted now, so it is folded into the new one,
+            # even if it is not among the newest expired messages.
+            previous_summary = get_oldest_chat_message(db_connection, user_id)
+            if previous_summary is not None and previous_summary.content.startswith(SUMMARY_PREFIX):
+                messages.append(previous_summary)
+            else:
+                previous_summary = None
+
+            summary = truncate_to_tokens(summarize(messages[::-1]), SUMMARY_MAX_TOKENS)
+            replace_with_summary(db_connection, last_id, SUMMARY_PREFIX + summary)
+            stats["summarized"] += len(messages) - (previous_summary is not None)
+            last_id -= 1
+
+        stats["users"] += 1
+        stats["deleted"] += delete_chat_history(db_connection, user_id, last_id, batch_size=batch_size)
+
+    return stats
+
+
+def main(args):
+    db_connection = open_connection(USERS_API_KEYS_DB_FILE)
+    try:
+        if args.command == 'export':
+            user_id = None
+            if args.user_key is not None:
+                user_id = get_user_id_by_api_key(db_connection, args.user_key)
+                if user_id is None:
+                    print("error: Key not found:", args.user_key, file=sys.stderr)
+                    sys.exit(1)
+
+            if args.output == '-':
+                exported = export_chat_history(db_connection, sys.stdout, user_id=user_id)
+            else:
+                with open(args.output, 'w', encoding='utf-8') as out:
+                    exported = export_chat_history(db_connection, out, user_id=user_id)
+            print(f"Exported {exported} messages", file=sys.stderr)
+            return
+
+        if args.command == 'retain':
+            if not (args.max_messages or args.max_age_days):
+                print("error: Set --max-messages or --max-age-days", file=sys.stderr)
+                sys.exit(1)
+
+            summarize = None
+            if args.summarize:
+                from utils import make_history_summarizer  # Needs OPENAI_API_KEY, so it is imported only if used.
+                summarize = make_history_summarizer()
+
+            stats = apply_retention(db_connection, max_messages=args.max_messages, max_age_days=args.max_age_days,
+                                    summarize=summarize, batch_size=args.batch_size)
+            print(f"Trimmed history of {stats['users']} users: {stats['deleted']} messages deleted, "
+                  f"{stats['summarized']} of them summarized", file=sys.stderr)
+            if args.no_compact:
+                return
+
+        if compact_db(db_connection, max_free_pages=args.max_free_pages,
+                      convert=args.command == 'compact' and args.convert):
+            print("Database compacted", file=sys.stderr)
+        else:
+            print("warning: Database is not compacted, as it has to be converted first. "
+                  "Stop the server and run `compact --convert`", file=sys.stderr)
+    finally:
+        db_connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help='Export chat history as JSON lines')
+    export_parser.add_argument('--user-key', metavar='KEY', help='Export history of the user with that API key only')
+    export_parser.add_argument('--output', default='-', help='File to write to. Standard output by default')
+
+    compact_parser = argparse.ArgumentParser(add_help=False)
+    compact_parser.add_argument('--max-free-pages', type=int, help='Free at most that many pages. All by default')
+
+    retain_parser = commands.add_parser('retain', parents=[compact_parser],
+                                        help='Delete (or summarize) old messages, then compact the database')
+    retain_parser.add_argument('--max-messages', type=int, default=CHAT_HISTORY_MAX_MESSAGES,
+                               help='Newest messages of every user to keep (CHAT_HISTORY_MAX_MESSAGES by default)')
+    retain_parser.add_argument('--max-age-days', type=float, default=CHAT_HISTORY_MAX_AGE_DAYS,
+                               help='Delete older messages (CHAT_HISTORY_MAX_AGE_DAYS by default)')
+    retain_parser.add_argument('--summarize', action='store_true',
+                               help='Replace deleted messages of every user with their summary, written by the model')
+    retain_parser.add_argument('--batch-size', type=int, default=CHAT_HISTORY_MAINTENANCE_BATCH_SIZE,
+                               help='Messages deleted per transaction')
+    retain_parser.add_argument('--no-compact', action='store_true', help='Do not compact the database afterwards')
+
+    compact_command_parser = commands.add_parser('compact', parents=[compact_parser], help='Compact the database')
+    compact_command_parser.add_argument('--convert', action='store_true',
+                                        help='Convert the database, created without incremental auto-vacuum, '
+                                             'by rewriting it. It is locked meanwhile, so stop the server first')
+
+    main(parser.parse_args())
@@ -0,0 +1,86 @@
+import re
+from collections import deque
+from typing import Deque, Iterable, Iterator, NamedTuple
+
+from langchain.docstore.document import Document
+
+from app_types import PageData
+from config import CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS
+from tokens import count_tokens_batch, split_to_tokens
+
+# Chunks are made of whole sentences (or lines), unless a sentence does not fit a chunk on its own.
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+class _Segment(NamedTuple):
+    text: str
+    tokens: int
+    page_num: int
+
+
+def _iter_segments(pages: Iterable[PageData], chunk_tokens: int) -> Iterator[_Segment]:
+    for page in pages:
+        texts = [text for text in _SENTENCE_BOUNDARY.split(page.text) if text and not text.isspace()]
+        for text, tokens in zip(texts, count_tokens_batch(texts)):
+            if tokens <= chunk_tokens:
+                yield _Segment(text, tokens, page.num)
+            else:
+                for piece, piece_tokens in split_to_tokens(text, chunk_tokens):
+                    yield _Segment(piece, piece_tokens, page.num)
+
+
+def _make_chunk(segments: Deque[_Segment], index: int, metadata: dict) -> Document:
+    first_page = segments[0].page_num
+    last_page = segments[-1].page_num
+    pages = f"p{first_page}" if first_page == last_page else f"p{first_page}-p{last_page}"
+    return Document(
+        page_content=" ".join(segment.text for segment in segments),
+        metadata={
+            "page_number": first_page,
+            "page_end": last_page,
+            "chunk": index,
+            "source": f"{pages}-{index}",
+            **metadata,
+        }
+    )
+
+
+def iter_token_chunks(pages: Iterable[PageData],
+                      metadata: dict,
+                      chunk_tokens: int = CHUNK_TOKENS,
+                      overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[Document]:
+    """
+    Splits the document into chunks of at most `chunk_tokens` tokens. Unlike utils.iter_text_chunks,
+    chunks are not bound to pages, so sentences, which continue on the next page, are not cut.
+    Every chunk records the first (page_number) and the last (page_end) of its pages.
+
+    Pages are encoded once, sentence by sentence, and are read lazily: only the current chunk is held.
+    Number of tokens of the chunk is the sum of the ones of its sentences, so it may differ from the
+    number of tokens of the joined text by a few tokens.
+
+    :param pages:           Cleaned pages of the document.
+    :param metadata:        Metadata of the document, added to every chunk.
+    :param chunk_tokens:    Maximum size of the chunk.
+    :param overlap_tokens:  Maximum size of the end of the chunk, repeated in the beginning of the next one.
+    """
+    window: Deque[_Segment] = deque()
+    window_tokens = 0
+    has_new_segments = False  # Window has more than the overlap of the previous chunk.
+    index = 0
+
+    for segment in _iter_segments(pages, chunk_tokens):
+        if has_new_segments and window_tokens + segment.tokens > chunk_tokens:
+            yield _make_chunk(window, index, metadata)
+            index += 1
+            has_new_segments = False
+
+            while window and (window_tokens > overlap_tokens or window_tokens + segment.tokens > chunk_tokens):
+                window_tokens -= window.popleft().tokens
+
+        window.append(segment)
+        window_tokens += segment.tokens
+        has_new_segments = True
+
+    if has_new_segments:
+        yield _make_chunk(window, index, metadata)
+
@@ -0,0 +1,180 @@
+import asyncio
+import re
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterator, List, Optional, TypeVar
+
+from langchain.embeddings.base import Embeddings
+
+from config import EMBEDDING_BATCH_WINDOW, EMBEDDING_BATCH_SIZE
+
+T = TypeVar('T')
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """
+    :return: Question without differences, which do not change the answer: case, spaces and final punctuation.
+    """
+    return _SPACES.sub(" ", question).strip().rstrip("?!. ").lower()
+
+
+class LeaderGone(Exception):
+    """
+    Request, which was doing the call for the others, was cancelled (e.g. its client disconnected).
+    """
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one: the first caller (the leader) does the call,
+    and the others wait for its result. Nothing is cached: once the call finishes, the next one is done again.
+
+    If the leader is cancelled, waiting callers do not fail: one of them does the call instead.
+    If the call raises, all waiting callers get the exception.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, asyncio.Future] = {}
+
+        self.leaders = 0
+        self.followers = 0
+
+    @contextmanager
+    def lead(self, key: Optional[Hashable]) -> Iterator[asyncio.Future]:
+        """
+        Registers the call of the caller, so that others can `wait` for it. The caller should set the result
+        of the yielded future. If the block is left without the result, waiting callers are released.
+        :param key: Key of the call. With None, or if the same call is in flight already, nothing is registered.
+        """
+        future = asyncio.get_running_loop().create_future()
+        registered = key is not None and key not in self._flights
+        if registered:
+            self._flights[key] = future
+            self.leaders += 1
+        try:
+            yield future
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            raise
+        finally:
+            if registered:
+                del self._flights[key]
+            if not future.done():
+                future.set_exception(LeaderGone())
+            future.exception()  # Marks the exception retrieved, so that asyncio does not log it, if nobody waited.
+
+    async def wait(self, key: Hashable, default: Any = None) -> Any:
+        """
+        :return: Result of the call, which is in flight, or `default`, if there is none, or its leader is gone.
+        """
+        future = self._flights.get(key)
+        if future is None:
+            return default
+        self.followers += 1
+        try:
+            return await asyncio.shield(future)
+        except LeaderGone:
+            return default
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        :return: Result of `func`, called by this caller, or by a concurrent one with the same key.
+        """
+        while True:
+            if key not in self._flights:
+                with self.lead(key) as future:
+                    result = await func()
+                    future.set_result(result)
+                    return result
+
+            future = self._flights[key]
+            self.followers += 1
+            try:
+                return await asyncio.shield(future)
+            except LeaderGone:
+                continue
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._flights), "leaders": self.leaders, "followers": self.followers}
+
+
+class _Batch:
+    def __init__(self):
+        self.texts: List[str] = []
+        self.futures: List[Future] = []
+        self.full = threading.Event()
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Embeds queries of concurrent requests with one call: the first query waits for up to `window` seconds
+    (or until `max_batch_size` queries are collected), and all queries, collected by then, are embedded together.
+    Identical queries of the batch are embedded once.
+
+    Calls are blocking, so it batches queries of different threads, e.g. of concurrency.blocking_executor.
+    Documents are embedded at once: they come in batches already.
+    """
+
+    def __init__(self,
+                 embeddings: Embeddings,
+                 window: float = EMBEDDING_BATCH_WINDOW,
+                 max_batch_size: int = EMBEDDING_BATCH_SIZE):
+        """
+        :param embeddings:      Embeddings to embed batches with.
+        :param window:          Seconds, the first query of the batch waits for others.
+        :param max_batch_size:  Maximum number of queries per call.
+        """
+        self._embeddings = embeddings
+        self._window = window
+        self._max_batch_size = max_batch_size
+
+        self._lock = threading.Lock()
+        self._batch: Optional[_Batch] = None
+
+        self.queries = 0
+        self.calls = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        future = Future()
+        with self._lock:
+            self.queries += 1
+            batch = self._batch
+            is_leader = batch is None
+            if is_leader:
+                batch = self._batch = _Batch()
+            batch.texts.append(text)
+            batch.futures.append(future)
+            if len(batch.texts) >= self._max_batch_size:
+                self._batch = None  # Next query starts the next batch.
+                batch.full.set()
+
+        if is_leader:
+            batch.full.wait(self._window)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+                self.calls += 1
+            self._embed_batch(batch)
+
+        return future.result()
+
+    def _embed_batch(self, batch: _Batch):
+        unique_texts = list(dict.fromkeys(batch.texts))
+        try:
+            vectors = dict(zip(unique_texts, self._embeddings.embed_documents(unique_texts)))
+        except Exception as e:
+            for future in batch.futures:
+                future.set_exception(e)
+        else:
+            for text, future in zip(batch.texts, batch.futures):
+                future.set_result(vectors[text])
+
+    def stats(self) -> dict:
+        return {"queries": self.queries, "calls": self.calls}
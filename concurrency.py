@@ -0,0 +1,31 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+from config import BLOCKING_EXECUTOR_MAX_WORKERS, MAX_CONCURRENT_LLM_REQUESTS
+
+blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_EXECUTOR_MAX_WORKERS, thread_name_prefix='blocking')
+
+# Limits requests, waiting for the model at the same time. Not bound to event loop until first used.
+llm_semaphore = asyncio.Semaphore(MAX_CONCURRENT_LLM_REQUESTS)
+
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """
+    Runs blocking function (sqlite3, tokenization, etc.) in the bounded thread pool.
+    Context variables of the caller (e.g. timings of the request, see metrics.span) are seen by the function.
+    :return: Result of the function.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(blocking_executor, partial(context.run, func, *args, **kwargs))
+
+
+def use_blocking_executor_by_default():
+    """
+    Makes the running event loop use the bounded thread pool for `run_in_executor(None, ...)` calls.
+    langchain runs vector store queries of async chains that way.
+    """
+    asyncio.get_running_loop().set_default_executor(blocking_executor)
@@ -3,11 +3,127 @@ import os
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", None)
 
 VECTOR_STORE_COLLECTION_NAME = 'terms_of_service'
-VECTOR_STORE_PATH = 'src/data/chroma'
-if not os.path.exists(VECTOR_STORE_PATH):
-    os.makedirs(VECTOR_STORE_PATH)
+# Created by persist_document.py, which writes it. Servers only read it.
+VECTOR_STORE_PATH = os.environ.get("VECTOR_STORE_PATH", 'src/data/chroma')
 
+# 'chroma', or 'numpy' for in-process store of memory-mapped vectors, see numpy_vector_store.NumpyVectorStore.
+VECTOR_STORE_BACKEND = os.environ.get("VECTOR_STORE_BACKEND", 'chroma')
+NUMPY_VECTOR_STORE_PATH = os.path.join(VECTOR_STORE_PATH, 'numpy')
 
-USERS_API_KEYS_DB_FILE = './users.sqlite3'
+# Lexical index of the chunks, built by persist_document.py, see bm25_index.BM25Index.
+BM25_INDEX_FILE = os.path.join(VECTOR_STORE_PATH, 'bm25.json')
+# 'hybrid' fuses lexical and vector search results (see hybrid_retriever.HybridRetriever), 'vector' uses vectors only.
+# Hybrid retrieval falls back to vectors only, until the lexical index is built.
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", 'hybrid')
+RETRIEVAL_K = 4  # Chunks, given to the model.
+RETRIEVAL_CANDIDATES = 20  # Chunks, taken from every search for fusion.
+RRF_K = 60
+# Question is answered from the lexical index alone, if the best match scores at least that share of the maximum
+# possible score (every word of the question once gives 0.4 in chunk of average length, and less in longer ones),
+# and at least LEXICAL_CONFIDENCE_MARGIN times more than the next match.
+LEXICAL_CONFIDENCE = float(os.environ.get("LEXICAL_CONFIDENCE", 0.3))
+LEXICAL_CONFIDENCE_MARGIN = float(os.environ.get("LEXICAL_CONFIDENCE_MARGIN", 1.5))
+
+# Rewritten by persist_document.py after every ingestion, so that running servers
+# know that the persisted collection has changed and the chain should be rebuilt.
+VECTOR_STORE_VERSION_FILE = os.path.join(VECTOR_STORE_PATH, 'version')
+CHAIN_RELOAD_CHECK_INTERVAL = float(os.environ.get("CHAIN_RELOAD_CHECK_INTERVAL", 5.0))  # Seconds.
+
+
+USERS_API_KEYS_DB_FILE = os.environ.get("USERS_API_KEYS_DB_FILE", './users.sqlite3')
 GPT_3_5_TURBO_TOKEN_LIMIT = 4096
 MAX_RESPONSE_TOKENS = 256
+# Chat history is read newest first, by pages of this size, until the token budget of the request is full.
+CHAT_HISTORY_PAGE_SIZE = int(os.environ.get("CHAT_HISTORY_PAGE_SIZE", 50))
+# What to do with messages, which do not fit: 'recency' drops them, 'summarize' replaces them with their summary.
+CHAT_HISTORY_TRIM_POLICY = os.environ.get("CHAT_HISTORY_TRIM_POLICY", 'recency')
+SUMMARY_MAX_TOKENS = 200
+SUMMARY_SOURCE_MAX_MESSAGES = 20  # At most that many dropped messages are summarized.
+SUMMARY_CACHE_SIZE = int(os.environ.get("SUMMARY_CACHE_SIZE", 1000))  # Summaries of dropped messages, kept by server.
+# Retention of chat history, applied by chat_history_maintenance.py: all but CHAT_HISTORY_MAX_MESSAGES newest messages
+# of every user, and messages older than CHAT_HISTORY_MAX_AGE_DAYS, are deleted or summarized. 0 keeps them.
+CHAT_HISTORY_MAX_MESSAGES = int(os.environ.get("CHAT_HISTORY_MAX_MESSAGES", 0))
+CHAT_HISTORY_MAX_AGE_DAYS = float(os.environ.get("CHAT_HISTORY_MAX_AGE_DAYS", 0))
+CHAT_HISTORY_MAINTENANCE_BATCH_SIZE = int(os.environ.get("CHAT_HISTORY_MAINTENANCE_BATCH_SIZE", 1000))
+
+# Follow-up questions may be rephrased into standalone ones by the model, before retrieval (see
+# answer_pipeline.CondenseMode): 'never', 'heuristic' (only questions, which look like follow-ups) or 'always'.
+CONDENSE_MODE = os.environ.get("CONDENSE_MODE", 'heuristic')
+# Rephrasing is simple, so cheaper model, or local one, served by OpenAI-compatible API, will do.
+CONDENSE_MODEL_NAME = os.environ.get("CONDENSE_MODEL_NAME", 'gpt-3.5-turbo')
+CONDENSE_OPENAI_API_BASE = os.environ.get("CONDENSE_OPENAI_API_BASE")  # OpenAI API by default.
+
+# 'openai', or 'fake' for deterministic local models (see fake_models.py), which answer after FAKE_CHAT_LATENCY
+# and embed after FAKE_EMBEDDING_LATENCY seconds, cost nothing and need no network: for benchmarks.
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", 'openai')
+FAKE_CHAT_LATENCY = float(os.environ.get("FAKE_CHAT_LATENCY", 0.5))  # Seconds per chat completion.
+FAKE_EMBEDDING_LATENCY = float(os.environ.get("FAKE_EMBEDDING_LATENCY", 0.05))  # Seconds per embeddings call.
+FAKE_EMBEDDING_SIZE = int(os.environ.get("FAKE_EMBEDDING_SIZE", 1536))  # As of OpenAI text-embedding-ada-002.
+
+# Blocking work (sqlite3, tokenization, vector store queries) is run in the bounded thread pool,
+# so the event loop stays free while it is done.
+BLOCKING_EXECUTOR_MAX_WORKERS = int(os.environ.get("BLOCKING_EXECUTOR_MAX_WORKERS", 8))
+# How many requests may wait for the model at the same time. Others wait in the queue.
+MAX_CONCURRENT_LLM_REQUESTS = int(os.environ.get("MAX_CONCURRENT_LLM_REQUESTS", 16))
+# Every thread of the blocking executor may hold one connection.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", BLOCKING_EXECUTOR_MAX_WORKERS))
+DB_BUSY_TIMEOUT = float(os.environ.get("DB_BUSY_TIMEOUT", 5.0))  # Seconds to wait for lock of other writer.
+
+# Requests with this header (e.g. `X-Profile: 1`) get the timing breakdown of their stages in the Server-Timing
+# header of the response, see metrics.TimingMiddleware. Empty value disables it.
+PROFILING_HEADER = os.environ.get("PROFILING_HEADER", 'X-Profile')
+# Workers of serve.py write their metrics to files in this directory, so that /metrics of any worker shows
+# metrics of all of them. serve.py sets it, when it runs several workers.
+METRICS_MULTIPROCESS_DIR = os.environ.get("METRICS_MULTIPROCESS_DIR")
+# Server starts accepting connections before it is warmed up (see main.warm_up). Requests, which come before
+# it is ready, wait for it that long, and get 503 then. /healthz answers at once.
+STARTUP_WAIT_TIMEOUT = float(os.environ.get("STARTUP_WAIT_TIMEOUT", 30.0))  # Seconds.
+
+# Resolved API keys are cached in memory. Registering or revoking a key is noticed within the check interval.
+API_KEY_CACHE_TTL = float(os.environ.get("API_KEY_CACHE_TTL", 300))  # Seconds.
+API_KEY_CACHE_MAX_SIZE = int(os.environ.get("API_KEY_CACHE_MAX_SIZE", 10000))
+API_KEY_REVISION_CHECK_INTERVAL = float(os.environ.get("API_KEY_REVISION_CHECK_INTERVAL", 1.0))  # Seconds.
+
+# Answers to questions, asked without chat history, are cached by embedding of the question.
+# Any later question, which is similar enough, gets the cached answer without asking the model.
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.environ.get("ANSWER_CACHE_SIMILARITY_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", 24 * 60 * 60))  # Seconds.
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 1000))
+# 'memory' keeps answers in the server process. 'sqlite' keeps them in ANSWER_CACHE_DB_FILE, so that all workers
+# of serve.py share them, see answer_cache.SharedAnswerCache. serve.py uses 'sqlite', when it runs several workers.
+ANSWER_CACHE_BACKEND = os.environ.get("ANSWER_CACHE_BACKEND", 'memory')
+ANSWER_CACHE_DB_FILE = os.environ.get("ANSWER_CACHE_DB_FILE", './answers.sqlite3')
+
+# Vectors of document chunks and questions are cached on disk by hash of their texts,
+# so re-ingestion of unchanged documents and repeated questions cost no embedding calls.
+EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "1") == "1"
+EMBEDDING_CACHE_DB_FILE = os.environ.get("EMBEDDING_CACHE_DB_FILE", './embeddings.sqlite3')
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 100000))  # ~600 MB of OpenAI vectors.
+# Last use of the cached vector, which eviction goes by, is written on hit only if it is older than that many seconds,
+# so that hits are reads, and do not take the write lock of the database, shared with other processes.
+EMBEDDING_CACHE_TOUCH_INTERVAL = float(os.environ.get("EMBEDDING_CACHE_TOUCH_INTERVAL", 3600))
+
+# Stored chunks name their PDF by its path relative to this directory (see ingestion.document_key), so the same
+# file is found again, whether it is given by relative or absolute path, and from whichever working directory.
+DOCUMENTS_ROOT = os.environ.get("DOCUMENTS_ROOT", os.path.dirname(os.path.abspath(__file__)))
+
+# persist_document.py parses PDFs in that many processes, and embeds new chunks in batches,
+# with up to that many batches being embedded at the same time.
+INGESTION_WORKERS = int(os.environ.get("INGESTION_WORKERS", os.cpu_count() or 1))
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 100))
+MAX_CONCURRENT_EMBEDDING_REQUESTS = int(os.environ.get("MAX_CONCURRENT_EMBEDDING_REQUESTS", 4))
+EMBEDDING_RETRY_ATTEMPTS = int(os.environ.get("EMBEDDING_RETRY_ATTEMPTS", 5))
+
+# Concurrent identical questions (without chat history) are answered by one model call, see coalescing.SingleFlight.
+COALESCE_QUESTIONS = os.environ.get("COALESCE_QUESTIONS", "1") == "1"
+# Queries of concurrent requests are embedded by one call, if they come within that many seconds.
+# 0 embeds every query on its own. See coalescing.BatchingEmbeddings.
+EMBEDDING_BATCH_WINDOW = float(os.environ.get("EMBEDDING_BATCH_WINDOW", 0.005))
+
+# Documents are split into chunks of about that many tokens (of the chat model), which may span pages.
+# Neighbour chunks share up to CHUNK_OVERLAP_TOKENS tokens of whole sentences.
+CHUNK_TOKENS = int(os.environ.get("CHUNK_TOKENS", 400))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", 50))
+# Retrieved chunks are sent along with the chat history, so their tokens are reserved in the budget of the request.
+DOCUMENTS_MAX_TOKENS = RETRIEVAL_K * CHUNK_TOKENS
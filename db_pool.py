@@ -0,0 +1,91 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+from config import DB_POOL_SIZE, DB_BUSY_TIMEOUT
+
+# WAL lets readers work while a write is in progress, and with synchronous=NORMAL a commit
+# does not wait for fsync (it is done on checkpoint). Database stays consistent on power loss,
+# only the last transactions may be lost.
+PRAGMAS = (
+    # Same as in db_services.re_initialize_db, but it must come before WAL mode, which writes the header of the file.
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",  # 16 MB per connection.
+)
+
+
+def open_connection(db_file: str, busy_timeout: float = DB_BUSY_TIMEOUT) -> sqlite3.Connection:
+    """
+    Opens connection with tuned pragmas. Connection may be used from any thread, but by one thread at a time.
+    """
+    connection = sqlite3.connect(db_file, timeout=busy_timeout, check_same_thread=False)
+    for pragma in PRAGMAS:
+        connection.execute(pragma)
+    return connection
+
+
+class ConnectionPool:
+    """
+    Fixed size pool of sqlite3 connections, shared by the threads of the blocking executor.
+    Connections are opened lazily. When all of them are in use, caller waits for one to be returned.
+    """
+
+    def __init__(self, db_file: str, size: int = DB_POOL_SIZE, busy_timeout: float = DB_BUSY_TIMEOUT):
+        self._db_file = db_file
+        self._busy_timeout = busy_timeout
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._size = size
+        self._opened = 0
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrows connection from the pool. Transaction, left open by the caller, is rolled back.
+        """
+        connection = self._acquire()
+        try:
+            yield connection
+        finally:
+            if connection.in_transaction:
+                connection.rollback()
+            self._idle.put(connection)
+
+    def close(self):
+        """
+        Closes idle connections. Connections, which are in use, are closed when returned and collected.
+        """
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            connection.close()
+            with self._lock:
+                self._opened -= 1
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened < self._size
+            if can_open:
+                self._opened += 1
+
+        if can_open:
+            try:
+                return open_connection(self._db_file, self._busy_timeout)
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        return self._idle.get()
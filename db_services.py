@@ -1,9 +1,11 @@
 import random
 import string
-from typing import Optional, List
+from typing import Optional, List, Iterator, Tuple
 from langchain.schema import HumanMessage, AIMessage
 
 from app_types import MessageType
+from config import CHAT_HISTORY_PAGE_SIZE, CHAT_HISTORY_MAINTENANCE_BATCH_SIZE
+from tokens import count_tokens
 
 
 def get_user_id_by_api_key(db_connection, api_key: str) -> Optional[str]:
@@ -14,6 +16,10 @@ def get_user_id_by_api_key(db_connection, api_key: str) -> Optional[str]:
 
 
 def re_initialize_db(connection):
+    # Lets chat_history_maintenance.py return pages of deleted messages to the file system without rewriting it.
+    # Takes effect only for new databases, and only if WAL mode is not set yet (db_pool.open_connection sets it
+    # after this pragma). Existing ones are converted by `compact_db(convert=True)`.
+    connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
     connection.execute('''CREATE TABLE IF NOT EXISTS User
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
                   key TEXT)''')
@@ -26,18 +32,87 @@ def re_initialize_db(connection):
                   text TEXT,
                   FOREIGN KEY (user_id) REFERENCES User(id))''')
 
+    # Single row. Is bumped whenever keys are registered or revoked, so that servers drop their cached keys.
+    connection.execute('''CREATE TABLE IF NOT EXISTS ApiKeyRevision
+                 (id INTEGER PRIMARY KEY CHECK (id = 0),
+                  revision INTEGER NOT NULL)''')
+    connection.execute('INSERT OR IGNORE INTO ApiKeyRevision (id, revision) VALUES (0, 0)')
+
     connection.commit()
 
+    migrate_db(connection)
+
+
+# Schema changes, applied in order on top of the tables, created by re_initialize_db.
+# Number of applied migrations is kept in `PRAGMA user_version`. Only append new migrations.
+MIGRATIONS = [
+    # 1. Chat history is read by user, newest messages first.
+    [
+        'CREATE INDEX IF NOT EXISTS MessageUserIdId ON Message (user_id, id)',
+    ],
+    # 2. Number of tokens in the message text is counted once, when message is saved.
+    #    It is NULL for messages, saved before, and is counted when such message is read.
+    [
+        'ALTER TABLE Message ADD COLUMN token_count INTEGER',
+    ],
+]
+
+
+def migrate_db(connection):
+    """
+    Applies migrations, which were not applied to the database yet. Every migration is applied in own transaction.
+    Safe to run by several processes at once (e.g. workers of serve.py): the version is read under the write lock,
+    so every migration is applied by one of them.
+    """
+    while True:
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            version = connection.execute('PRAGMA user_version').fetchone()[0]
+            if version >= len(MIGRATIONS):
+                connection.rollback()
+                return
+            for statement in MIGRATIONS[version]:
+                connection.execute(statement)
+            connection.execute(f'PRAGMA user_version = {version + 1}')
+        except Exception:
+            connection.rollback()
+            raise
+        connection.commit()
+
+
+def get_api_keys_revision(db_connection) -> int:
+    cursor = db_connection.execute('SELECT revision FROM ApiKeyRevision WHERE id = 0')
+    result = cursor.fetchone()
+    return result[0] if result else 0
+
+
+def _bump_api_keys_revision(db_connection):
+    db_connection.execute('UPDATE ApiKeyRevision SET revision = revision + 1 WHERE id = 0')
+
 
 def register_new_api_key(db_connection) -> str:
     key = ''.join(random.choices(string.ascii_letters + string.digits, k=32))
     db_connection.execute('INSERT INTO User (key) VALUES (?)', (key,))
+    _bump_api_keys_revision(db_connection)
     db_connection.commit()
     return key
 
 
+def revoke_api_key(db_connection, api_key: str) -> bool:
+    """
+    Revokes the key. The user and their chat history are kept.
+    :return: True if the key was found and revoked.
+    """
+    cursor = db_connection.execute('UPDATE User SET key = NULL WHERE key = ?', (api_key,))
+    revoked = cursor.rowcount > 0
+    if revoked:
+        _bump_api_keys_revision(db_connection)
+    db_connection.commit()
+    return revoked
+
+
 def get_user_api_keys(db_connection) -> List[str]:
-    cursor = db_connection.execute('SELECT key FROM User')
+    cursor = db_connection.execute('SELECT key FROM User WHERE key IS NOT NULL')
 
     return [r[0] for r in cursor]
 
@@ -67,23 +142,46 @@ def add_ai_message(db_connection, user_id: int, message_text: str):
 
 
 def save_to_chat_history(db_connection, messages: List[MessageType], user_id: int):
+    """
+    Saves messages in single transaction, along with number of tokens in each of them.
+    """
+    rows = []
     for message in messages:
         if isinstance(message, HumanMessage):
-            add_user_message(db_connection, user_id, message.content)
+            rows.append((user_id, 'user', message.content, count_tokens(message.content)))
         elif isinstance(message, AIMessage):
-            add_ai_message(db_connection, user_id, message.content)
+            rows.append((user_id, 'AI', message.content, count_tokens(message.content)))
+
+    with db_connection:
+        db_connection.executemany(
+            """
+            INSERT INTO Message (user_id, sender, text, token_count)
+            VALUES (?, ?, ?, ?)
+            """,
+            rows
+        )
+
+
+def _to_message(sender: str, text: str) -> Optional[MessageType]:
+    if sender == 'user':
+        return HumanMessage(content=text)
+    elif sender == 'AI':
+        return AIMessage(content=text)
+    return None
 
 
 def load_chat_history(db_connection, user_id: int) -> List[MessageType]:
+    """
+    Loads whole chat history of the user, oldest messages first.
+    Server reads only recent messages, see `iter_chat_history_newest_first`.
+    """
     cursor = db_connection.cursor()
     cursor.execute(
         """
-        SELECT Message.sender, Message.text
-        FROM User
-        JOIN Message
-        ON User.id = Message.user_id
-        WHERE User.id = ?
-        ORDER BY Message.created_at
+        SELECT sender, text
+        FROM Message
+        WHERE user_id = ?
+        ORDER BY id
         """,
         (user_id,)
     )
@@ -91,9 +189,191 @@ def load_chat_history(db_connection, user_id: int) -> List[MessageType]:
 
     chat_history = []
     for sender, text in result:
-        if sender == 'user':
-            chat_history.append(HumanMessage(content=text))
-        elif sender == 'AI':
-            chat_history.append(AIMessage(content=text))
+        message = _to_message(sender, text)
+        if message is not None:
+            chat_history.append(message)
 
     return chat_history
+
+
+def get_oldest_chat_message(db_connection, user_id: int) -> Optional[MessageType]:
+    row = db_connection.execute(
+        'SELECT sender, text FROM Message WHERE user_id = ? ORDER BY id LIMIT 1',
+        (user_id,)
+    ).fetchone()
+    return _to_message(*row) if row is not None else None
+
+
+def iter_chat_history_newest_first(db_connection,
+                                   user_id: int,
+                                   page_size: int = CHAT_HISTORY_PAGE_SIZE,
+                                   before_id: Optional[int] = None) -> Iterator[Tuple[MessageType, int]]:
+    """
+    Lazily reads chat history of the user, newest messages first, page by page.
+    Next page is read only when previous one is consumed, so the caller may stop early.
+    :param before_id: Only messages with lower ids are read. All by default.
+    :return: Iterator of messages along with number of tokens in their texts.
+    """
+    # Keyset pagination: every page continues below the last read id, so it is a single range scan of the index.
+    last_id = before_id
+    while True:
+        if last_id is None:
+            cursor = db_connection.execute(
+                """
+                SELECT id, sender, text, token_count
+                FROM Message
+                WHERE user_id = ?
+                ORDER BY id DESC
+                LIMIT ?
+                """,
+                (user_id, page_size)
+            )
+        else:
+            cursor = db_connection.execute(
+                """
+                SELECT id, sender, text, token_count
+                FROM Message
+                WHERE user_id = ? AND id < ?
+                ORDER BY id DESC
+                LIMIT ?
+                """,
+                (user_id, last_id, page_size)
+            )
+        rows = cursor.fetchall()
+
+        for message_id, sender, text, token_count in rows:
+            message = _to_message(sender, text)
+            if message is not None:
+                yield message, token_count if token_count is not None else count_tokens(text)
+
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1][0]
+
+
+def iter_chat_history_rows(db_connection,
+                           user_id: Optional[int] = None,
+                           page_size: int = CHAT_HISTORY_PAGE_SIZE) -> Iterator[dict]:
+    """
+    Lazily reads stored messages of the user, or of all users, oldest first, page by page, e.g. to export them.
+    :return: Iterator of messages as dicts: id, user_id, sender, text and created_at.
+    """
+    user_filter, params = ("AND user_id = ?", (user_id,)) if user_id is not None else ("", ())
+    last_id = 0
+    while True:
+        rows = db_connection.execute(
+            f"""
+            SELECT id, user_id, sender, text, created_at
+            FROM Message
+            WHERE id > ? {user_filter}
+            ORDER BY id
+            LIMIT ?
+            """,
+            (last_id, *params, page_size)
+        ).fetchall()
+
+        for message_id, message_user_id, sender, text, created_at in rows:
+            yield {"id": message_id, "user_id": message_user_id, "sender": sender, "text": text,
+                   "created_at": created_at}
+
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1][0]
+
+
+def get_chat_history_user_ids(db_connection) -> List[int]:
+    """
+    :return: Ids of users, who have stored messages.
+    """
+    return [row[0] for row in db_connection.execute('SELECT DISTINCT user_id FROM Message ORDER BY user_id')]
+
+
+def find_expired_chat_history(db_connection,
+                              user_id: int,
+                              max_messages: Optional[int] = None,
+                              created_before: Optional[str] = None) -> Optional[int]:
+    """
+    :param max_messages:    Number of newest messages of the user to keep.
+    :param created_before:  Messages, created before that time (UTC, 'YYYY-MM-DD HH:MM:SS'), expire.
+    :return: Id of the newest expired message of the user (all older ones are expired too), or None.
+    """
+    last_ids = []
+    if max_messages is not None:
+        row = db_connection.execute(
+            'SELECT id FROM Message WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?',
+            (user_id, max_messages)
+        ).fetchone()
+        if row is not None:
+            last_ids.append(row[0])
+    if created_before is not None:
+        row = db_connection.execute(
+            'SELECT MAX(id) FROM Message WHERE user_id = ? AND created_at < ?',
+            (user_id, created_before)
+        ).fetchone()
+        if row[0] is not None:
+            last_ids.append(row[0])
+    return max(last_ids, default=None)
+
+
+def delete_chat_history(db_connection,
+                        user_id: int,
+                        last_id: int,
+                        batch_size: int = CHAT_HISTORY_MAINTENANCE_BATCH_SIZE) -> int:
+    """
+    Deletes messages of the user up to `last_id` (inclusive), in transactions of `batch_size` messages,
+    so that the server, which saves messages meanwhile, waits for the write lock only briefly.
+    :return: Number of deleted messages.
+    """
+    deleted = 0
+    while True:
+        with db_connection:
+            cursor = db_connection.execute(
+                """
+                DELETE FROM Message WHERE id IN
+                (SELECT id FROM Message WHERE user_id = ? AND id <= ? ORDER BY id LIMIT ?)
+                """,
+                (user_id, last_id, batch_size)
+            )
+        deleted += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return deleted
+
+
+def replace_with_summary(db_connection, message_id: int, summary: str):
+    """
+    Rewrites the message into the AI message with the summary, so that the summary keeps its place in the history.
+    """
+    with db_connection:
+        db_connection.execute(
+            "UPDATE Message SET sender = 'AI', text = ?, token_count = ? WHERE id = ?",
+            (summary, count_tokens(summary), message_id)
+        )
+
+
+def compact_db(db_connection, max_free_pages: Optional[int] = None, convert: bool = False) -> bool:
+    """
+    Returns free pages (of deleted rows) to the file system, and updates statistics of the query planner.
+    :param max_free_pages: At most that many pages are freed. All by default.
+    :param convert:        Convert the database, created without incremental auto-vacuum, by full VACUUM. It rewrites
+                           the whole file, and writers wait for it longer than DB_BUSY_TIMEOUT, so it is done
+                           with the server stopped. Otherwise free pages of such database are kept.
+    :return: Whether free pages were returned to the file system.
+    """
+    compacted = True
+    if db_connection.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:  # Not INCREMENTAL.
+        if convert:
+            db_connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            db_connection.execute('VACUUM')
+        else:
+            compacted = False
+    else:
+        # It frees one page per step and returns no rows, so `execute` would free one page only.
+        # `executescript` runs the statement to completion.
+        pages = '' if max_free_pages is None else f'({int(max_free_pages)})'
+        db_connection.executescript(f'PRAGMA incremental_vacuum{pages}')
+
+    db_connection.execute('ANALYZE')
+    db_connection.commit()
+    # In WAL mode freed pages reach the database file on checkpoint.
+    db_connection.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+    return compacted
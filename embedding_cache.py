@@ -0,0 +1,145 @@
+import hashlib
+import threading
+import time
+from typing import List, Optional, Dict, Iterable
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from config import EMBEDDING_CACHE_DB_FILE, EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_CACHE_TOUCH_INTERVAL
+from db_pool import open_connection
+
+_SQLITE_MAX_PARAMS = 500  # Keys per `IN (...)` lookup. SQLite limits number of query parameters.
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps embeddings with persistent cache: hash of the text -> vector.
+
+    Vectors are stored in SQLite as float32 BLOBs (6 KB per OpenAI vector), so they survive restarts and
+    are shared by ingestion (persist_document.py) and the server. Unchanged chunks of the document are
+    not embedded again, and repeated questions are embedded once.
+    When there are more than `max_entries` vectors, the least recently used ones are deleted. Time of the last use
+    is precise to `touch_interval` seconds.
+    """
+
+    def __init__(self,
+                 embeddings: Embeddings,
+                 namespace: str,
+                 db_file: str = EMBEDDING_CACHE_DB_FILE,
+                 max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+                 touch_interval: float = EMBEDDING_CACHE_TOUCH_INTERVAL):
+        """
+        :param embeddings:  Embeddings to compute missing vectors with.
+        :param namespace:   Identifies the model, e.g. its name. Vectors of different models never mix.
+        :param db_file:     SQLite file of the cache.
+        :param max_entries: Maximum number of cached vectors.
+        :param touch_interval: Time of the last use of the vector is updated on hit, only if it is older than that.
+        """
+        self._embeddings = embeddings
+        self._namespace = namespace
+        self._db_file = db_file
+        self._max_entries = max_entries
+        self._touch_interval = touch_interval
+
+        self._lock = threading.Lock()
+        self._connection = None
+        self._count: Optional[int] = None  # Approximate, as other processes write too. Recounted on eviction.
+
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key('document', text) for text in texts]
+        cached = self._get_many(keys)
+
+        missing: Dict[bytes, str] = {key: text for key, text in zip(keys, texts) if key not in cached}
+        if missing:
+            vectors = self._embeddings.embed_documents(list(missing.values()))
+            cached.update(self._put_many(zip(missing.keys(), vectors)))
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key('query', text)
+        cached = self._get_many([key])
+        if key in cached:
+            return cached[key]
+
+        vector = self._embeddings.embed_query(text)
+        return self._put_many([(key, vector)])[key]
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _key(self, kind: str, text: str) -> bytes:
+        return hashlib.sha256(f"{self._namespace}\0{kind}\0{text}".encode()).digest()
+
+    def _get_connection(self):
+        if self._connection is None:
+            self._connection = open_connection(self._db_file)
+            with self._connection:
+                self._connection.execute('''CREATE TABLE IF NOT EXISTS Embedding
+                             (key BLOB PRIMARY KEY,
+                              vector BLOB NOT NULL,
+                              used_at REAL NOT NULL)''')
+                self._connection.execute('CREATE INDEX IF NOT EXISTS EmbeddingUsedAt ON Embedding (used_at)')
+        return self._connection
+
+    def _get_many(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+        unique_keys = list(dict.fromkeys(keys))
+        found = {}
+        now = time.time()
+        stale = []  # Keys of found vectors, whose time of the last use is to be updated.
+        with self._lock:
+            connection = self._get_connection()
+            with connection:
+                for start in range(0, len(unique_keys), _SQLITE_MAX_PARAMS):
+                    batch = unique_keys[start:start + _SQLITE_MAX_PARAMS]
+                    placeholders = ','.join('?' * len(batch))
+                    for key, vector, used_at in connection.execute(
+                            f'SELECT key, vector, used_at FROM Embedding WHERE key IN ({placeholders})', batch):
+                        found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+                        if now - used_at >= self._touch_interval:
+                            stale.append((now, key))
+                # Usually there are none, so the transaction is read only.
+                if stale:
+                    connection.executemany('UPDATE Embedding SET used_at = ? WHERE key = ?', stale)
+
+            self.hits += len(found)
+            self.misses += len(unique_keys) - len(found)
+        return found
+
+    def _put_many(self, items: Iterable) -> Dict[bytes, List[float]]:
+        now = time.time()
+        rows = []
+        stored = {}
+        for key, vector in items:
+            vector = np.asarray(vector, dtype=np.float32)
+            rows.append((key, vector.tobytes(), now))
+            stored[key] = vector.tolist()  # Same precision, as when read from the cache later.
+
+        with self._lock:
+            connection = self._get_connection()
+            with connection:
+                if self._count is None:
+                    self._count = connection.execute('SELECT COUNT(*) FROM Embedding').fetchone()[0]
+                cursor = connection.executemany(
+                    'INSERT OR REPLACE INTO Embedding (key, vector, used_at) VALUES (?, ?, ?)', rows)
+                self._count += cursor.rowcount
+
+                if self._count > self._max_entries:
+                    self._evict(connection)
+        return stored
+
+    def _evict(self, connection):
+        # Evicts down to 90% of the limit, so that it is not done on every insert.
+        self._count = connection.execute('SELECT COUNT(*) FROM Embedding').fetchone()[0]
+        excess = self._count - int(self._max_entries * 0.9)
+        if excess > 0 and self._count > self._max_entries:
+            connection.execute('''DELETE FROM Embedding WHERE key IN
+                               (SELECT key FROM Embedding ORDER BY used_at LIMIT ?)''', (excess,))
+            self._count -= excess
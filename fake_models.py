@@ -0,0 +1,122 @@
+"""
+Deterministic local stand-ins for OpenAI models (MODEL_BACKEND=fake), so that the whole server, and ingestion,
+can be benchmarked offline and for free, see benchmarks/bench_e2e.py. Latency of the models is configurable,
+everything else (retrieval, chat history, caches, tokenization) does its real work.
+"""
+import asyncio
+import hashlib
+import re
+import time
+import zlib
+from typing import List, Optional
+
+import numpy as np
+from langchain.chat_models.base import BaseChatModel
+from langchain.embeddings.base import Embeddings
+from langchain.schema import AIMessage, ChatGeneration, ChatResult
+
+from config import FAKE_CHAT_LATENCY, FAKE_EMBEDDING_LATENCY, FAKE_EMBEDDING_SIZE
+from tokens import count_tokens
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+ANSWER_WORDS = ("The", "terms", "of", "service", "say", "that", "fees", "are", "charged", "monthly", "and",
+                "refunds", "take", "up", "to", "ten", "business", "days", "from", "the", "dispute", "notice")
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Answers after `latency` seconds, with text, which depends only on the prompt. If `streaming`, the answer is
+    streamed word by word, and the latency is spread evenly between the words. Token usage is reported as by the
+    API: only for responses, which are not streamed. `calls` counts the requests to the "API".
+    """
+    model_name: str = "fake-chat"
+    latency: float = FAKE_CHAT_LATENCY
+    streaming: bool = False
+    answer_words: int = 40
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _answer(self, messages) -> List[str]:
+        """
+        :return: Words of the answer, with spaces before all but the first one, as the API streams them.
+        """
+        digest = hashlib.sha256("\n".join(message.content for message in messages).encode()).digest()
+        words = [ANSWER_WORDS[digest[i % len(digest)] % len(ANSWER_WORDS)] for i in range(self.answer_words)]
+        return [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+
+    def _result(self, messages, words: List[str]) -> ChatResult:
+        text = "".join(words)
+        llm_output = None
+        if not self.streaming:
+            llm_output = {"token_usage": {
+                "prompt_tokens": sum(count_tokens(message.content) for message in messages),
+                "completion_tokens": count_tokens(text),
+            }}
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))], llm_output=llm_output)
+
+    def _combine_llm_outputs(self, llm_outputs: List[Optional[dict]]) -> dict:
+        # As ChatOpenAI does.
+        token_usage = {}
+        for output in llm_outputs:
+            for name, value in (output or {}).get("token_usage", {}).items():
+                token_usage[name] = token_usage.get(name, 0) + value
+        return {"token_usage": token_usage, "model_name": self.model_name}
+
+    def _generate(self, messages, stop=None, run_manager=None) -> ChatResult:
+        self.calls += 1
+        words = self._answer(messages)
+        if self.streaming:
+            for word in words:
+                time.sleep(self.latency / len(words))
+                if run_manager:
+                    run_manager.on_llm_new_token(word)
+        else:
+            time.sleep(self.latency)
+        return self._result(messages, words)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None) -> ChatResult:
+        self.calls += 1
+        words = self._answer(messages)
+        if self.streaming:
+            for word in words:
+                await asyncio.sleep(self.latency / len(words))
+                if run_manager:
+                    await run_manager.on_llm_new_token(word)
+        else:
+            await asyncio.sleep(self.latency)
+        return self._result(messages, words)
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Embeds texts after `latency` seconds per call, by hashing their words into `size` dimensions, so that texts with
+    common words are similar, and retrieval and the semantic answer cache behave sensibly.
+    """
+
+    def __init__(self, latency: float = FAKE_EMBEDDING_LATENCY, size: int = FAKE_EMBEDDING_SIZE):
+        self.latency = latency
+        self.size = size
+        self.model = f"fake-{size}"
+        self.calls = 0
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in _WORD_PATTERN.findall(text.lower()):
+            bucket = zlib.crc32(word.encode())
+            vector[bucket % self.size] += 1.0 if bucket & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            vector[0] = norm = 1.0
+        return (vector / norm).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
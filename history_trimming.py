@@ -0,0 +1,200 @@
+import hashlib
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from enum import Enum
+from itertools import accumulate, islice
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from langchain.prompts.base import StringPromptValue
+from langchain.schema import BaseMessage, SystemMessage
+
+from answer_pipeline import record_llm_call
+from app_types import MessageType
+from config import GPT_3_5_TURBO_TOKEN_LIMIT, MAX_RESPONSE_TOKENS, CHAT_HISTORY_TRIM_POLICY, SUMMARY_MAX_TOKENS, \
+    SUMMARY_SOURCE_MAX_MESSAGES, DOCUMENTS_MAX_TOKENS, SUMMARY_CACHE_SIZE
+from tokens import count_tokens, truncate_to_tokens
+
+MESSAGE_OVERHEAD_TOKENS = 4 + 1  # Every message follows <im_start>[role/name]\n(content)<im_end>\n, role is 1 token.
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+
+class TrimPolicy(str, Enum):
+    RECENCY = 'recency'  # Keep as many of the most recent messages, as fit. Drop older ones.
+    SUMMARIZE = 'summarize'  # Same, but replace dropped messages with their summary.
+
+
+Summarizer = Callable[[List[MessageType]], str]
+
+
+def request_base_tokens(question_tokens: int,
+                        max_response_tokens: int = MAX_RESPONSE_TOKENS,
+                        document_tokens: int = DOCUMENTS_MAX_TOKENS) -> int:
+    """
+    :return: Tokens, spent by the request without chat history.
+    """
+    tokens_count = max_response_tokens  # Expected that tokens to be wasted by the model to respond user.
+    tokens_count += document_tokens  # Retrieved documents are not known yet, so the most they may take is reserved.
+    tokens_count += 2  # every reply (in the end) is primed with <im_start>assistant
+    tokens_count += 4  # Every message follows <im_start>[role/name]\n(content)<im_end>\n
+    tokens_count += question_tokens
+    return tokens_count
+
+
+def select_chat_history(question_tokens: int,
+                        recent_chat_history: Iterable[Tuple[MessageType, int]],
+                        policy: TrimPolicy = CHAT_HISTORY_TRIM_POLICY,
+                        token_limit: int = GPT_3_5_TURBO_TOKEN_LIMIT,
+                        max_response_tokens: int = MAX_RESPONSE_TOKENS,
+                        document_tokens: int = DOCUMENTS_MAX_TOKENS) -> Tuple[List[MessageType], List[MessageType]]:
+    """
+    Selects the most recent contiguous part of chat history, which fits the token budget of the request,
+    and messages to summarize (see `trim_chat_history`), without summarizing them. So the caller may release
+    the database, before the model is called, or take the summary from a cache (see `SummaryCache`).
+    Summary is added with `add_summary`.
+    :return: Kept messages, and messages to summarize (empty, unless some messages were dropped by SUMMARIZE policy),
+             oldest first.
+    :raises ValueError in case, if question has too many tokens provided.
+    """
+    base_tokens = request_base_tokens(question_tokens, max_response_tokens, document_tokens)
+    if base_tokens >= token_limit * 0.9:
+        raise ValueError("Too much tokens for model")
+
+    budget = token_limit * 0.8 - base_tokens
+
+    kept: List[MessageType] = []
+    costs: List[int] = []
+    spent = 0
+    overflow: Optional[MessageType] = None
+
+    recent_chat_history = iter(recent_chat_history)
+    for message, text_tokens in recent_chat_history:
+        cost = text_tokens + MESSAGE_OVERHEAD_TOKENS
+        if spent + cost >= budget:
+            overflow = message
+            break
+        kept.append(message)
+        costs.append(cost)
+        spent += cost
+
+    if overflow is None or policy != TrimPolicy.SUMMARIZE:
+        kept.reverse()
+        return kept, []
+
+    # Room for the summary is taken from the oldest kept messages. Prefix sums of costs (newest first)
+    # find how many of the newest messages still fit, with a single binary search.
+    summary_budget = budget - SUMMARY_MAX_TOKENS - count_tokens(SUMMARY_PREFIX) - MESSAGE_OVERHEAD_TOKENS
+    keep_count = bisect_left(list(accumulate(costs)), summary_budget)
+
+    dropped = kept[keep_count:]
+    dropped.append(overflow)
+    dropped.extend(message for message, _ in islice(recent_chat_history,
+                                                    max(SUMMARY_SOURCE_MAX_MESSAGES - len(dropped), 0)))
+    dropped = dropped[:SUMMARY_SOURCE_MAX_MESSAGES]
+    dropped.reverse()
+
+    kept = kept[:keep_count]
+    kept.reverse()
+    return kept, dropped
+
+
+def add_summary(kept: List[MessageType], summary: str) -> List[BaseMessage]:
+    """
+    :param kept:    Kept messages, oldest first.
+    :param summary: Summary of dropped messages. Is cut to SUMMARY_MAX_TOKENS.
+    :return: Summary as system message, followed by kept messages.
+    """
+    summary_message = SystemMessage(content=SUMMARY_PREFIX + truncate_to_tokens(summary, SUMMARY_MAX_TOKENS))
+    return [summary_message, *kept]
+
+
+def trim_chat_history(question_tokens: int,
+                      recent_chat_history: Iterable[Tuple[MessageType, int]],
+                      policy: TrimPolicy = CHAT_HISTORY_TRIM_POLICY,
+                      summarize: Optional[Summarizer] = None,
+                      token_limit: int = GPT_3_5_TURBO_TOKEN_LIMIT,
+                      max_response_tokens: int = MAX_RESPONSE_TOKENS,
+                      document_tokens: int = DOCUMENTS_MAX_TOKENS) -> List[BaseMessage]:
+    """
+    Selects the most recent contiguous part of chat history, which fits the token budget of the request.
+
+    History is read newest first, only until the budget is exhausted, so it may be a lazy iterator over the
+    database. Kept messages are never copied, and work is linear in number of read messages.
+    The budget is 80% of the token limit, for safe.
+
+    :param question_tokens:     Number of tokens in the question.
+    :param recent_chat_history: Previous messages, newest first, along with numbers of tokens in their texts.
+    :param policy:              What to do with messages, which do not fit.
+    :param summarize:           Function, that summarizes messages (oldest first). Required by SUMMARIZE policy.
+                                 Summary is added as system message before kept messages.
+                                 Up to SUMMARY_SOURCE_MAX_MESSAGES dropped messages are summarized.
+    :param token_limit:         Token limit of the model.
+    :param max_response_tokens: Tokens, reserved for the response.
+    :param document_tokens:     Tokens, reserved for the retrieved documents.
+    :return: Limited history, oldest messages first.
+    :raises ValueError in case, if question has too many tokens provided.
+    """
+    kept, dropped = select_chat_history(question_tokens, recent_chat_history, policy, token_limit,
+                                        max_response_tokens, document_tokens)
+    if not dropped:
+        return kept
+
+    if summarize is None:
+        raise ValueError("Summarize policy requires summarize function")
+    return add_summary(kept, summarize(dropped))
+
+
+class SummaryCache:
+    """
+    Summaries of dropped messages, by the user and the messages. Requests, which drop the same messages
+    (e.g. retried or concurrent ones), summarize them once. Keeps `size` most recently used summaries.
+    """
+
+    def __init__(self, size: int = SUMMARY_CACHE_SIZE):
+        self.size = size
+        self._summaries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(user_id: int, messages: List[MessageType]) -> tuple:
+        # By content rather than by ids of messages: chat_history_maintenance.py rewrites messages in place.
+        digest = hashlib.sha1()
+        for message in messages:
+            digest.update(f"{message.type}\0{message.content}\0".encode())
+        return user_id, digest.digest()
+
+    def get(self, user_id: int, messages: List[MessageType]) -> Optional[str]:
+        key = self._key(user_id, messages)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is not None:
+                self._summaries.move_to_end(key)
+            return summary
+
+    def put(self, user_id: int, messages: List[MessageType], summary: str):
+        key = self._key(user_id, messages)
+        with self._lock:
+            self._summaries[key] = summary
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > self.size:
+                self._summaries.popitem(last=False)
+
+
+_SUMMARY_TEMPLATE = ("Summarize the conversation between the user and the assistant below in a few sentences. "
+                     "Keep facts, that the user told about themselves, and questions, that are still open.\n\n"
+                     "{conversation}\n\nSummary:")
+
+
+def make_llm_summarizer(llm) -> Summarizer:
+    """
+    :param llm: Model to summarize with. Cheaper model is fine.
+    :return: Function, that summarizes messages with the model. Its calls are counted as "summarize" stage.
+    """
+
+    def summarize(messages: List[MessageType]) -> str:
+        conversation = "\n".join(f"{'User' if message.type == 'human' else 'Assistant'}: {message.content}"
+                                 for message in messages)
+        prompt = StringPromptValue(text=_SUMMARY_TEMPLATE.format(conversation=conversation))
+        return record_llm_call("summarize", llm, prompt, llm.generate_prompt([prompt])).strip()
+
+    return summarize
@@ -0,0 +1,102 @@
+from typing import Dict, List, Tuple
+
+from langchain.docstore.document import Document
+from langchain.schema import BaseRetriever
+
+from bm25_index import BM25Index
+from concurrency import run_blocking
+from config import RETRIEVAL_K, RETRIEVAL_CANDIDATES, RRF_K, LEXICAL_CONFIDENCE, LEXICAL_CONFIDENCE_MARGIN
+from metrics import RETRIEVALS
+
+
+def _document_key(document: Document) -> Tuple[str, str]:
+    return document.metadata.get('file', ''), document.page_content
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int, rrf_k: int = RRF_K) -> List[Document]:
+    """
+    Merges rankings: every document scores 1 / (rrf_k + rank) for every ranking it is in.
+    Only ranks are used, so scores of different retrievers need not be comparable.
+    :return: Up to `k` best documents.
+    """
+    scores: Dict[Tuple[str, str], float] = {}
+    documents: Dict[Tuple[str, str], Document] = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, start=1):
+            key = _document_key(document)
+            scores[key] = scores.get(key, 0.0) + 1 / (rrf_k + rank)
+            documents.setdefault(key, document)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[key] for key in best]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Combines lexical (BM25) and vector search with reciprocal rank fusion.
+
+    If the best lexical match is confident (it has most of the words of the question, and is clearly better than
+    the next one), lexical results are returned at once, without embedding the question and querying the vector store.
+    """
+
+    def __init__(self,
+                 vector_store,
+                 index: BM25Index,
+                 k: int = RETRIEVAL_K,
+                 candidates: int = RETRIEVAL_CANDIDATES,
+                 confidence: float = LEXICAL_CONFIDENCE,
+                 confidence_margin: float = LEXICAL_CONFIDENCE_MARGIN):
+        """
+        :param vector_store:        langchain vector store.
+        :param index:               Lexical index of the same chunks.
+        :param k:                   Number of documents to return.
+        :param candidates:          Number of documents to take from every retriever for fusion.
+        :param confidence:          Minimal score of the best lexical match, as a share of the maximum possible one.
+        :param confidence_margin:   Minimal ratio of scores of the best and the second lexical matches.
+        """
+        self._vector_store = vector_store
+        self._index = index
+        self._k = k
+        self._candidates = candidates
+        self._confidence = confidence
+        self._confidence_margin = confidence_margin
+
+        self.lexical_only = 0
+        self.fused = 0
+
+    def _search_lexical(self, query: str) -> Tuple[List[Document], bool]:
+        """
+        :return: Lexical matches, best first, and whether they are confident enough to skip vector search.
+        """
+        results = self._index.search(query, self._candidates)
+        confident = False
+        if results:
+            max_score = self._index.max_score(query)
+            best = results[0][1]
+            second = results[1][1] if len(results) > 1 else 0.0
+            confident = best >= self._confidence * max_score and best >= self._confidence_margin * second
+        return [self._index.document(row) for row, _ in results], confident
+
+    def get_relevant_documents(self, query: str) -> List[Document]:
+        lexical, confident = self._search_lexical(query)
+        if confident:
+            self.lexical_only += 1
+            RETRIEVALS.inc(path="lexical")
+            return lexical[:self._k]
+
+        self.fused += 1
+        RETRIEVALS.inc(path="fused")
+        vector = self._vector_store.similarity_search(query, k=self._candidates)
+        return reciprocal_rank_fusion([lexical, vector], self._k)
+
+    async def aget_relevant_documents(self, query: str) -> List[Document]:
+        # Scoring of the whole index is CPU bound, so it does not run on the event loop either.
+        lexical, confident = await run_blocking(self._search_lexical, query)
+        if confident:
+            self.lexical_only += 1
+            RETRIEVALS.inc(path="lexical")
+            return lexical[:self._k]
+
+        self.fused += 1
+        RETRIEVALS.inc(path="fused")
+        vector = await run_blocking(self._vector_store.similarity_search, query, k=self._candidates)
+        return reciprocal_rank_fusion([lexical, vector], self._k)
@@ -0,0 +1,224 @@
+import hashlib
+import json
+import os.path
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, TypeVar
+
+from langchain.docstore.document import Document
+
+from bm25_index import BM25Index
+from config import DOCUMENTS_ROOT, EMBEDDING_RETRY_ATTEMPTS
+
+T = TypeVar('T')
+
+# Metadata keys, added to every stored chunk. Chunks of the document are found by FILE_KEY,
+# and FILE_HASH_KEY tells whether the file has changed since it was stored. FILE_CHUNKS_KEY tells
+# whether all chunks of the file were stored, as ingestion might be interrupted.
+FILE_KEY = 'file'
+FILE_HASH_KEY = 'file_hash'
+FILE_CHUNKS_KEY = 'file_chunks'
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        while block := file.read(_HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def document_key(file_path: str, root: str = DOCUMENTS_ROOT) -> str:
+    """
+    Name of the file in the vector store (FILE_KEY): its real path, relative to the root of the documents.
+    Path, as typed, would depend on the working directory, and the file would be stored again under another name.
+    """
+    return os.path.relpath(os.path.realpath(file_path), os.path.realpath(root))
+
+
+def chunk_ids(file: str, chunks: List[Document]) -> List[str]:
+    """
+    Stable IDs of chunks: hash of the file name and the text of the chunk.
+    They do not depend on position of the chunk, so editing a page changes IDs of its chunks only.
+    Identical texts within the file are told apart by number of their occurrence.
+    """
+    ids = []
+    occurrences: Dict[str, int] = {}
+    for chunk in chunks:
+        text_hash = hashlib.sha256(f"{file}\0{chunk.page_content}".encode()).hexdigest()
+        occurrence = occurrences.get(text_hash, 0)
+        occurrences[text_hash] = occurrence + 1
+        ids.append(text_hash if occurrence == 0 else f"{text_hash}-{occurrence}")
+    return ids
+
+
+@dataclass
+class SyncPlan:
+    add_ids: List[str] = field(default_factory=list)
+    add_chunks: List[Document] = field(default_factory=list)
+    update_ids: List[str] = field(default_factory=list)  # Same text, but metadata (e.g. page number) changed.
+    update_metadatas: List[dict] = field(default_factory=list)
+    delete_ids: List[str] = field(default_factory=list)
+    unchanged: int = 0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.add_ids or self.update_ids or self.delete_ids)
+
+    def __str__(self):
+        return (f"{len(self.add_ids)} added, {len(self.update_ids)} updated, "
+                f"{len(self.delete_ids)} deleted, {self.unchanged} unchanged")
+
+
+def plan_sync(stored: Dict[str, dict], file: str, chunks: List[Document]) -> SyncPlan:
+    """
+    Compares chunks of the document with the ones, stored before.
+    :param stored:  ID -> metadata of the stored chunks of the file.
+    :param file:    Name of the file.
+    :param chunks:  Current chunks of the file. FILE_KEY and FILE_CHUNKS_KEY are added to their metadata.
+    :return: What should be done, so that the store has the current chunks only.
+             Only added chunks need to be embedded.
+    """
+    plan = SyncPlan()
+    current_ids = set()
+    for chunk_id, chunk in zip(chunk_ids(file, chunks), chunks):
+        current_ids.add(chunk_id)
+        chunk.metadata[FILE_KEY] = file
+        chunk.metadata[FILE_CHUNKS_KEY] = len(chunks)
+        stored_metadata = stored.get(chunk_id)
+        if stored_metadata is None:
+            plan.add_ids.append(chunk_id)
+            plan.add_chunks.append(chunk)
+        elif _same_metadata(stored_metadata, chunk.metadata):
+            plan.unchanged += 1
+        else:
+            plan.update_ids.append(chunk_id)
+            plan.update_metadatas.append(chunk.metadata)
+
+    plan.delete_ids = [chunk_id for chunk_id in stored if chunk_id not in current_ids]
+    return plan
+
+
+def _same_metadata(first: dict, second: dict) -> bool:
+    # Metadata is compared as it is stored: JSON scalars.
+    return json.dumps(first, sort_keys=True) == json.dumps(second, sort_keys=True)
+
+
+def _collection(vector_store):
+    # Chroma keeps chunks in chromadb collection. NumpyVectorStore has the same methods itself.
+    return getattr(vector_store, '_collection', vector_store)
+
+
+def get_stored_chunks(vector_store, file: str) -> Dict[str, dict]:
+    """
+    :param vector_store:    Chroma or NumpyVectorStore, see utils.make_vector_store.
+    :return: ID -> metadata of the stored chunks of the file.
+    """
+    result = _collection(vector_store).get(where={FILE_KEY: file}, include=['metadatas'])
+    return dict(zip(result['ids'], result['metadatas']))
+
+
+def get_stored_file_hash(stored: Dict[str, dict]) -> Optional[str]:
+    """
+    :return: Hash of the file, the stored chunks were made of. None if they were made of different versions,
+             or not all of them are stored.
+    """
+    versions = {(metadata.get(FILE_HASH_KEY), metadata.get(FILE_CHUNKS_KEY)) for metadata in stored.values()}
+    if len(versions) != 1:
+        return None
+    hash_, chunks = versions.pop()
+    return hash_ if chunks == len(stored) else None
+
+
+def apply_sync(vector_store, plan: SyncPlan):
+    """
+    Embeds and adds new chunks, updates metadata of moved ones and deletes the ones, which are gone.
+    """
+    apply_removals_and_updates(vector_store, plan)
+    if plan.add_ids:
+        vector_store.add_texts(
+            texts=[chunk.page_content for chunk in plan.add_chunks],
+            metadatas=[chunk.metadata for chunk in plan.add_chunks],
+            ids=plan.add_ids,
+        )
+
+
+def apply_removals_and_updates(vector_store, plan: SyncPlan):
+    """
+    Same as `apply_sync`, but new chunks are left to be embedded and added by the caller, see `add_embedded_chunks`.
+    """
+    if plan.delete_ids:
+        _collection(vector_store).delete(ids=plan.delete_ids)
+    if plan.update_ids:
+        _collection(vector_store).update(ids=plan.update_ids, metadatas=plan.update_metadatas)
+
+
+def add_embedded_chunks(vector_store, ids: List[str], chunks: List[Document], embeddings: List[List[float]]):
+    _collection(vector_store).add(
+        ids=ids,
+        embeddings=embeddings,
+        metadatas=[chunk.metadata for chunk in chunks],
+        documents=[chunk.page_content for chunk in chunks],
+    )
+
+
+def retry_with_backoff(func: Callable[[], T],
+                       attempts: int = EMBEDDING_RETRY_ATTEMPTS,
+                       base_delay: float = 1.0,
+                       max_delay: float = 60.0) -> T:
+    """
+    Calls `func`, and calls it again after exponentially growing (with jitter) delay, if it raised.
+    :raises the last exception, if all attempts failed.
+    """
+    for attempt in range(attempts):
+        try:
+            return func()
+        except Exception:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+
+def delete_legacy_chunks(vector_store) -> int:
+    """
+    Deletes chunks, stored before ingestion became incremental. They have random IDs and no FILE_KEY,
+    so they would never be replaced, and would duplicate the new ones.
+    :return: Number of deleted chunks.
+    """
+    result = _collection(vector_store).get(include=['metadatas'])
+    legacy_ids = [chunk_id for chunk_id, metadata in zip(result['ids'], result['metadatas'])
+                  if not metadata or FILE_KEY not in metadata]
+    if legacy_ids:
+        _collection(vector_store).delete(ids=legacy_ids)
+    return len(legacy_ids)
+
+
+def prune_removed_files(vector_store, directories: List[str], root: str = DOCUMENTS_ROOT) -> int:
+    """
+    Deletes chunks of the files, which were stored from the directories, but are no longer there.
+    :param directories: - Directories, the files were ingested from. Chunks of other files are kept.
+    :return: Number of deleted chunks.
+    """
+    prefixes = [document_key(directory, root) for directory in directories]
+    result = _collection(vector_store).get(include=['metadatas'])
+    removed_ids = []
+    for chunk_id, metadata in zip(result['ids'], result['metadatas']):
+        key = (metadata or {}).get(FILE_KEY)
+        if not key or os.path.isfile(os.path.join(root, key)):
+            continue
+        if any(prefix == os.curdir or key.startswith(prefix + os.sep) for prefix in prefixes):
+            removed_ids.append(chunk_id)
+    if removed_ids:
+        _collection(vector_store).delete(ids=removed_ids)
+    return len(removed_ids)
+
+
+def build_lexical_index(vector_store) -> BM25Index:
+    """
+    Builds the lexical index of all stored chunks, so that it matches the vector store exactly.
+    """
+    result = _collection(vector_store).get(include=['documents', 'metadatas'])
+    return BM25Index.build(result['ids'], result['documents'], result['metadatas'])
@@ -0,0 +1,367 @@
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union, TYPE_CHECKING
+
+from config import PROFILING_HEADER, METRICS_MULTIPROCESS_DIR
+
+if TYPE_CHECKING:
+    from langchain.embeddings.base import Embeddings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+# Value of the counter or the gauge, or counts per bucket of the histogram, followed by the sum of observed values.
+Sample = Union[float, List[float]]
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    labels = labels + extra
+    if not labels:
+        return ""
+    values = ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return f"{{{values}}}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != float('inf') else "+Inf"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0.0)
+
+    def collect(self) -> Dict[Labels, Sample]:
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(first: Sample, second: Sample) -> Sample:
+        return first + second
+
+    def render(self, samples: Optional[Dict[Labels, Sample]] = None) -> Iterator[str]:
+        """
+        :param samples: Samples to render, e.g. merged ones of several processes. Own ones by default.
+        """
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in (self.collect() if samples is None else samples).items():
+            yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}  # Counts per bucket (+Inf last), and sum.
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bucket] += 1
+            total[0] += value
+
+    def count(self, **labels: str) -> int:
+        counts, _ = self._values.get(tuple(sorted(labels.items())), ([0], [0.0]))
+        return sum(counts)
+
+    def collect(self) -> Dict[Labels, Sample]:
+        with self._lock:
+            return {labels: counts + total for labels, (counts, total) in self._values.items()}
+
+    @staticmethod
+    def merge(first: Sample, second: Sample) -> Sample:
+        return [a + b for a, b in zip(first, second)]
+
+    def render(self, samples: Optional[Dict[Labels, Sample]] = None) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, sample in (self.collect() if samples is None else samples).items():
+            counts, total = sample[:-1], sample[-1]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += int(count)
+                yield f"{self.name}_bucket{_format_labels(labels, (('le', _format_value(bound)),))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(labels)} {cumulative}"
+
+
+class CallbackMetric:
+    """
+    Metric, which values are read at scrape time, e.g. hit counters of caches, which count them anyway.
+    """
+
+    def __init__(self, name: str, documentation: str, metric_type: str, read: Callable[[], Dict[Labels, float]]):
+        """
+        :param metric_type: 'counter' or 'gauge'.
+        :param read:        Returns current values by labels, e.g. {(('cache', 'answer'),): 10.0}.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self._read = read
+
+    def collect(self) -> Dict[Labels, Sample]:
+        return dict(self._read())
+
+    @staticmethod
+    def merge(first: Sample, second: Sample) -> Sample:
+        return first + second
+
+    def render(self, samples: Optional[Dict[Labels, Sample]] = None) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.metric_type}"
+        for labels, value in (self.collect() if samples is None else samples).items():
+            yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Registry:
+    def __init__(self, directory: Optional[str] = METRICS_MULTIPROCESS_DIR, dump_interval: float = 1.0):
+        """
+        :param directory:       If set, every process writes its metrics to own file in the directory, and `render`
+                                 shows the sum of metrics of all processes, e.g. of all workers of serve.py.
+        :param dump_interval:   How often (in seconds) `dump_soon` writes the file.
+        """
+        self._metrics = []
+        self._directory = directory
+        self._dump_interval = dump_interval
+        self._changed = threading.Event()
+        self._dumping_pid = None  # Process, which runs the dumping thread. Threads do not survive fork.
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collect(self) -> dict:
+        """
+        :return: Samples of all metrics of this process, which can be written as JSON.
+        """
+        return {metric.name: [[labels, sample] for labels, sample in metric.collect().items()]
+                for metric in self._metrics}
+
+    def dump(self):
+        """
+        Writes metrics of this process to its file in the directory, through temporary file and rename,
+        so that other processes never read partially written one.
+        """
+        if self._directory is None:
+            return
+        file = os.path.join(self._directory, f"{os.getpid()}.json")
+        with open(f"{file}.tmp", 'w') as out:
+            json.dump(self.collect(), out)
+        os.replace(f"{file}.tmp", file)
+
+    def dump_soon(self):
+        """
+        Marks metrics changed, e.g. after every request. Changed metrics are dumped by the background thread
+        within `dump_interval`, so that `render` of other processes shows them, even if this one is idle then.
+        """
+        if self._directory is None:
+            return
+        self._changed.set()
+        if self._dumping_pid != os.getpid():
+            self._dumping_pid = os.getpid()
+            threading.Thread(target=self._dump_changes, name="metrics-dump", daemon=True).start()
+
+    def _dump_changes(self):
+        while True:
+            self._changed.wait()
+            self._changed.clear()
+            self.dump()
+            time.sleep(self._dump_interval)
+
+    def render(self) -> str:
+        """
+        :return: All metrics in Prometheus text exposition format.
+        """
+        if self._directory is None:
+            return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+        self.dump()
+        merged: Dict[str, Dict[Labels, Sample]] = {metric.name: {} for metric in self._metrics}
+        mergers = {metric.name: metric.merge for metric in self._metrics}
+        # Files of exited processes are kept, so that counters of the restarted worker do not go down.
+        for file in glob.glob(os.path.join(self._directory, "*.json")):
+            try:
+                with open(file) as dump:
+                    snapshot = json.load(dump)
+            except (OSError, ValueError):
+                continue
+            for name, samples in snapshot.items():
+                if name not in merged:
+                    continue
+                for labels, sample in samples:
+                    labels = tuple(tuple(label) for label in labels)
+                    current = merged[name].get(labels)
+                    merged[name][labels] = sample if current is None else mergers[name](current, sample)
+
+        return "\n".join(line for metric in self._metrics for line in metric.render(merged[metric.name])) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "assistant_stage_duration_seconds", "Time spent by requests in stages (stages may be nested)."))
+REQUEST_SECONDS = registry.register(Histogram(
+    "assistant_request_duration_seconds", "Time of HTTP requests, until the last byte of the response."))
+LLM_TOKENS = registry.register(Counter(
+    "assistant_llm_tokens_total", "Tokens of model calls: kind is prompt or completion."))
+LLM_CALLS = registry.register(Counter("assistant_llm_calls_total", "Model calls by stage."))
+EMBEDDING_CALLS = registry.register(Counter("assistant_embedding_calls_total", "Calls of the embedding model."))
+EMBEDDED_TEXTS = registry.register(Counter("assistant_embedded_texts_total", "Texts, sent to the embedding model."))
+RETRIEVALS = registry.register(Counter(
+    "assistant_retrievals_total", "Hybrid retrievals: path is lexical (vector search skipped) or fused."))
+
+# Stage timings of the current request, see `start_request_timings`.
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar('request_timings', default=None)
+
+
+def start_request_timings() -> Dict[str, float]:
+    """
+    Starts collecting the timing breakdown of the current request (task). Stages, observed by the request,
+    including the ones in concurrency.run_blocking, are added to the returned dict.
+    """
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def get_request_timings() -> Optional[Dict[str, float]]:
+    return _request_timings.get()
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage: str):
+    """
+    Times the block as the stage of the current request.
+    """
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started_at)
+
+
+class TimedIterator:
+    """
+    Iterator, which counts time spent in reading the wrapped one, e.g. in lazy database reads.
+    """
+
+    def __init__(self, iterable: Iterable):
+        self._iterator = iter(iterable)
+        self.seconds = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started_at = time.perf_counter()
+        try:
+            return next(self._iterator)
+        finally:
+            self.seconds += time.perf_counter() - started_at
+
+
+class TimedEmbeddings:
+    """
+    Counts and times calls of the embedding model, as "embedding" stage.
+    Has the interface of langchain Embeddings, but does not subclass them, so that main (which imports this module)
+    starts without importing langchain.
+    """
+
+    def __init__(self, embeddings: 'Embeddings'):
+        self._embeddings = embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        EMBEDDING_CALLS.inc()
+        EMBEDDED_TEXTS.inc(len(texts))
+        with span("embedding"):
+            return self._embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        EMBEDDING_CALLS.inc()
+        EMBEDDED_TEXTS.inc()
+        with span("embedding"):
+            return self._embeddings.embed_query(text)
+
+
+def format_server_timing(timings: Dict[str, float]) -> str:
+    """
+    :return: Value of the Server-Timing header, with durations in milliseconds.
+    """
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware: times every HTTP request, and collects its stage timings (see `start_request_timings`).
+    If the request has PROFILING_HEADER (`X-Profile: 1`), the breakdown is returned in the Server-Timing
+    header of the response. Streamed responses get it in their headers too, so stages, finished after
+    the headers were sent, are not in it.
+    """
+
+    def __init__(self, app, profiling_header: str = PROFILING_HEADER):
+        self.app = app
+        self._profiling_header = profiling_header.lower().encode() if profiling_header else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = start_request_timings()
+        profile = self._profiling_header is not None and any(
+            name == self._profiling_header and value not in (b"", b"0") for name, value in scope.get("headers", ()))
+        started_at = time.perf_counter()
+        status = 500
+
+        async def send_with_timings(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if profile:
+                    timings["total"] = time.perf_counter() - started_at
+                    headers = list(message.get("headers", ()))
+                    headers.append((b"server-timing", format_server_timing(timings).encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"  # Not raw path: it would make too many labels.
+            REQUEST_SECONDS.observe(time.perf_counter() - started_at, path=path, method=scope["method"],
+                                    status=str(status))
+            registry.dump_soon()
@@ -0,0 +1,213 @@
+import json
+import os
+import time
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.base import VectorStore
+
+_CHUNKS_FILE = 'chunks.json'
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    In-process vector store for corpora of up to tens of thousands of chunks: normalized float32 vectors
+    in a single matrix, memory-mapped from `.npy` file, and exact top-k search by dot product.
+
+    Files in `persist_directory`: `chunks.json` (ids, texts and metadata of chunks, and name of the vectors file)
+    and `vectors-<version>.npy`. `persist` writes new vectors file and then replaces `chunks.json`,
+    so readers never see partially written store.
+
+    Besides langchain VectorStore, has methods of chromadb collection, which are used by ingestion:
+    `get`, `add`, `update` and `delete`.
+    """
+
+    def __init__(self, persist_directory: str, embedding_function: Embeddings):
+        """
+        :param persist_directory:   Directory of the store. Created on `persist`.
+        :param embedding_function:  Embeddings to embed texts and queries with.
+        """
+        self._persist_directory = persist_directory
+        self._embedding_function = embedding_function
+
+        self._ids: List[str] = []
+        self._documents: List[str] = []
+        self._metadatas: List[dict] = []
+        self._vectors: Optional[np.ndarray] = None  # Memory-mapped, until the store is changed.
+        self._vectors_file: Optional[str] = None
+        self._load()
+
+    def _load(self, attempts: int = 3):
+        chunks_file = os.path.join(self._persist_directory, _CHUNKS_FILE)
+        for attempt in range(attempts):
+            try:
+                with open(chunks_file, 'r') as file:
+                    chunks = json.load(file)
+            except FileNotFoundError:
+                return
+
+            try:
+                vectors = np.load(os.path.join(self._persist_directory, chunks['vectors_file']), mmap_mode='r')
+                break
+            except FileNotFoundError:
+                # Store was persisted again, after chunks file was read. Read the new one.
+                if attempt == attempts - 1:
+                    raise
+
+        self._ids = chunks['ids']
+        self._documents = chunks['documents']
+        self._metadatas = chunks['metadatas']
+        self._vectors_file = chunks['vectors_file']
+        self._vectors = vectors
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def persist(self):
+        os.makedirs(self._persist_directory, exist_ok=True)
+        old_vectors_file = self._vectors_file
+
+        vectors_file = f"vectors-{time.time_ns()}.npy"
+        vectors = self._vectors if self._vectors is not None else np.zeros((0, 0), dtype=np.float32)
+        np.save(os.path.join(self._persist_directory, vectors_file), vectors)
+
+        chunks_file = os.path.join(self._persist_directory, _CHUNKS_FILE)
+        with open(f"{chunks_file}.tmp", 'w') as file:
+            json.dump({
+                "vectors_file": vectors_file,
+                "ids": self._ids,
+                "documents": self._documents,
+                "metadatas": self._metadatas,
+            }, file)
+        os.replace(f"{chunks_file}.tmp", chunks_file)
+        self._vectors_file = vectors_file
+
+        # Servers, which have mapped the old file, keep reading it until they reload.
+        if old_vectors_file is not None and old_vectors_file != vectors_file:
+            try:
+                os.remove(os.path.join(self._persist_directory, old_vectors_file))
+            except FileNotFoundError:
+                pass
+
+    # Methods of chromadb collection.
+
+    def get(self,
+            where: Optional[dict] = None,
+            limit: Optional[int] = None,
+            include: Optional[List[str]] = None) -> dict:
+        """
+        :param where:   Metadata values, chunks should have, e.g. {"file": "terms.pdf"}.
+        :param limit:   Maximum number of chunks to return.
+        :param include: Ids, metadatas and documents are always returned. Embeddings (normalized) are returned,
+                        if "embeddings" are included.
+        """
+        rows = [row for row, metadata in enumerate(self._metadatas)
+                if not where or all(metadata.get(key) == value for key, value in where.items())]
+        rows = rows[:limit]
+        result = {
+            'ids': [self._ids[row] for row in rows],
+            'metadatas': [self._metadatas[row] for row in rows],
+            'documents': [self._documents[row] for row in rows],
+        }
+        if include and 'embeddings' in include:
+            result['embeddings'] = [self._vectors[row].tolist() for row in rows]
+        return result
+
+    def add(self, ids: List[str], embeddings: List[List[float]], metadatas: List[dict], documents: List[str]):
+        if not ids:
+            return
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        if self._vectors is None or len(self._vectors) == 0:
+            self._vectors = vectors
+        else:
+            self._vectors = np.concatenate([self._vectors, vectors])
+        self._ids.extend(ids)
+        self._metadatas.extend(dict(metadata) for metadata in metadatas)
+        self._documents.extend(documents)
+
+    def update(self, ids: List[str], metadatas: List[dict]):
+        rows = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+        for chunk_id, metadata in zip(ids, metadatas):
+            self._metadatas[rows[chunk_id]] = dict(metadata)
+
+    def delete(self, ids: List[str]):
+        ids = set(ids)
+        keep = [row for row, chunk_id in enumerate(self._ids) if chunk_id not in ids]
+        self._ids = [self._ids[row] for row in keep]
+        self._metadatas = [self._metadatas[row] for row in keep]
+        self._documents = [self._documents[row] for row in keep]
+        if self._vectors is not None:
+            self._vectors = self._vectors[keep]
+
+    # Methods of langchain VectorStore.
+
+    def add_texts(self,
+                  texts: Iterable[str],
+                  metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None,
+                  **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if ids is None:
+            ids = [str(len(self._ids) + i) for i in range(len(texts))]
+        if metadatas is None:
+            metadatas = [{} for _ in texts]
+        self.add(ids, self._embedding_function.embed_documents(texts), metadatas, texts)
+        return ids
+
+    def search_by_vectors(self, queries: np.ndarray, k: int = 4) -> List[List[Tuple[int, float]]]:
+        """
+        Exact search of many queries at once: single matrix product.
+        :param queries: Query vectors, one per row.
+        :return: For every query, up to `k` (row, cosine similarity) pairs, most similar first.
+        """
+        if self._vectors is None or len(self._vectors) == 0:
+            return [[] for _ in queries]
+
+        scores = _normalize(np.asarray(queries, dtype=np.float32)) @ self._vectors.T
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for query_scores, query_top in zip(scores, top):
+            query_top = query_top[np.argsort(-query_scores[query_top])]
+            results.append([(int(row), float(query_scores[row])) for row in query_top])
+        return results
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4) -> List[Tuple[Document, float]]:
+        return [(Document(page_content=self._documents[row], metadata=dict(self._metadatas[row])), score)
+                for row, score in self.search_by_vectors(np.asarray([embedding]), k)[0]]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        """
+        :return: Documents along with cosine similarity to the query, most similar first.
+        """
+        return self.similarity_search_by_vector_with_score(self._embedding_function.embed_query(query), k)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k)]
+
+    def _similarity_search_with_relevance_scores(self, query: str, k: int = 4,
+                                                 **kwargs: Any) -> List[Tuple[Document, float]]:
+        # Cosine similarity to [0, 1].
+        return [(document, (score + 1) / 2) for document, score in self.similarity_search_with_score(query, k)]
+
+    @classmethod
+    def from_texts(cls,
+                   texts: List[str],
+                   embedding: Embeddings,
+                   metadatas: Optional[List[dict]] = None,
+                   persist_directory: str = None,
+                   **kwargs: Any) -> 'NumpyVectorStore':
+        store = cls(persist_directory=persist_directory, embedding_function=embedding)
+        store.add_texts(texts, metadatas, kwargs.get('ids'))
+        return store
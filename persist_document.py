@@ -1,46 +1,67 @@
 #!/usr/bin/env python3
+import argparse
+import glob
 import os.path
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 import pdfplumber as pdfplumber
-import PyPDF4 as PyPDF4
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.vectorstores import Chroma
+from langchain.docstore.document import Document
 
 from app_types import PageData, PDFDocument
-from utils import merge_hyphenated_words, fix_newlines, remove_multiple_newlines, clean_text, text_to_chunks, make_chain
-from config import VECTOR_STORE_COLLECTION_NAME, VECTOR_STORE_PATH
+from chain_manager import mark_vector_store_updated
+from chunking import iter_token_chunks
+from ingestion import FILE_HASH_KEY, FILE_KEY, file_hash, get_stored_chunks, get_stored_file_hash, plan_sync, \
+    apply_removals_and_updates, add_embedded_chunks, retry_with_backoff, delete_legacy_chunks, build_lexical_index, \
+    document_key, prune_removed_files
+from text_cleaning import clean_page_text
+from utils import iter_clean_text, make_embeddings, make_vector_store
+from config import INGESTION_WORKERS, EMBEDDING_BATCH_SIZE, \
+    MAX_CONCURRENT_EMBEDDING_REQUESTS, BM25_INDEX_FILE, VECTOR_STORE_PATH
 
+DEFAULT_DOCUMENT = './Nifty Bridge Terms of Service.pdf'
+# Same as [merge_hyphenated_words, fix_newlines, remove_multiple_newlines], but in fewer passes.
+CLEANING_FUNCTIONS = [clean_page_text]
 
-def fill_pages_from_pdf(file_path: str, pdf_document: PDFDocument):
+
+def iter_pages_from_pdf(pdf: pdfplumber.PDF) -> Iterator[PageData]:
+    """
+    Lazily extracts the text from each page of the PDF. Parsed objects of the page are released,
+    once its text is extracted, so only one parsed page at a time is held in memory.
+    :param pdf: - Opened PDF file.
+    """
+    for page_num, page in enumerate(pdf.pages):
+        text = page.extract_text()
+        # Parsed objects are cached by the page, and characters - by its text map.
+        page.flush_cache()
+        page.get_textmap.cache_clear()
+        if text.strip():  # Check if extracted text exists.
+            yield PageData(num=page_num, text=text)
+
+
+def fill_pages_from_pdf(pdf: pdfplumber.PDF, pdf_document: PDFDocument):
     """
     Extracts the text from each page of the PDF.
-    :param file_path: - The path of the PDF file.
+    :param pdf: - Opened PDF file.
     :param pdf_document: - Python instance of document to fill.
     """
-    if not os.path.isfile(file_path):
-        raise FileNotFoundError(f"File not found: {file_path}")
-
-    with pdfplumber.open(file_path) as pdf:
-        pdf_document.pages = []
-        for page_num, page in enumerate(pdf.pages):
-            text = page.extract_text()
-            if text.strip():  # Check if extracted text exists.
-                pdf_document.pages.append(PageData(num=page_num, text=text))
+    pdf_document.pages = list(iter_pages_from_pdf(pdf))
 
 
-def fill_metadata_from_pdf(file_path: str, pdf_document: PDFDocument):
-    with open(file_path, 'rb') as pdf_file:
-        reader = PyPDF4.PdfFileReader(pdf_file)
-        metadata = reader.getDocumentInfo()
+def fill_metadata_from_pdf(pdf: pdfplumber.PDF, pdf_document: PDFDocument):
+    metadata = pdf.metadata
 
-        pdf_document.title = metadata.get('/Title', '').strip()
-        pdf_document.author = metadata.get('/Author', '').strip()
-        pdf_document.creation_date = metadata.get('/CreationDate', '').strip()
+    pdf_document.title = str(metadata.get('Title', '')).strip()
+    pdf_document.author = str(metadata.get('Author', '')).strip()
+    pdf_document.creation_date = str(metadata.get('CreationDate', '')).strip()
 
 
 def parse_pdf(file_path: str) -> PDFDocument:
     """
-    Extracts the title and text from each page of the PDF.
+    Extracts the title and text from each page of the PDF. The file is opened and parsed once.
 
     :param file_path: - The path of the PDF file.
     :return: The tuple containing the title and list of tuples with page numbers
@@ -49,37 +70,257 @@ def parse_pdf(file_path: str) -> PDFDocument:
         raise FileNotFoundError(f"File not found: {file_path}")
 
     pdf_document = PDFDocument(title='', author='', creation_date='', pages=[])
-    fill_metadata_from_pdf(file_path, pdf_document)
-    fill_pages_from_pdf(file_path, pdf_document)
+    with pdfplumber.open(file_path) as pdf:
+        fill_metadata_from_pdf(pdf, pdf_document)
+        fill_pages_from_pdf(pdf, pdf_document)
 
     return pdf_document
 
 
+def load_chunks(file_path: str, current_file_hash: str) -> List[Document]:
+    """
+    Parses, cleans and splits the PDF. Is run in the worker process.
+
+    Pages are streamed through the stages (extract -> clean -> split) one at a time, so neither list of
+    pages, nor list of cleaned pages is built. Only the chunks are collected, as the whole set of them is
+    needed to find out, which stored chunks are gone (see ingestion.plan_sync).
+    Chunks are sized in tokens and may span pages, see chunking.iter_token_chunks.
+    """
+    if not os.path.isfile(file_path):
+        raise FileNotFoundError(f"File not found: {file_path}")
+
+    pdf_document = PDFDocument(title='', author='', creation_date='', pages=[])
+    with pdfplumber.open(file_path) as pdf:
+        fill_metadata_from_pdf(pdf, pdf_document)
+        pages = iter_clean_text(iter_pages_from_pdf(pdf), CLEANING_FUNCTIONS)
+        document_chunks = list(iter_token_chunks(pages, pdf_document.metadata))
+
+    for chunk in document_chunks:
+        chunk.metadata[FILE_HASH_KEY] = current_file_hash
+    return document_chunks
+
+
+def find_pdf_files(paths: Iterable[str]) -> List[str]:
+    """
+    :param paths: - PDF files, directories (searched recursively) and glob patterns.
+    :return: Real (absolute) paths of the PDF files, sorted and without duplicates.
+    """
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            matches = glob.glob(os.path.join(path, '**', '*.pdf'), recursive=True)
+        elif glob.has_magic(path):
+            matches = glob.glob(path, recursive=True)
+        else:
+            matches = [path]
+        files.update(os.path.realpath(match) for match in matches if not os.path.isdir(match))
+    return sorted(files)
+
+
+@dataclass
+class IngestionStats:
+    files: int = 0
+    skipped: int = 0
+    failed: int = 0
+    chunks: int = 0
+    embedded: int = 0
+    deleted: int = 0
+    updated: int = 0
+    started_at: float = 0.0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.embedded or self.deleted or self.updated)
+
+    def progress(self, total_files: int) -> str:
+        elapsed = time.monotonic() - self.started_at
+        return (f"[{self.files + self.skipped + self.failed}/{total_files} files, {elapsed:.1f}s] "
+                f"{self.chunks / elapsed if elapsed else 0:.1f} chunks/s, "
+                f"{self.embedded / elapsed if elapsed else 0:.1f} embedded chunks/s")
+
+    def __str__(self):
+        return (f"{self.files} files ingested, {self.skipped} unchanged, {self.failed} failed. "
+                f"Chunks: {self.chunks} total, {self.embedded} embedded, {self.updated} updated, "
+                f"{self.deleted} deleted")
+
+
+def iter_changed_documents(vector_store,
+                           files: List[str],
+                           workers: int,
+                           stats: IngestionStats) -> Iterator[Tuple[str, dict, List[Document]]]:
+    """
+    Parses changed files in the process pool. Unchanged files (see ingestion.get_stored_file_hash) are skipped.
+    Up to 2 files per worker are parsed ahead, so memory stays bounded, when many files are ingested.
+    :return: Iterator of the name of the file in the vector store (see ingestion.document_key), its stored chunks
+             and its current chunks, in order of parsing completion.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = {}
+        files = iter(files)
+
+        def submit_next() -> bool:
+            for file in files:
+                key = document_key(file)
+                stored = get_stored_chunks(vector_store, key)
+                current_file_hash = file_hash(file)
+                if stored and get_stored_file_hash(stored) == current_file_hash:
+                    stats.skipped += 1
+                    print(f"Unchanged, skipped: {file}")
+                    continue
+                in_flight[pool.submit(load_chunks, file, current_file_hash)] = (key, stored)
+                return True
+            return False
+
+        while len(in_flight) < workers * 2 and submit_next():
+            pass
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, stored = in_flight.pop(future)
+                try:
+                    chunks = future.result()
+                except Exception as e:
+                    stats.failed += 1
+                    print(f"error: Failed to parse {key}: {e!r}", file=sys.stderr)
+                else:
+                    yield key, stored, chunks
+                submit_next()
+
+
+def iter_batches(items: Iterable, batch_size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def persist_pdfs(files: List[str],
+                 vector_store,
+                 embeddings,
+                 workers: int = INGESTION_WORKERS,
+                 batch_size: int = EMBEDDING_BATCH_SIZE,
+                 max_concurrent_embeddings: int = MAX_CONCURRENT_EMBEDDING_REQUESTS) -> IngestionStats:
+    """
+    Stores chunks of the PDFs in the vector store, incrementally: only new chunks are embedded,
+    chunks, which are gone from the documents, are deleted.
+
+    Files are parsed in the process pool, and new chunks of all files are embedded in batches of `batch_size`,
+    with up to `max_concurrent_embeddings` batches at a time. Failed batches are retried with backoff.
+    Files of a batch, which failed all attempts, are counted as failed, and other batches are stored anyway.
+    Vector store is written from the calling thread only.
+    """
+    stats = IngestionStats(started_at=time.monotonic())
+
+    def iter_new_chunks() -> Iterator[Tuple[str, Document]]:
+        for key, stored, chunks in iter_changed_documents(vector_store, files, workers, stats):
+            plan = plan_sync(stored, key, chunks)
+            apply_removals_and_updates(vector_store, plan)
+            stats.files += 1
+            stats.chunks += len(chunks)
+            stats.updated += len(plan.update_ids)
+            stats.deleted += len(plan.delete_ids)
+            print(f"{key}: {plan}")
+            yield from zip(plan.add_ids, plan.add_chunks)
+
+    def embed(batch: List[Tuple[str, Document]]) -> List[List[float]]:
+        texts = [chunk.page_content for _, chunk in batch]
+        return retry_with_backoff(lambda: embeddings.embed_documents(texts))
+
+    failed_files = set()
+
+    def store(batch: List[Tuple[str, Document]], future: Future):
+        try:
+            batch_embeddings = future.result()
+        except Exception as e:
+            # Other batches are still stored. Chunks of the file are incomplete, so it is ingested again next time,
+            # see ingestion.get_stored_file_hash.
+            batch_files = {chunk.metadata[FILE_KEY] for _, chunk in batch}
+            newly_failed = batch_files - failed_files
+            failed_files.update(newly_failed)
+            stats.files -= len(newly_failed)
+            stats.failed += len(newly_failed)
+            print(f"error: Failed to embed {len(batch)} chunks of {', '.join(sorted(batch_files))}: {e!r}",
+                  file=sys.stderr)
+            return
+        add_embedded_chunks(vector_store,
+                            ids=[chunk_id for chunk_id, _ in batch],
+                            chunks=[chunk for _, chunk in batch],
+                            embeddings=batch_embeddings)
+        stats.embedded += len(batch)
+        print(stats.progress(len(files)))
+
+    with ThreadPoolExecutor(max_workers=max_concurrent_embeddings) as embedding_pool:
+        in_flight = {}
+        for batch in iter_batches(iter_new_chunks(), batch_size):
+            while len(in_flight) >= max_concurrent_embeddings:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    store(in_flight.pop(future), future)
+            in_flight[embedding_pool.submit(embed, batch)] = batch
+
+        for future in list(in_flight):
+            store(in_flight.pop(future), future)
+
+    return stats
+
+
+def main(args):
+    files = find_pdf_files(args.paths)
+    directories = [path for path in args.paths if os.path.isdir(path)]
+    # Directory, all PDFs of which were removed, is still pruned.
+    if not files and not (args.prune and directories):
+        print("error: No PDF files found", file=sys.stderr)
+        sys.exit(1)
+
+    os.makedirs(VECTOR_STORE_PATH, exist_ok=True)
+    embeddings = make_embeddings()
+    vector_store = make_vector_store(embeddings)
+
+    legacy_chunks = delete_legacy_chunks(vector_store)
+    if legacy_chunks:
+        print(f"Deleted {legacy_chunks} chunks, stored by the previous version")
+
+    pruned_chunks = prune_removed_files(vector_store, directories) if args.prune else 0
+    if pruned_chunks:
+        print(f"Deleted {pruned_chunks} chunks of the files, removed from {', '.join(directories)}")
+
+    print(f"Persisting {len(files)} PDF files")
+    stats = persist_pdfs(files, vector_store, embeddings,
+                         workers=args.workers,
+                         batch_size=args.batch_size,
+                         max_concurrent_embeddings=args.max_concurrent_embeddings)
+    print(stats)
+    print(stats.progress(len(files)))
+
+    changed = legacy_chunks or pruned_chunks or stats.changed
+    if changed:
+        vector_store.persist()
+    if changed or not os.path.exists(BM25_INDEX_FILE):
+        index = build_lexical_index(vector_store)
+        index.save()
+        print(f"Lexical index of {len(index)} chunks is saved to {BM25_INDEX_FILE}")
+    if changed:
+        mark_vector_store_updated()
+
+    if stats.failed:
+        sys.exit(1)
+
+
 if __name__ == "__main__":
-    print("Parsing pdf")
-    pdf_document = parse_pdf('./Nifty Bridge Terms of Service.pdf')
-
-    print("Cleaning text")
-    pdf_document.pages = clean_text(
-        pages=pdf_document.pages,
-        cleaning_functions=[
-            merge_hyphenated_words,
-            fix_newlines,
-            remove_multiple_newlines,
-        ]
-    )
-
-    print("Splitting text to chunks")
-    document_chunks = text_to_chunks(pdf_document)
-
-    embeddings = OpenAIEmbeddings()
-
-    print("Embedding document")
-    vector_store = Chroma.from_documents(
-        document_chunks,
-        embeddings,
-        collection_name=VECTOR_STORE_COLLECTION_NAME,
-        persist_directory=VECTOR_STORE_PATH
-    )
-
-    vector_store.persist()
+    parser = argparse.ArgumentParser(description='Parse PDF documents and store their chunks in the vector store')
+    parser.add_argument('paths', nargs='*', default=[DEFAULT_DOCUMENT],
+                        help='PDF files, directories and glob patterns (quote them). '
+                             f'"{DEFAULT_DOCUMENT}" by default')
+    parser.add_argument('--workers', type=int, default=INGESTION_WORKERS, help='Processes to parse PDFs with')
+    parser.add_argument('--batch-size', type=int, default=EMBEDDING_BATCH_SIZE, help='Chunks per embedding request')
+    parser.add_argument('--max-concurrent-embeddings', type=int, default=MAX_CONCURRENT_EMBEDDING_REQUESTS,
+                        help='Embedding requests at the same time')
+    parser.add_argument('--prune', action='store_true',
+                        help='Delete stored chunks of the files, which are no longer in the given directories')
+
+    main(parser.parse_args())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Runs the server in several processes (workers), which accept connections on the same socket.
+
+With several workers, state, which is only read, is loaded once, before workers are forked, and is shared by them
+(copy-on-write): the tokenizer, and the chain with its lexical index and memory-mapped vectors
+(VECTOR_STORE_BACKEND=numpy). A single worker has nothing to share, so it accepts connections at once, and loads
+everything in the background, as `uvicorn main:app` does (unless --preload is given).
+State, which is written, is shared through SQLite files, which workers write in short transactions:
+chat history and API keys, the embedding cache, and the answer cache (ANSWER_CACHE_BACKEND=sqlite, the default
+with several workers). /metrics of any worker shows metrics of all of them. Workers, which exit, are restarted.
+
+Usage: `OPENAI_API_KEY=<Your OPENAI key here> python serve.py --workers 4 --host 0.0.0.0 --port 8000`
+"""
+import argparse
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+logger = logging.getLogger("serve")
+
+# Worker, which exits sooner after start, most likely cannot start at all, so it is not restarted.
+MIN_WORKER_LIFETIME = 5.0  # Seconds.
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def spawn_worker(server, sock: socket.socket, log_level: str) -> int:
+    """
+    Forks the worker, which serves the app on the socket.
+    :return: Process id of the worker.
+    """
+    pid = os.fork()
+    if pid:
+        return pid
+
+    import uvicorn
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    code = 1
+    try:
+        uvicorn.Server(uvicorn.Config(server.app, log_level=log_level)).run(sockets=[sock])
+        code = 0
+    finally:
+        os._exit(code)
+
+
+def run(args):
+    metrics_dir = None
+    if args.workers > 1:
+        os.environ.setdefault("ANSWER_CACHE_BACKEND", "sqlite")
+        if "METRICS_MULTIPROCESS_DIR" not in os.environ:
+            metrics_dir = os.environ["METRICS_MULTIPROCESS_DIR"] = tempfile.mkdtemp(prefix="metrics-")
+
+    try:
+        exit_code = serve(args)
+    finally:
+        if metrics_dir is not None:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+    sys.exit(exit_code)
+
+
+def serve(args) -> int:
+    """
+    Forks workers and restarts the ones, which exit, until SIGINT or SIGTERM.
+    :return: Exit code.
+    """
+    # Config is read from the environment on import, so the server is imported only now. With several workers,
+    # the assistant is imported before fork too (and not in the background by every worker, see main.warm_up),
+    # so that workers share it.
+    import main as server
+
+    if args.preload or args.workers > 1:
+        import assistant_api
+        assistant_api.preload()
+    sock = bind_socket(args.host, args.port, args.backlog)
+
+    started_at = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(started_at):
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(args.workers):
+        started_at[spawn_worker(server, sock, args.log_level)] = time.monotonic()
+    logger.warning("Serving on %s:%s with %s workers", args.host, args.port, args.workers)
+
+    exit_code = 0
+    try:
+        while started_at:
+            pid, status = os.wait()
+            lifetime = time.monotonic() - started_at.pop(pid)
+            if stopping:
+                continue
+            if lifetime < MIN_WORKER_LIFETIME:
+                logger.error("Worker %s exited with status %s right after start, stopping", pid, status)
+                exit_code = 1
+                stop(signal.SIGTERM, None)
+                continue
+            logger.warning("Worker %s exited with status %s, restarting it", pid, status)
+            started_at[spawn_worker(server, sock, args.log_level)] = time.monotonic()
+    finally:
+        sock.close()
+    return exit_code
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=int(os.environ.get("WEB_CONCURRENCY", 1)),
+                        help='Number of server processes (WEB_CONCURRENCY by default)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--backlog', type=int, default=2048, help='Maximum number of pending connections')
+    parser.add_argument('--log-level', default='info')
+    parser.add_argument('--preload', action='store_true',
+                        help='Load the assistant before accepting connections. Always done with several workers')
+    logging.basicConfig(format="%(asctime)s %(name)s: %(message)s")
+    run(parser.parse_args())
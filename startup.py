@@ -0,0 +1,98 @@
+import asyncio
+import json
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+
+from config import STARTUP_WAIT_TIMEOUT
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+
+class Readiness:
+    """
+    Progress of the warm-up of the server: its steps, and whether it is done (the server is ready) or failed.
+    Steps may be run in threads, but the state is changed in the event loop.
+    """
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.steps: Dict[str, float] = {}  # Seconds, every finished step took.
+        self.error: Optional[str] = None
+        self._done = asyncio.Event()
+        self._ready = False
+
+    @property
+    def status(self) -> str:
+        if self.error is not None:
+            return "failed"
+        return "ready" if self._ready else "starting"
+
+    @contextmanager
+    def step(self, name: str):
+        started_at = time.perf_counter()
+        yield
+        self.steps[name] = time.perf_counter() - started_at
+        logger.info("Warm-up step %s took %.3f s", name, self.steps[name])
+
+    def set_ready(self):
+        self._ready = True
+        self._done.set()
+        logger.info("Ready in %.3f s", time.monotonic() - self.started_at)
+
+    def set_failed(self, error: Exception):
+        self.error = f"{type(error).__name__}: {error}"
+        self._done.set()
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        :return: Whether the server is ready. False, if the warm-up failed, or did not finish in `timeout` seconds.
+        """
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._ready
+
+    def report(self) -> dict:
+        report = {
+            "status": self.status,
+            "uptime": round(time.monotonic() - self.started_at, 3),
+            "steps": {name: round(seconds * 1000, 1) for name, seconds in self.steps.items()},
+        }
+        if self.error is not None:
+            report["error"] = self.error
+        return report
+
+
+class ReadinessGate:
+    """
+    ASGI middleware: HTTP requests, which come before the server is ready, wait for it (as "startup" stage),
+    and get 503 with Retry-After, if it fails, or is not ready in `timeout` seconds.
+    Requests of `exempt_paths` (health checks and metrics) are passed at once.
+    """
+
+    def __init__(self,
+                 app,
+                 readiness: Readiness,
+                 exempt_paths: Iterable[str] = ("/healthz", "/metrics"),
+                 timeout: float = STARTUP_WAIT_TIMEOUT):
+        self.app = app
+        self._readiness = readiness
+        self._exempt_paths = frozenset(exempt_paths)
+        self._timeout = timeout
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] not in self._exempt_paths and self._readiness.status != "ready":
+            with span("startup"):
+                ready = await self._readiness.wait(self._timeout)
+            if not ready:
+                body = json.dumps({"detail": f"The server is not ready: {self._readiness.status}"}).encode()
+                await send({"type": "http.response.start", "status": 503,
+                            "headers": [(b"content-type", b"application/json"), (b"retry-after", b"1"),
+                                        (b"content-length", str(len(body)).encode())]})
+                await send({"type": "http.response.body", "body": body})
+                return
+        await self.app(scope, receive, send)
@@ -0,0 +1,143 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock
+
+from answer_cache import SemanticAnswerCache, SharedAnswerCache
+
+EMBEDDINGS = {
+    'What is the refund policy?': [1.0, 0.0, 0.0],
+    'What is the refund policy': [0.99, 0.05, 0.0],
+    'Who owns the service?': [0.0, 1.0, 0.0],
+    'Where is the company located?': [0.0, 0.0, 1.0],
+}
+
+
+class TestSemanticAnswerCache(TestCase):
+    def setUp(self):
+        self.embed = Mock(side_effect=lambda question: EMBEDDINGS[question])
+
+    def make_cache(self, **kwargs) -> SemanticAnswerCache:
+        options = dict(similarity_threshold=0.95, ttl=60, max_entries=10)
+        options.update(kwargs)
+        return SemanticAnswerCache(embed=self.embed, **options)
+
+    def test_similar_question_is_answered_from_cache(self):
+        cache = self.make_cache()
+
+        answer, embedding = cache.get('What is the refund policy?')
+        self.assertIsNone(answer)
+        cache.put(embedding, 'No refunds.')
+
+        self.assertEqual(cache.get('What is the refund policy?')[0], 'No refunds.')
+        self.assertEqual(cache.get('What is the refund policy')[0], 'No refunds.')
+
+    def test_different_question_is_not_answered(self):
+        cache = self.make_cache()
+        cache.put(cache.get('What is the refund policy?')[1], 'No refunds.')
+
+        self.assertIsNone(cache.get('Who owns the service?')[0])
+
+    def test_expired_answer_is_not_returned(self):
+        cache = self.make_cache(ttl=0)
+        cache.put(cache.get('What is the refund policy?')[1], 'No refunds.')
+
+        self.assertIsNone(cache.get('What is the refund policy?')[0])
+
+    def test_least_recently_used_answer_is_evicted(self):
+        cache = self.make_cache(max_entries=2)
+        cache.put(cache.get('What is the refund policy?')[1], 'No refunds.')
+        cache.put(cache.get('Who owns the service?')[1], 'Nifty Bridge.')
+        cache.get('What is the refund policy?')
+
+        cache.put(cache.get('Where is the company located?')[1], 'Somewhere.')
+
+        self.assertEqual(cache.get('What is the refund policy?')[0], 'No refunds.')
+        self.assertIsNone(cache.get('Who owns the service?')[0])
+        self.assertEqual(cache.get('Where is the company located?')[0], 'Somewhere.')
+
+    def test_clear(self):
+        cache = self.make_cache()
+        cache.put(cache.get('What is the refund policy?')[1], 'No refunds.')
+
+        cache.clear()
+
+        self.assertIsNone(cache.get('What is the refund policy?')[0])
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_stats(self):
+        cache = self.make_cache()
+        cache.put(cache.get('What is the refund policy?')[1], 'No refunds.')
+        cache.get('What is the refund policy?')
+
+        self.assertEqual(cache.stats(), {"entries": 1, "hits": 1, "misses": 1, "hit_rate": 0.5})
+
+
+class TestSharedAnswerCache(TestCase):
+    def setUp(self):
+        self.embed = Mock(side_effect=lambda question: EMBEDDINGS[question])
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.db_file = os.path.join(tmp_dir.name, 'answers.sqlite3')
+
+    def make_cache(self, **kwargs) -> SharedAnswerCache:
+        """
+        Cache of one worker. Caches, made by one test, share the database, as workers of serve.py do.
+        """
+        options = dict(similarity_threshold=0.95, ttl=60, max_entries=10)
+        options.update(kwargs)
+        cache = SharedAnswerCache(embed=self.embed, db_file=self.db_file, **options)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_answer_is_shared_by_workers(self):
+        worker_1, worker_2 = self.make_cache(), self.make_cache()
+        self.assertIsNone(worker_2.get('What is the refund policy')[0])
+
+        worker_1.put(worker_1.get('What is the refund policy?')[1], 'No refunds.')
+
+        self.assertEqual(worker_2.get('What is the refund policy')[0], 'No refunds.')
+        self.assertIsNone(worker_2.get('Who owns the service?')[0])
+
+    def test_expired_answer_is_not_returned(self):
+        cache = self.make_cache(ttl=0)
+        cache.put(cache.get('What is the refund policy?')[1], 'No refunds.')
+
+        self.assertIsNone(cache.get('What is the refund policy?')[0])
+
+    def test_oldest_answer_is_evicted(self):
+        worker_1, worker_2 = self.make_cache(max_entries=2), self.make_cache(max_entries=2)
+        worker_1.put(worker_1.get('What is the refund policy?')[1], 'No refunds.')
+        worker_2.put(worker_2.get('Who owns the service?')[1], 'Nifty Bridge.')
+        worker_1.put(worker_1.get('Where is the company located?')[1], 'Somewhere.')
+
+        for cache in (worker_1, worker_2):
+            self.assertIsNone(cache.get('What is the refund policy?')[0])
+            self.assertEqual(cache.get('Who owns the service?')[0], 'Nifty Bridge.')
+            self.assertEqual(cache.get('Where is the company located?')[0], 'Somewhere.')
+            self.assertEqual(cache.stats()['entries'], 2)
+
+    def test_clear_is_seen_by_other_workers(self):
+        worker_1, worker_2 = self.make_cache(), self.make_cache()
+        worker_1.put(worker_1.get('What is the refund policy?')[1], 'No refunds.')
+        self.assertEqual(worker_2.get('What is the refund policy?')[0], 'No refunds.')
+
+        worker_1.clear()
+
+        self.assertIsNone(worker_2.get('What is the refund policy?')[0])
+        worker_2.put(worker_2.get('Who owns the service?')[1], 'Nifty Bridge.')
+        self.assertEqual(worker_1.get('Who owns the service?')[0], 'Nifty Bridge.')
+
+    def test_answers_survive_restart(self):
+        cache = self.make_cache()
+        cache.put(cache.get('What is the refund policy?')[1], 'No refunds.')
+        cache.close()
+
+        self.assertEqual(self.make_cache().get('What is the refund policy?')[0], 'No refunds.')
+
+    def test_stats(self):
+        cache = self.make_cache()
+        cache.put(cache.get('What is the refund policy?')[1], 'No refunds.')
+        cache.get('What is the refund policy?')
+
+        self.assertEqual(cache.stats(), {"entries": 1, "hits": 1, "misses": 1, "hit_rate": 0.5})
@@ -0,0 +1,161 @@
+import asyncio
+from typing import List
+from unittest import TestCase
+from unittest.mock import patch, Mock
+
+from langchain.callbacks.base import AsyncCallbackHandler
+from langchain.chat_models.base import BaseChatModel
+from langchain.docstore.document import Document
+from langchain.schema import AIMessage, BaseMessage, ChatGeneration, ChatResult, HumanMessage, SystemMessage
+
+from answer_pipeline import AnswerPipeline, CondenseMode, looks_like_follow_up, format_chat_history, \
+    ANSWER_INSTRUCTIONS
+from metrics import LLM_CALLS, LLM_TOKENS, STAGE_SECONDS
+from test_helpers import FakeEncoding
+
+
+class FakeChatModel(BaseChatModel):
+    answer: str
+    prompts: List[List[BaseMessage]] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _generate(self, messages, stop=None, run_manager=None) -> ChatResult:
+        self.prompts.append(messages)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None) -> ChatResult:
+        self.prompts.append(messages)
+        if run_manager:
+            for token in self.answer.split(' '):
+                await run_manager.on_llm_new_token(token)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+
+class FakeRetriever:
+    def __init__(self):
+        self.queries = []
+
+    def get_relevant_documents(self, query):
+        self.queries.append(query)
+        return [Document(page_content=f"Document about {query}")]
+
+    async def aget_relevant_documents(self, query):
+        return self.get_relevant_documents(query)
+
+
+class TokenCollector(AsyncCallbackHandler):
+    def __init__(self):
+        self.tokens = []
+
+    async def on_llm_new_token(self, token: str, **kwargs) -> None:
+        self.tokens.append(token)
+
+
+HISTORY = [HumanMessage(content="What are the fees of the card?"), AIMessage(content="The fee is $5.")]
+
+
+def make_pipeline(condense_mode: CondenseMode) -> AnswerPipeline:
+    return AnswerPipeline(retriever=FakeRetriever(),
+                          answer_model=FakeChatModel(answer="The answer", prompts=[]),
+                          condense_model=FakeChatModel(answer=" Standalone question ", prompts=[]),
+                          condense_mode=condense_mode)
+
+
+class TestFormatChatHistory(TestCase):
+    def test_roles(self):
+        chat_history = [SystemMessage(content="Summary"), *HISTORY]
+        self.assertEqual(format_chat_history(chat_history),
+                         "\nSystem: Summary\nHuman: What are the fees of the card?\nAssistant: The fee is $5.")
+
+
+class TestLooksLikeFollowUp(TestCase):
+    def test_follow_ups(self):
+        for question in ("Why?", "How can I avoid it?", "And for business accounts?", "What about the card fees?",
+                         "Can those be refunded?"):
+            self.assertTrue(looks_like_follow_up(question), question)
+
+    def test_standalone_questions(self):
+        for question in ("How do I close my Nifty Bridge account?", "What are the fees of the card?"):
+            self.assertFalse(looks_like_follow_up(question), question)
+
+
+# Fake models report no token usage, so tokens are counted: one token per word.
+@patch('tokens.get_encoding', Mock(return_value=FakeEncoding()))
+class TestAnswerPipeline(TestCase):
+    def test_question_without_history_is_not_condensed(self):
+        for mode in CondenseMode:
+            pipeline = make_pipeline(mode)
+            result = pipeline({"question": "How do I close the account?", "chat_history": []})
+
+            self.assertEqual(pipeline.condense_model.prompts, [])
+            self.assertEqual(pipeline.retriever.queries, ["How do I close the account?"])
+            self.assertEqual(result["answer"], "The answer")
+
+    def test_always(self):
+        pipeline = make_pipeline(CondenseMode.ALWAYS)
+        result = pipeline({"question": "How do I close the account?", "chat_history": HISTORY})
+
+        self.assertEqual(len(pipeline.condense_model.prompts), 1)
+        condense_prompt = pipeline.condense_model.prompts[0][0].content
+        self.assertIn("The fee is $5.", condense_prompt)
+        self.assertIn("How do I close the account?", condense_prompt)
+        self.assertEqual(pipeline.retriever.queries, ["Standalone question"])
+        self.assertEqual(result["question"], "Standalone question")
+
+    def test_never(self):
+        pipeline = make_pipeline(CondenseMode.NEVER)
+        pipeline({"question": "Can I avoid it?", "chat_history": HISTORY})
+
+        self.assertEqual(pipeline.condense_model.prompts, [])
+        self.assertEqual(pipeline.retriever.queries, ["Can I avoid it?"])
+
+    def test_heuristic(self):
+        pipeline = make_pipeline(CondenseMode.HEURISTIC)
+        pipeline({"question": "How do I close the account?", "chat_history": HISTORY})
+        pipeline({"question": "Can I avoid it?", "chat_history": HISTORY})
+
+        self.assertEqual(len(pipeline.condense_model.prompts), 1)
+        self.assertEqual(pipeline.retriever.queries, ["How do I close the account?", "Standalone question"])
+
+    def test_answer_prompt(self):
+        pipeline = make_pipeline(CondenseMode.ALWAYS)
+        pipeline({"question": "Can I avoid it?", "chat_history": HISTORY})
+
+        system, *history, question = pipeline.answer_model.prompts[0]
+        self.assertIsInstance(system, SystemMessage)
+        self.assertTrue(system.content.startswith(ANSWER_INSTRUCTIONS))
+        self.assertTrue(system.content.endswith("Document about Standalone question"))
+        self.assertEqual(history, HISTORY)
+        self.assertEqual(question, HumanMessage(content="Can I avoid it?"))
+
+    def test_timings(self):
+        result = make_pipeline(CondenseMode.ALWAYS)({"question": "Can I avoid it?", "chat_history": HISTORY})
+        self.assertEqual(set(result["timings"]), {"condense", "retrieve", "answer"})
+        self.assertTrue(all(seconds >= 0 for seconds in result["timings"].values()))
+
+    def test_token_usage_and_metrics(self):
+        calls = LLM_CALLS.value(stage="condense", model="FakeChatModel")
+        answer_tokens = LLM_TOKENS.value(stage="answer", model="FakeChatModel", kind="completion")
+        observed = STAGE_SECONDS.count(stage="retrieve")
+
+        result = make_pipeline(CondenseMode.ALWAYS)({"question": "Can I avoid it?", "chat_history": HISTORY})
+
+        self.assertEqual(result["token_usage"]["completion_tokens"], 4)  # "Standalone question" and "The answer".
+        self.assertGreater(result["token_usage"]["prompt_tokens"], 4)
+        self.assertEqual(LLM_CALLS.value(stage="condense", model="FakeChatModel"), calls + 1)
+        self.assertEqual(LLM_TOKENS.value(stage="answer", model="FakeChatModel", kind="completion"),
+                         answer_tokens + 2)
+        self.assertEqual(STAGE_SECONDS.count(stage="retrieve"), observed + 1)
+
+    def test_async_streams_answer_tokens_only(self):
+        pipeline = make_pipeline(CondenseMode.ALWAYS)
+        collector = TokenCollector()
+        result = asyncio.run(pipeline.acall({"question": "Can I avoid it?", "chat_history": HISTORY},
+                                            callbacks=[collector]))
+
+        self.assertEqual(collector.tokens, ["The", "answer"])
+        self.assertEqual(result["answer"], "The answer")
+        self.assertEqual(result["source_documents"], [Document(page_content="Document about Standalone question")])
@@ -0,0 +1,84 @@
+import asyncio
+from http import HTTPStatus
+from unittest import TestCase
+from unittest.mock import AsyncMock, Mock, patch
+
+from fastapi import HTTPException
+from langchain.schema import HumanMessage, AIMessage, SystemMessage
+
+from history_trimming import SUMMARY_PREFIX
+from test_helpers import FakeEncoding
+
+# The assistant is built on import. Fake models and no embedding cache keep it offline and off the disk.
+with patch('utils.MODEL_BACKEND', 'fake'), patch('utils.EMBEDDING_CACHE_ENABLED', False):
+    import assistant_api
+
+
+class TestAnswerCache(TestCase):
+    def setUp(self):
+        self.answer_cache = Mock(get=Mock(return_value=("Cached answer", None)))
+        patcher = patch('assistant_api.answer_cache', self.answer_cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.chain = Mock(acall=AsyncMock(return_value={"answer": "Generated answer"}))
+
+    def answer(self, chat_history: list, question: str = "And the fees?") -> str:
+        return asyncio.run(assistant_api._generate_answer(self.chain, question, chat_history))
+
+    def test_standalone_question_is_answered_from_cache(self):
+        self.assertEqual(self.answer([]), "Cached answer")
+        self.chain.acall.assert_not_called()
+
+    def test_follow_up_with_history_misses_cache(self):
+        chat_history = [HumanMessage(content="Tell me about the card"), AIMessage(content="It is a debit card")]
+
+        self.assertEqual(self.answer(chat_history), "Generated answer")
+        self.answer_cache.get.assert_not_called()
+        self.answer_cache.put.assert_not_called()
+
+    def test_standalone_question_with_history_is_answered_from_cache(self):
+        chat_history = [HumanMessage(content="What are the fees of the card?"), AIMessage(content="The fee is $5.")]
+
+        self.assertEqual(self.answer(chat_history, "What are the fees of the card?"), "Cached answer")
+        self.answer_cache.get.assert_called_once_with("What are the fees of the card?")
+        self.chain.acall.assert_not_called()
+
+
+class TestCoalescingKey(TestCase):
+    def test_standalone_questions_are_coalesced(self):
+        chat_history = [HumanMessage(content="Tell me about the card"), AIMessage(content="It is a debit card")]
+
+        with patch('assistant_api.COALESCE_QUESTIONS', True):
+            self.assertIsNotNone(assistant_api._coalescing_key("What are the fees of the card?", chat_history))
+            self.assertIsNotNone(assistant_api._coalescing_key("And the fees?", []))
+            self.assertIsNone(assistant_api._coalescing_key("And the fees?", chat_history))
+
+
+class TestPrepareRequest(TestCase):
+    def test_invalid_message_is_rejected(self):
+        for data in ({}, {"message": None}, {"message": 5}, {"message": ["Hi"]}, {"message": " "}, ["Hi"]):
+            request = Mock(json=AsyncMock(return_value=data))
+            with self.subTest(data=data), self.assertRaises(HTTPException) as raised:
+                asyncio.run(assistant_api._prepare_request(request, user_id=1))
+            self.assertEqual(raised.exception.status_code, HTTPStatus.BAD_REQUEST)
+
+
+class TestAddSummary(TestCase):
+    def setUp(self):
+        patcher = patch('tokens.get_encoding', Mock(return_value=FakeEncoding()))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_dropped_messages_are_summarized_once(self):
+        summarize = Mock(return_value="The user asked about the card.")
+        kept = [HumanMessage(content="And the fees?")]
+        dropped = [HumanMessage(content="Tell me about the card"), AIMessage(content="It is a debit card")]
+
+        with patch('assistant_api.history_summarizer', summarize), \
+                patch('assistant_api.summary_cache', assistant_api.SummaryCache()):
+            for _ in range(2):
+                chat_history = asyncio.run(assistant_api._add_summary(1, kept, dropped))
+
+        summarize.assert_called_once_with(dropped)
+        self.assertEqual(chat_history,
+                         [SystemMessage(content=SUMMARY_PREFIX + "The user asked about the card."), *kept])
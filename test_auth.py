@@ -0,0 +1,100 @@
+import sqlite3
+from unittest import TestCase
+from unittest.mock import Mock
+
+from auth import ApiKeyCache, MISSING
+from db_services import re_initialize_db, register_new_api_key, revoke_api_key, get_api_keys_revision, \
+    get_user_id_by_api_key, get_user_api_keys
+
+
+class TestApiKeyCache(TestCase):
+    def setUp(self):
+        self.users = {'key-1': 1, 'key-2': 2}
+        self.revision = 0
+        self.lookup = Mock(side_effect=lambda key: self.users.get(key))
+        self.get_revision = Mock(side_effect=lambda: self.revision)
+
+    def make_cache(self, **kwargs) -> ApiKeyCache:
+        options = dict(ttl=60, max_size=10, revision_check_interval=60)
+        options.update(kwargs)
+        return ApiKeyCache(lookup=self.lookup, get_revision=self.get_revision, **options)
+
+    def test_key_is_looked_up_once(self):
+        cache = self.make_cache()
+
+        self.assertIs(cache.get_cached('key-1'), MISSING)
+        self.assertEqual(cache.resolve('key-1'), 1)
+        self.assertEqual(cache.get_cached('key-1'), 1)
+        self.assertEqual(cache.resolve('key-1'), 1)
+        self.assertEqual(self.lookup.call_count, 1)
+
+    def test_unknown_key_is_cached(self):
+        cache = self.make_cache()
+
+        self.assertIsNone(cache.resolve('unknown'))
+        self.assertIsNone(cache.get_cached('unknown'))
+        self.assertEqual(self.lookup.call_count, 1)
+
+    def test_expired_key_is_looked_up_again(self):
+        cache = self.make_cache(ttl=0)
+
+        cache.resolve('key-1')
+
+        self.assertIs(cache.get_cached('key-1'), MISSING)
+        cache.resolve('key-1')
+        self.assertEqual(self.lookup.call_count, 2)
+
+    def test_least_recently_used_key_is_evicted(self):
+        cache = self.make_cache(max_size=1)
+
+        cache.resolve('key-1')
+        cache.resolve('key-2')
+
+        self.assertIs(cache.get_cached('key-1'), MISSING)
+        self.assertEqual(cache.get_cached('key-2'), 2)
+
+    def test_revision_change_drops_cache(self):
+        cache = self.make_cache(revision_check_interval=0)
+        cache.resolve('key-1')
+
+        del self.users['key-1']
+        self.revision += 1
+
+        self.assertIsNone(cache.resolve('key-1'))
+
+    def test_revision_is_not_checked_within_interval(self):
+        cache = self.make_cache()
+        cache.resolve('key-1')
+        cache.resolve('key-2')
+
+        self.assertEqual(self.get_revision.call_count, 1)
+
+
+class TestApiKeysRevision(TestCase):
+    def setUp(self):
+        self.db_connection = sqlite3.connect(':memory:')
+        re_initialize_db(self.db_connection)
+
+    def tearDown(self):
+        self.db_connection.close()
+
+    def test_register_bumps_revision(self):
+        revision = get_api_keys_revision(self.db_connection)
+        register_new_api_key(self.db_connection)
+        self.assertEqual(get_api_keys_revision(self.db_connection), revision + 1)
+
+    def test_revoke(self):
+        key = register_new_api_key(self.db_connection)
+        revision = get_api_keys_revision(self.db_connection)
+
+        self.assertTrue(revoke_api_key(self.db_connection, key))
+
+        self.assertIsNone(get_user_id_by_api_key(self.db_connection, key))
+        self.assertEqual(get_user_api_keys(self.db_connection), [])
+        self.assertEqual(get_api_keys_revision(self.db_connection), revision + 1)
+
+    def test_revoke_unknown_key(self):
+        revision = get_api_keys_revision(self.db_connection)
+
+        self.assertFalse(revoke_api_key(self.db_connection, 'unknown'))
+        self.assertEqual(get_api_keys_revision(self.db_connection), revision)
@@ -0,0 +1,73 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from bm25_index import BM25Index, tokenize
+
+DOCUMENTS = [
+    "Refunds are issued within 30 days of the purchase.",
+    "The arbitration clause covers all disputes between you and Nifty Bridge.",
+    "Fees are charged monthly. Fees are not refunded.",
+    "Privacy of your data is described in the privacy policy.",
+]
+
+
+def make_index() -> BM25Index:
+    return BM25Index.build(ids=[f"id{i}" for i in range(len(DOCUMENTS))],
+                           documents=DOCUMENTS,
+                           metadatas=[{"file": "terms.pdf", "chunk": i} for i in range(len(DOCUMENTS))])
+
+
+class TestBM25Index(TestCase):
+    def test_stop_words_are_skipped(self):
+        self.assertEqual(tokenize("What is the Arbitration clause?"), ["arbitration", "clause"])
+
+    def test_best_match_first(self):
+        results = make_index().search("arbitration clause", k=4)
+        self.assertEqual(results[0][0], 1)
+        self.assertEqual(len(results), 1)  # Other chunks have none of the words.
+
+    def test_frequent_word_scores_higher(self):
+        rows = [row for row, _ in make_index().search("fees privacy", k=4)]
+        self.assertEqual(sorted(rows), [2, 3])
+
+    def test_k_limits_results(self):
+        self.assertEqual(len(make_index().search("fees refunds privacy arbitration", k=2)), 2)
+
+    def test_unknown_words(self):
+        index = make_index()
+        self.assertEqual(index.search("blockchain", k=4), [])
+        self.assertEqual(index.search("", k=4), [])
+
+    def test_score_is_below_max_score(self):
+        index = make_index()
+        for query in ("arbitration clause", "fees", "arbitration blockchain"):
+            for _, score in index.search(query, k=4):
+                self.assertLess(score, index.max_score(query))
+
+    def test_unknown_words_are_not_in_max_score(self):
+        index = make_index()
+        self.assertEqual(index.max_score("arbitration blockchain"), index.max_score("arbitration"))
+        self.assertGreater(index.max_score("arbitration clause"), index.max_score("arbitration"))
+
+    def test_document(self):
+        document = make_index().document(1)
+        self.assertEqual(document.page_content, DOCUMENTS[1])
+        self.assertEqual(document.metadata, {"file": "terms.pdf", "chunk": 1})
+
+    def test_save_and_load(self):
+        index = make_index()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index_file = os.path.join(tmp_dir, 'bm25.json')
+            self.assertIsNone(BM25Index.load(index_file))
+
+            index.save(index_file)
+            loaded = BM25Index.load(index_file)
+
+        self.assertEqual(loaded.ids, index.ids)
+        self.assertEqual(loaded.search("fees refunds", k=4), index.search("fees refunds", k=4))
+
+    def test_empty_index(self):
+        index = BM25Index.build([], [], [])
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.search("fees", k=4), [])
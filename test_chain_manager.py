@@ -0,0 +1,101 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock
+
+from chain_manager import ChainManager, mark_vector_store_updated, read_vector_store_version
+
+
+class TestVectorStoreVersion(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.version_file = os.path.join(self.tmp_dir.name, 'version')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_missing_version(self):
+        self.assertIsNone(read_vector_store_version(self.version_file))
+
+    def test_mark_updated(self):
+        version = mark_vector_store_updated(self.version_file)
+        self.assertEqual(read_vector_store_version(self.version_file), version)
+
+
+class TestChainManager(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.version_file = os.path.join(self.tmp_dir.name, 'version')
+        self.chain_factory = Mock(side_effect=lambda: object())
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_chain_is_built_once(self):
+        manager = ChainManager(self.chain_factory, version_file=self.version_file, reload_check_interval=0)
+        chain = manager.load()
+
+        self.assertIs(manager.get_chain(), chain)
+        self.assertIs(manager.get_chain(), chain)
+        self.assertEqual(self.chain_factory.call_count, 1)
+
+    def test_chain_is_built_lazily(self):
+        manager = ChainManager(self.chain_factory, version_file=self.version_file, reload_check_interval=0)
+
+        chain = manager.get_chain()
+
+        self.assertIs(manager.get_chain(), chain)
+        self.assertEqual(self.chain_factory.call_count, 1)
+
+    def test_chain_is_reloaded_on_vector_store_update(self):
+        manager = ChainManager(self.chain_factory, version_file=self.version_file, reload_check_interval=0)
+        old_chain = manager.load()
+
+        mark_vector_store_updated(self.version_file)
+        new_chain = manager.get_chain()
+
+        self.assertIsNot(new_chain, old_chain)
+        self.assertIs(manager.get_chain(), new_chain)
+        self.assertEqual(self.chain_factory.call_count, 2)
+
+    def test_version_is_not_checked_within_interval(self):
+        manager = ChainManager(self.chain_factory, version_file=self.version_file, reload_check_interval=3600)
+        chain = manager.load()
+
+        mark_vector_store_updated(self.version_file)
+
+        self.assertIs(manager.get_chain(), chain)
+        self.assertEqual(self.chain_factory.call_count, 1)
+
+    def test_on_reload_is_called_on_vector_store_update(self):
+        on_reload = Mock()
+        manager = ChainManager(self.chain_factory, version_file=self.version_file, reload_check_interval=0,
+                               on_reload=on_reload)
+        manager.load()
+        manager.get_chain()
+        on_reload.assert_not_called()
+
+        mark_vector_store_updated(self.version_file)
+        manager.get_chain()
+
+        on_reload.assert_called_once_with()
+
+    def test_old_chain_is_served_if_reload_fails(self):
+        manager = ChainManager(self.chain_factory, version_file=self.version_file, reload_check_interval=3600)
+        old_chain = manager.load()
+        self.chain_factory.side_effect = OSError("Store is being written")
+
+        mark_vector_store_updated(self.version_file)
+        manager._next_check_at = 0.0  # The interval has passed.
+        with self.assertLogs('chain_manager', level='ERROR'):
+            self.assertIs(manager.get_chain(), old_chain)
+
+        # Rebuild is not retried by every request, but after the interval.
+        self.assertIs(manager.get_chain(), old_chain)
+        self.assertEqual(self.chain_factory.call_count, 2)
+
+        self.chain_factory.side_effect = lambda: object()
+        manager._next_check_at = 0.0
+        new_chain = manager.get_chain()
+        self.assertIsNot(new_chain, old_chain)
+        self.assertIs(manager.get_chain(), new_chain)
@@ -0,0 +1,138 @@
+import io
+import json
+import os
+import sqlite3
+import tempfile
+from contextlib import closing
+from unittest import TestCase
+from unittest.mock import patch, Mock
+
+from langchain.schema import HumanMessage, AIMessage
+
+from chat_history_maintenance import export_chat_history, apply_retention
+from db_pool import open_connection
+from db_services import re_initialize_db, register_new_api_key, get_user_id_by_api_key, save_to_chat_history, \
+    load_chat_history, compact_db
+from history_trimming import SUMMARY_PREFIX
+from test_helpers import FakeEncoding
+
+
+class TestChatHistoryMaintenance(TestCase):
+    def setUp(self):
+        patcher = patch('tokens.get_encoding', Mock(return_value=FakeEncoding()))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.db_file = os.path.join(tmp_dir.name, 'users.sqlite3')
+        self.db_connection = open_connection(self.db_file)
+        self.addCleanup(self.db_connection.close)
+        re_initialize_db(self.db_connection)
+
+        self.user_id = get_user_id_by_api_key(self.db_connection, register_new_api_key(self.db_connection))
+        self.other_user_id = get_user_id_by_api_key(self.db_connection, register_new_api_key(self.db_connection))
+        for i in range(5):
+            save_to_chat_history(self.db_connection, [HumanMessage(content=f'question {i}'),
+                                                      AIMessage(content=f'answer {i}')], self.user_id)
+        save_to_chat_history(self.db_connection, [HumanMessage(content='other question')], self.other_user_id)
+
+    def test_export(self):
+        out = io.StringIO()
+        exported = export_chat_history(self.db_connection, out, page_size=3)
+
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(exported, 11)
+        self.assertEqual([row["text"] for row in rows[:2]], ['question 0', 'answer 0'])
+        self.assertEqual([row["id"] for row in rows], sorted(row["id"] for row in rows))
+        self.assertEqual(set(rows[0]), {"id", "user_id", "sender", "text", "created_at"})
+
+    def test_export_of_one_user(self):
+        out = io.StringIO()
+        export_chat_history(self.db_connection, out, user_id=self.other_user_id)
+
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([(row["user_id"], row["sender"], row["text"]) for row in rows],
+                         [(self.other_user_id, 'user', 'other question')])
+
+    def test_max_messages(self):
+        stats = apply_retention(self.db_connection, max_messages=3, batch_size=2)
+
+        self.assertEqual(stats, {"users": 1, "deleted": 7, "summarized": 0})
+        self.assertEqual(load_chat_history(self.db_connection, self.user_id),
+                         [AIMessage(content='answer 3'), HumanMessage(content='question 4'),
+                          AIMessage(content='answer 4')])
+        self.assertEqual(len(load_chat_history(self.db_connection, self.other_user_id)), 1)
+
+    def test_max_age(self):
+        self.db_connection.execute("UPDATE Message SET created_at = '2000-01-01 00:00:00' WHERE text LIKE '%0'")
+        self.db_connection.commit()
+
+        stats = apply_retention(self.db_connection, max_age_days=30)
+
+        self.assertEqual(stats["deleted"], 2)
+        self.assertEqual(load_chat_history(self.db_connection, self.user_id)[0], HumanMessage(content='question 1'))
+
+    def test_summarize(self):
+        summarize = Mock(return_value="The user asked questions 0 to 2.")
+
+        stats = apply_retention(self.db_connection, max_messages=4, summarize=summarize)
+
+        self.assertEqual(stats, {"users": 1, "deleted": 5, "summarized": 6})
+        summarized = summarize.call_args[0][0]
+        self.assertEqual(summarized[0], HumanMessage(content='question 0'))
+        self.assertEqual(summarized[-1], AIMessage(content='answer 2'))
+        self.assertEqual(load_chat_history(self.db_connection, self.user_id), [
+            AIMessage(content=SUMMARY_PREFIX + "The user asked questions 0 to 2."),
+            HumanMessage(content='question 3'), AIMessage(content='answer 3'),
+            HumanMessage(content='question 4'), AIMessage(content='answer 4'),
+        ])
+
+        # Only the summary is beyond the limit now, so it is not summarized again.
+        self.assertEqual(apply_retention(self.db_connection, max_messages=4, summarize=summarize)["users"], 0)
+        self.assertEqual(summarize.call_count, 1)
+
+    def test_previous_summary_is_summarized_again(self):
+        summarize = Mock(side_effect=["The user asked questions 0 to 2.", "The user asked questions 0 to 4."])
+        apply_retention(self.db_connection, max_messages=4, summarize=summarize)
+        for i in range(5, 7):
+            save_to_chat_history(self.db_connection, [HumanMessage(content=f'question {i}'),
+                                                      AIMessage(content=f'answer {i}')], self.user_id)
+
+        # The previous summary is not among the newest expired messages.
+        with patch('chat_history_maintenance.SUMMARY_SOURCE_MAX_MESSAGES', 2):
+            stats = apply_retention(self.db_connection, max_messages=4, summarize=summarize)
+
+        self.assertEqual(stats, {"users": 1, "deleted": 4, "summarized": 2})
+        self.assertEqual(summarize.call_args[0][0], [
+            AIMessage(content=SUMMARY_PREFIX + "The user asked questions 0 to 2."),
+            HumanMessage(content='question 4'), AIMessage(content='answer 4'),
+        ])
+        self.assertEqual(load_chat_history(self.db_connection, self.user_id)[0],
+                         AIMessage(content=SUMMARY_PREFIX + "The user asked questions 0 to 4."))
+
+    def test_compact(self):
+        with self.db_connection:
+            self.db_connection.executemany('INSERT INTO Message (user_id, sender, text) VALUES (?, ?, ?)',
+                                           [(self.user_id, 'user', 'x' * 1000)] * 2000)
+        self.db_connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        size = os.path.getsize(self.db_file)
+
+        apply_retention(self.db_connection, max_messages=10)
+        self.assertTrue(compact_db(self.db_connection))
+
+        self.assertLess(os.path.getsize(self.db_file), size / 10)
+        self.assertEqual(len(load_chat_history(self.db_connection, self.user_id)), 10)
+
+    def test_compact_converts_database_without_auto_vacuum(self):
+        db_file = os.path.join(os.path.dirname(self.db_file), 'old.sqlite3')
+        with closing(sqlite3.connect(db_file)) as db_connection:
+            db_connection.execute('CREATE TABLE Message (id INTEGER PRIMARY KEY, text TEXT)')
+            self.assertEqual(db_connection.execute('PRAGMA auto_vacuum').fetchone()[0], 0)
+
+            # Not converted, unless asked to, as it locks the database for the whole VACUUM.
+            self.assertFalse(compact_db(db_connection))
+            self.assertEqual(db_connection.execute('PRAGMA auto_vacuum').fetchone()[0], 0)
+
+            self.assertTrue(compact_db(db_connection, convert=True))
+            self.assertEqual(db_connection.execute('PRAGMA auto_vacuum').fetchone()[0], 2)
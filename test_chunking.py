@@ -0,0 +1,62 @@
+from unittest import TestCase
+from unittest.mock import patch, Mock
+
+from app_types import PageData
+from chunking import iter_token_chunks
+from test_helpers import FakeEncoding
+
+
+def sentence(words: int, name: str = 'word') -> str:
+    return " ".join([name] * (words - 1) + [f"{name}."])
+
+
+@patch('tokens.get_encoding', Mock(return_value=FakeEncoding()))
+class TestIterTokenChunks(TestCase):
+    def chunks(self, pages, chunk_tokens=10, overlap_tokens=0):
+        return list(iter_token_chunks(pages, {"title": "Terms"}, chunk_tokens=chunk_tokens,
+                                      overlap_tokens=overlap_tokens))
+
+    def test_sentences_are_packed_up_to_the_limit(self):
+        text = " ".join([sentence(4, 'a'), sentence(4, 'b'), sentence(4, 'c')])
+
+        chunks = self.chunks([PageData(num=0, text=text)])
+
+        self.assertEqual([chunk.page_content for chunk in chunks],
+                         [f"{sentence(4, 'a')} {sentence(4, 'b')}", sentence(4, 'c')])
+        self.assertEqual(chunks[1].metadata,
+                         {"page_number": 0, "page_end": 0, "chunk": 1, "source": "p0-1", "title": "Terms"})
+
+    def test_chunk_spans_pages(self):
+        chunks = self.chunks([PageData(num=1, text="The sentence continues"),
+                              PageData(num=2, text="on the next page.")])
+
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(chunks[0].page_content, "The sentence continues on the next page.")
+        self.assertEqual((chunks[0].metadata["page_number"], chunks[0].metadata["page_end"]), (1, 2))
+        self.assertEqual(chunks[0].metadata["source"], "p1-p2-0")
+
+    def test_overlap_repeats_last_sentences(self):
+        text = " ".join([sentence(4, 'a'), sentence(2, 'b'), sentence(4, 'c'), sentence(4, 'd')])
+
+        chunks = self.chunks([PageData(num=0, text=text)], chunk_tokens=9, overlap_tokens=3)
+
+        self.assertEqual([chunk.page_content for chunk in chunks],
+                         [f"{sentence(4, 'a')} {sentence(2, 'b')}",
+                          f"{sentence(2, 'b')} {sentence(4, 'c')}",
+                          f"{sentence(4, 'd')}"])
+
+    def test_long_sentence_is_split_by_tokens(self):
+        chunks = self.chunks([PageData(num=0, text=sentence(25))])
+
+        self.assertEqual([len(chunk.page_content.split()) for chunk in chunks], [10, 10, 5])
+
+    def test_no_chunk_exceeds_the_limit(self):
+        text = " ".join(sentence(words) for words in (3, 7, 1, 9, 4, 12, 2, 6, 5, 8) * 5)
+
+        chunks = self.chunks([PageData(num=0, text=text), PageData(num=1, text=text)], overlap_tokens=4)
+
+        self.assertTrue(all(len(chunk.page_content.split()) <= 10 for chunk in chunks))
+        self.assertEqual([chunk.metadata["chunk"] for chunk in chunks], list(range(len(chunks))))
+
+    def test_empty_pages(self):
+        self.assertEqual(self.chunks([PageData(num=0, text=" \n ")]), [])
@@ -0,0 +1,160 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from langchain.embeddings.base import Embeddings
+
+from coalescing import SingleFlight, BatchingEmbeddings, normalize_question
+
+
+class TestNormalizeQuestion(TestCase):
+    def test_case_spaces_and_punctuation(self):
+        self.assertEqual(normalize_question("  What are the  FEES?\n"), "what are the fees")
+        self.assertEqual(normalize_question("What are the fees ?!"), "what are the fees")
+
+    def test_words_are_kept(self):
+        self.assertNotEqual(normalize_question("What are the fees?"), normalize_question("What are fees?"))
+
+
+class TestSingleFlight(TestCase):
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.calls = 0
+
+    async def answer(self, delay: float = 0.05) -> str:
+        self.calls += 1
+        call = self.calls
+        await asyncio.sleep(delay)
+        return f"answer {call}"
+
+    def test_concurrent_calls_are_coalesced(self):
+        async def run():
+            return await asyncio.gather(*(self.flights.run("fees", self.answer) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(run()), ["answer 1"] * 5)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.flights.stats(), {"in_flight": 0, "leaders": 1, "followers": 4})
+
+    def test_different_keys_are_not_coalesced(self):
+        async def run():
+            return await asyncio.gather(self.flights.run("fees", self.answer), self.flights.run("refunds", self.answer))
+
+        self.assertEqual(sorted(asyncio.run(run())), ["answer 1", "answer 2"])
+
+    def test_results_are_not_cached(self):
+        async def run():
+            return [await self.flights.run("fees", self.answer), await self.flights.run("fees", self.answer)]
+
+        self.assertEqual(asyncio.run(run()), ["answer 1", "answer 2"])
+
+    def test_none_key_is_not_coalesced(self):
+        async def run():
+            return await asyncio.gather(self.flights.run(None, self.answer), self.flights.run(None, self.answer))
+
+        asyncio.run(run())
+        self.assertEqual(self.calls, 2)
+
+    def test_follower_answers_if_leader_is_cancelled(self):
+        async def run():
+            leader = asyncio.ensure_future(self.flights.run("fees", self.answer))
+            await asyncio.sleep(0.01)
+            follower = asyncio.ensure_future(self.flights.run("fees", self.answer))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await follower
+
+        self.assertEqual(asyncio.run(run()), "answer 2")
+
+    def test_exception_is_shared(self):
+        async def fail():
+            self.calls += 1
+            await asyncio.sleep(0.05)
+            raise ValueError("model is down")
+
+        async def run():
+            return await asyncio.gather(*(self.flights.run("fees", fail) for _ in range(3)), return_exceptions=True)
+
+        results = asyncio.run(run())
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    def test_wait(self):
+        async def run():
+            self.assertIsNone(await self.flights.wait("fees"))
+            with self.flights.lead("fees") as flight:
+                follower = asyncio.ensure_future(self.flights.wait("fees"))
+                await asyncio.sleep(0.01)
+                flight.set_result("answer")
+            return await follower
+
+        self.assertEqual(asyncio.run(run()), "answer")
+
+    def test_wait_for_leader_without_result(self):
+        async def run():
+            with self.flights.lead("fees"):
+                follower = asyncio.ensure_future(self.flights.wait("fees", default="own answer"))
+                await asyncio.sleep(0.01)
+            return await follower
+
+        self.assertEqual(asyncio.run(run()), "own answer")
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self, fail: bool = False):
+        self.batches = []
+        self.fail = fail
+        self.lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self.lock:
+            self.batches.append(list(texts))
+        if self.fail:
+            raise ValueError("embeddings are down")
+        return [[float(len(text))] for text in texts]
+
+    def embed_query(self, text):
+        raise AssertionError("queries should be embedded in batches")
+
+
+class TestBatchingEmbeddings(TestCase):
+    def embed_concurrently(self, embeddings, texts):
+        with ThreadPoolExecutor(max_workers=len(texts)) as pool:
+            return list(pool.map(embeddings.embed_query, texts))
+
+    def test_concurrent_queries_are_batched(self):
+        inner = CountingEmbeddings()
+        embeddings = BatchingEmbeddings(inner, window=0.2, max_batch_size=100)
+        texts = [f"question {'?' * i}" for i in range(8)]
+
+        self.assertEqual(self.embed_concurrently(embeddings, texts), [[float(len(text))] for text in texts])
+        self.assertLess(len(inner.batches), len(texts))
+        self.assertEqual(sorted(text for batch in inner.batches for text in batch), sorted(texts))
+        self.assertEqual(embeddings.stats(), {"queries": 8, "calls": len(inner.batches)})
+
+    def test_identical_queries_are_embedded_once(self):
+        inner = CountingEmbeddings()
+        embeddings = BatchingEmbeddings(inner, window=0.2, max_batch_size=100)
+
+        self.assertEqual(self.embed_concurrently(embeddings, ["fees"] * 6), [[4.0]] * 6)
+        self.assertEqual(sum(len(batch) for batch in inner.batches), len(inner.batches))
+
+    def test_full_batch_is_embedded_at_once(self):
+        inner = CountingEmbeddings()
+        embeddings = BatchingEmbeddings(inner, window=10, max_batch_size=2)
+
+        self.embed_concurrently(embeddings, ["a", "b", "c", "d"])  # Would take 10 seconds, if batches waited.
+        self.assertTrue(all(len(batch) <= 2 for batch in inner.batches))
+
+    def test_exception_is_raised_to_every_query(self):
+        embeddings = BatchingEmbeddings(CountingEmbeddings(fail=True), window=0.05)
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            futures = [pool.submit(embeddings.embed_query, text) for text in ("a", "b", "c")]
+        for future in futures:
+            self.assertIsInstance(future.exception(), ValueError)
+
+    def test_documents_are_not_delayed(self):
+        inner = CountingEmbeddings()
+        embeddings = BatchingEmbeddings(inner, window=10)
+        self.assertEqual(embeddings.embed_documents(["a", "bb"]), [[1.0], [2.0]])
+        self.assertEqual(inner.batches, [["a", "bb"]])
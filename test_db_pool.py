@@ -0,0 +1,72 @@
+import os
+import tempfile
+import threading
+from unittest import TestCase
+from unittest.mock import patch, Mock
+
+from langchain.schema import HumanMessage, AIMessage
+
+from db_pool import ConnectionPool
+from db_services import re_initialize_db, register_new_api_key, get_user_id_by_api_key, save_to_chat_history, \
+    load_chat_history
+from test_helpers import FakeEncoding
+
+
+class TestConnectionPool(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmp_dir.name, 'users.sqlite3')
+        self.pool = ConnectionPool(self.db_file, size=2)
+        with self.pool.connection() as db_connection:
+            re_initialize_db(db_connection)
+
+    def tearDown(self):
+        self.pool.close()
+        self.tmp_dir.cleanup()
+
+    def test_wal_mode(self):
+        with self.pool.connection() as db_connection:
+            journal_mode = db_connection.execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual(journal_mode, 'wal')
+
+    def test_connection_is_reused(self):
+        with self.pool.connection() as first:
+            pass
+        with self.pool.connection() as second:
+            pass
+        self.assertIs(first, second)
+
+    def test_uncommitted_transaction_is_rolled_back(self):
+        with self.pool.connection() as db_connection:
+            db_connection.execute("INSERT INTO User (key) VALUES ('uncommitted')")
+
+        with self.pool.connection() as db_connection:
+            self.assertIsNone(get_user_id_by_api_key(db_connection, 'uncommitted'))
+
+    def test_size_is_limited(self):
+        acquired = []
+
+        def worker():
+            with self.pool.connection() as db_connection:
+                acquired.append(db_connection)
+
+        with self.pool.connection() as first, self.pool.connection() as second:
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join(timeout=0.2)
+            self.assertTrue(thread.is_alive())
+
+        thread.join()
+        self.assertIn(acquired[0], (first, second))
+
+    @patch('tokens.get_encoding', Mock(return_value=FakeEncoding()))
+    def test_save_to_chat_history(self):
+        with self.pool.connection() as db_connection:
+            key = register_new_api_key(db_connection)
+            user_id = get_user_id_by_api_key(db_connection, key)
+            save_to_chat_history(db_connection, [HumanMessage(content='question'), AIMessage(content='answer')],
+                                 user_id)
+
+        with self.pool.connection() as db_connection:
+            self.assertEqual(load_chat_history(db_connection, user_id),
+                             [HumanMessage(content='question'), AIMessage(content='answer')])
@@ -0,0 +1,105 @@
+import os
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from unittest.mock import patch, Mock
+
+from langchain.schema import HumanMessage, AIMessage
+
+from db_services import re_initialize_db, register_new_api_key, get_user_id_by_api_key, save_to_chat_history, \
+    load_chat_history, iter_chat_history_newest_first, migrate_db, MIGRATIONS
+from test_helpers import FakeEncoding
+
+
+class TestMigrations(TestCase):
+    def setUp(self):
+        self.db_connection = sqlite3.connect(':memory:')
+
+    def tearDown(self):
+        self.db_connection.close()
+
+    def test_all_migrations_are_applied(self):
+        re_initialize_db(self.db_connection)
+
+        version = self.db_connection.execute('PRAGMA user_version').fetchone()[0]
+        self.assertEqual(version, len(MIGRATIONS))
+
+    def test_migrations_are_applied_once(self):
+        re_initialize_db(self.db_connection)
+        migrate_db(self.db_connection)
+        re_initialize_db(self.db_connection)
+
+        version = self.db_connection.execute('PRAGMA user_version').fetchone()[0]
+        self.assertEqual(version, len(MIGRATIONS))
+
+    def test_concurrent_servers_migrate_once(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_file = os.path.join(tmp_dir, 'users.sqlite3')
+
+            def initialize(_):
+                with sqlite3.connect(db_file, timeout=10) as db_connection:
+                    re_initialize_db(db_connection)
+                    return db_connection.execute('PRAGMA user_version').fetchone()[0]
+
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                self.assertEqual(list(pool.map(initialize, range(4))), [len(MIGRATIONS)] * 4)
+
+    def test_chat_history_query_uses_index(self):
+        re_initialize_db(self.db_connection)
+
+        plan = self.db_connection.execute(
+            'EXPLAIN QUERY PLAN SELECT id FROM Message WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT 10',
+            (1, 100)
+        ).fetchall()
+        self.assertIn('MessageUserIdId', plan[0][3])
+
+
+class TestChatHistory(TestCase):
+    def setUp(self):
+        patcher = patch('tokens.get_encoding', Mock(return_value=FakeEncoding()))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.db_connection = sqlite3.connect(':memory:')
+        re_initialize_db(self.db_connection)
+        self.user_id = get_user_id_by_api_key(self.db_connection, register_new_api_key(self.db_connection))
+        other_user_id = get_user_id_by_api_key(self.db_connection, register_new_api_key(self.db_connection))
+
+        self.messages = []
+        for i in range(7):
+            exchange = [HumanMessage(content=f'question {i}'), AIMessage(content=f'answer {i}')]
+            save_to_chat_history(self.db_connection, exchange, self.user_id)
+            save_to_chat_history(self.db_connection, [HumanMessage(content='other')], other_user_id)
+            self.messages.extend(exchange)
+
+    def tearDown(self):
+        self.db_connection.close()
+
+    def test_load_chat_history(self):
+        self.assertEqual(load_chat_history(self.db_connection, self.user_id), self.messages)
+
+    def test_iter_chat_history_newest_first(self):
+        for page_size in (1, 3, 14, 100):
+            with self.subTest(page_size=page_size):
+                history = iter_chat_history_newest_first(self.db_connection, self.user_id, page_size=page_size)
+                self.assertEqual([message for message, _ in history], self.messages[::-1])
+
+    def test_iter_chat_history_reads_lazily(self):
+        statements = []
+        self.db_connection.set_trace_callback(statements.append)
+
+        history = iter_chat_history_newest_first(self.db_connection, self.user_id, page_size=2)
+        self.assertEqual([next(history)[0], next(history)[0]], self.messages[:-3:-1])
+
+        self.assertEqual(len(statements), 1)
+
+    def test_token_counts_are_saved(self):
+        history = iter_chat_history_newest_first(self.db_connection, self.user_id)
+        self.assertEqual(next(history), (AIMessage(content='answer 6'), 2))
+
+    def test_token_counts_of_old_messages_are_counted_on_read(self):
+        self.db_connection.execute("UPDATE Message SET token_count = NULL")
+
+        history = iter_chat_history_newest_first(self.db_connection, self.user_id)
+        self.assertEqual(next(history), (AIMessage(content='answer 6'), 2))
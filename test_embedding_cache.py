@@ -0,0 +1,106 @@
+import os
+import sqlite3
+import tempfile
+from contextlib import closing
+from unittest import TestCase
+from unittest.mock import patch
+
+from langchain.embeddings.base import Embeddings
+
+from embedding_cache import CachedEmbeddings
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.embedded = []
+
+    def _vector(self, text: str):
+        return [float(len(text)), 0.5, -1.0]
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self.embedded.append(text)
+        return self._vector(text)
+
+
+class TestCachedEmbeddings(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmp_dir.name, 'embeddings.sqlite3')
+        self.embeddings = CountingEmbeddings()
+        self.caches = []
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.close()
+        self.tmp_dir.cleanup()
+
+    def make_cache(self, **kwargs) -> CachedEmbeddings:
+        options = dict(namespace='test', db_file=self.db_file, max_entries=100)
+        options.update(kwargs)
+        cache = CachedEmbeddings(self.embeddings, **options)
+        self.caches.append(cache)
+        return cache
+
+    def test_only_missing_documents_are_embedded(self):
+        cache = self.make_cache()
+
+        self.assertEqual(cache.embed_documents(['a', 'bb']), [[1.0, 0.5, -1.0], [2.0, 0.5, -1.0]])
+        self.assertEqual(cache.embed_documents(['bb', 'ccc', 'a', 'ccc']),
+                         [[2.0, 0.5, -1.0], [3.0, 0.5, -1.0], [1.0, 0.5, -1.0], [3.0, 0.5, -1.0]])
+        self.assertEqual(self.embeddings.embedded, ['a', 'bb', 'ccc'])
+
+    def test_query_is_embedded_once(self):
+        cache = self.make_cache()
+
+        self.assertEqual(cache.embed_query('question'), cache.embed_query('question'))
+        self.assertEqual(self.embeddings.embedded, ['question'])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_cache_is_persistent(self):
+        self.make_cache().embed_documents(['a'])
+
+        self.assertEqual(self.make_cache().embed_documents(['a']), [[1.0, 0.5, -1.0]])
+        self.assertEqual(self.embeddings.embedded, ['a'])
+
+    def test_namespaces_do_not_mix(self):
+        self.make_cache(namespace='model-1').embed_query('question')
+        self.make_cache(namespace='model-2').embed_query('question')
+
+        self.assertEqual(self.embeddings.embedded, ['question', 'question'])
+
+    def test_least_recently_used_vectors_are_evicted(self):
+        cache = self.make_cache(max_entries=10, touch_interval=0)
+        cache.embed_documents([str(i) for i in range(10)])
+        cache.embed_documents(['0'])  # Is used recently, so it stays.
+
+        cache.embed_documents(['new'])
+
+        self.embeddings.embedded.clear()
+        cache.embed_documents(['0', 'new'])
+        self.assertEqual(self.embeddings.embedded, [])
+        cache.embed_documents([str(i) for i in range(1, 10)])
+        self.assertEqual(len(self.embeddings.embedded), 2)  # Down to 90% of the limit.
+
+    def used_at(self, text: str) -> float:
+        key = self.caches[0]._key('query', text)
+        with closing(sqlite3.connect(self.db_file)) as connection:
+            return connection.execute('SELECT used_at FROM Embedding WHERE key = ?', (key,)).fetchone()[0]
+
+    @patch('embedding_cache.time.time')
+    def test_time_of_use_is_updated_once_per_interval(self, now):
+        cache = self.make_cache(touch_interval=60)
+        now.return_value = 1000.0
+        cache.embed_query('question')
+
+        now.return_value = 1059.0
+        cache.embed_query('question')
+        self.assertEqual(self.used_at('question'), 1000.0)
+
+        now.return_value = 1060.0
+        cache.embed_query('question')
+        self.assertEqual(self.used_at('question'), 1060.0)
+        self.assertEqual(self.embeddings.embedded, ['question'])
@@ -0,0 +1,75 @@
+import asyncio
+from unittest import TestCase
+from unittest.mock import patch, Mock
+
+import numpy as np
+from langchain.callbacks.base import AsyncCallbackHandler
+from langchain.schema import HumanMessage
+
+from fake_models import FakeChatModel, FakeEmbeddings
+from test_helpers import FakeEncoding
+from utils import make_chat_model
+
+
+class TokenCollector(AsyncCallbackHandler):
+    def __init__(self):
+        self.tokens = []
+
+    async def on_llm_new_token(self, token: str, **kwargs) -> None:
+        self.tokens.append(token)
+
+
+class TestFakeChatModel(TestCase):
+    def setUp(self):
+        patcher = patch('tokens.get_encoding', Mock(return_value=FakeEncoding()))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_answer_depends_only_on_prompt(self):
+        model = FakeChatModel(latency=0, answer_words=10)
+
+        answer = model.predict_messages([HumanMessage(content="What are the fees?")]).content
+
+        self.assertEqual(len(answer.split()), 10)
+        self.assertEqual(FakeChatModel(latency=0, answer_words=10)([HumanMessage(content="What are the fees?")]).content,
+                         answer)
+        self.assertNotEqual(model([HumanMessage(content="How do I close my account?")]).content, answer)
+
+    def test_usage_is_reported_unless_streamed(self):
+        prompt = [[HumanMessage(content="What are the fees?")]]
+
+        result = FakeChatModel(latency=0, answer_words=10).generate(prompt)
+
+        self.assertEqual(result.llm_output["token_usage"], {"prompt_tokens": 4, "completion_tokens": 10})
+        self.assertEqual(FakeChatModel(latency=0, streaming=True).generate(prompt).llm_output["token_usage"], {})
+
+    def test_streaming(self):
+        model = FakeChatModel(latency=0.05, answer_words=5, streaming=True)
+        collector = TokenCollector()
+
+        result = asyncio.run(model.agenerate([[HumanMessage(content="What are the fees?")]], callbacks=[collector]))
+
+        self.assertEqual(len(collector.tokens), 5)
+        self.assertEqual("".join(collector.tokens), result.generations[0][0].text)
+
+    def test_backend(self):
+        with patch('utils.MODEL_BACKEND', 'fake'):
+            model = make_chat_model(model_name="gpt-3.5-turbo", temperature=0, max_tokens=256, streaming=True)
+        self.assertIsInstance(model, FakeChatModel)
+        self.assertTrue(model.streaming)
+
+        with patch('utils.MODEL_BACKEND', 'local'), self.assertRaises(ValueError):
+            make_chat_model(model_name="gpt-3.5-turbo", temperature=0, max_tokens=256)
+
+
+class TestFakeEmbeddings(TestCase):
+    def test_texts_with_common_words_are_similar(self):
+        embeddings = FakeEmbeddings(latency=0, size=256)
+
+        fees, refunds, fees_again = np.array(embeddings.embed_documents(
+            ["Monthly fees of the card", "Refunds take ten days", "What are the monthly fees of the card?"]))
+
+        self.assertAlmostEqual(float(np.linalg.norm(fees)), 1.0, places=5)
+        self.assertGreater(fees @ fees_again, fees @ refunds)
+        self.assertEqual(embeddings.embed_query("Monthly fees of the card"), fees.tolist())
+        self.assertEqual(embeddings.calls, 2)
@@ -0,0 +1,25 @@
+"""
+Fakes, shared by tests. Tests patch `tokens.get_encoding` to return FakeEncoding, so that they do not download
+the encoding of the model, and numbers of tokens are easy to count.
+"""
+
+
+class FakeEncoding:
+    """
+    One token per word.
+    """
+
+    @staticmethod
+    def encode(text: str) -> list:
+        return text.split()
+
+    @staticmethod
+    def encode_ordinary(text: str) -> list:
+        return text.split()
+
+    def encode_ordinary_batch(self, texts: list) -> list:
+        return [self.encode_ordinary(text) for text in texts]
+
+    @staticmethod
+    def decode(tokens: list) -> str:
+        return " ".join(tokens)
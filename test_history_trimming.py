@@ -0,0 +1,145 @@
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from langchain.schema import HumanMessage, AIMessage, SystemMessage
+
+from fake_models import FakeChatModel
+from history_trimming import trim_chat_history, select_chat_history, add_summary, make_llm_summarizer, TrimPolicy, \
+    SummaryCache, SUMMARY_PREFIX
+from metrics import LLM_CALLS, LLM_TOKENS
+from test_helpers import FakeEncoding
+
+
+def with_token_counts(messages) -> list:
+    return [(message, len(message.content.split())) for message in messages]
+
+
+def trim(recent_history, **kwargs) -> list:
+    # Budget of history is 80 tokens, minus 6 tokens of the request and the question tokens.
+    # Every message costs 5 + its words.
+    options = dict(question_tokens=1, token_limit=100, max_response_tokens=0, document_tokens=0,
+                   policy=TrimPolicy.RECENCY)
+    options.update(kwargs)
+    return trim_chat_history(recent_chat_history=recent_history, **options)
+
+
+class TestRecencyPolicy(TestCase):
+    def test_everything_fits(self):
+        history = [HumanMessage(content='one two'), AIMessage(content='three')]
+        self.assertEqual(trim(with_token_counts(reversed(history))), history)
+
+    def test_older_messages_are_cut_off(self):
+        history = [HumanMessage(content='word ' * 40), AIMessage(content='word ' * 30), HumanMessage(content='last')]
+        self.assertEqual(trim(with_token_counts(reversed(history))), history[1:])
+
+    def test_history_stays_contiguous(self):
+        history = [HumanMessage(content='old'), AIMessage(content='word ' * 70), HumanMessage(content='last')]
+        self.assertEqual(trim(with_token_counts(reversed(history))), history[2:])
+
+    def test_history_is_read_only_as_far_as_needed(self):
+        history = [HumanMessage(content='old')] * 10 + [AIMessage(content='word ' * 70)]
+        recent_history = iter(with_token_counts(reversed(history)))
+
+        self.assertEqual(trim(recent_history), [])
+        self.assertEqual(len(list(recent_history)), 10)
+
+    def test_messages_are_not_copied(self):
+        message = HumanMessage(content='message')
+        self.assertIs(trim([(message, 1)])[0], message)
+
+    def test_too_long_question(self):
+        with self.assertRaises(ValueError):
+            trim([], question_tokens=90)
+
+
+@patch('history_trimming.SUMMARY_MAX_TOKENS', 10)
+@patch('tokens.get_encoding', Mock(return_value=FakeEncoding()))
+class TestSummarizePolicy(TestCase):
+    def test_nothing_is_summarized_when_everything_fits(self):
+        summarize = Mock()
+        history = [HumanMessage(content='one'), AIMessage(content='two')]
+
+        self.assertEqual(trim(with_token_counts(reversed(history)), policy=TrimPolicy.SUMMARIZE,
+                              summarize=summarize), history)
+        summarize.assert_not_called()
+
+    def test_overflow_is_summarized(self):
+        summarize = Mock(return_value='summary')
+        # Costs: 5 + 30 = 35 each. Only two of them fit 73 tokens; with 20 tokens of summary only one.
+        history = [HumanMessage(content=f'{i} ' + 'word ' * 29) for i in range(4)]
+
+        result = trim(with_token_counts(reversed(history)), policy=TrimPolicy.SUMMARIZE, summarize=summarize)
+
+        self.assertEqual(result, [SystemMessage(content=SUMMARY_PREFIX + 'summary'), history[3]])
+        summarize.assert_called_once_with(history[:3])
+
+    def test_prefix_of_summary_is_counted(self):
+        summarize = Mock(return_value='summary')
+        # Costs: 5 + 23 = 28 each. Two of them fit 58 tokens, left by 15 tokens of summary, but not 53,
+        # left by 5 more tokens of its prefix.
+        history = [HumanMessage(content=f'{i} ' + 'word ' * 22) for i in range(3)]
+
+        result = trim(with_token_counts(reversed(history)), policy=TrimPolicy.SUMMARIZE, summarize=summarize)
+
+        self.assertEqual(result, [SystemMessage(content=SUMMARY_PREFIX + 'summary'), history[2]])
+
+    def test_messages_are_selected_without_summarizing(self):
+        history = [HumanMessage(content=f'{i} ' + 'word ' * 29) for i in range(4)]
+
+        kept, dropped = select_chat_history(recent_chat_history=with_token_counts(reversed(history)), question_tokens=1,
+                                            token_limit=100, max_response_tokens=0, document_tokens=0,
+                                            policy=TrimPolicy.SUMMARIZE)
+
+        self.assertEqual(kept, history[3:])
+        self.assertEqual(dropped, history[:3])
+        self.assertEqual(add_summary(kept, 'summary'), [SystemMessage(content=SUMMARY_PREFIX + 'summary'), history[3]])
+
+    def test_long_summary_is_truncated(self):
+        summarize = Mock(return_value='word ' * 50)
+        history = [HumanMessage(content='word ' * 80)]
+
+        result = trim(with_token_counts(history), policy=TrimPolicy.SUMMARIZE, summarize=summarize)
+
+        self.assertEqual(result, [SystemMessage(content=SUMMARY_PREFIX + ' '.join(['word'] * 10))])
+
+    def test_summarizer_is_required(self):
+        with self.assertRaises(ValueError):
+            trim(with_token_counts([HumanMessage(content='word ' * 80)]), policy=TrimPolicy.SUMMARIZE)
+
+
+class TestSummaryCache(TestCase):
+    def test_summary_is_kept_by_user_and_messages(self):
+        cache = SummaryCache()
+        messages = [HumanMessage(content='Hello'), AIMessage(content='Hi')]
+        cache.put(1, messages, 'greeting')
+
+        self.assertEqual(cache.get(1, [HumanMessage(content='Hello'), AIMessage(content='Hi')]), 'greeting')
+        self.assertIsNone(cache.get(2, messages))
+        self.assertIsNone(cache.get(1, [HumanMessage(content='Hello'), AIMessage(content='Hello')]))
+
+    def test_least_recently_used_summary_is_evicted(self):
+        cache = SummaryCache(size=2)
+        first, second, third = ([HumanMessage(content=text)] for text in ('one', 'two', 'three'))
+        cache.put(1, first, 'first')
+        cache.put(1, second, 'second')
+        cache.get(1, first)
+        cache.put(1, third, 'third')
+
+        self.assertEqual(cache.get(1, first), 'first')
+        self.assertIsNone(cache.get(1, second))
+        self.assertEqual(cache.get(1, third), 'third')
+
+
+@patch('tokens.get_encoding', Mock(return_value=FakeEncoding()))
+class TestLlmSummarizer(TestCase):
+    def test_calls_are_counted(self):
+        model = FakeChatModel(latency=0, answer_words=5)
+        calls = LLM_CALLS.value(stage="summarize", model=model.model_name)
+        completion_tokens = LLM_TOKENS.value(stage="summarize", model=model.model_name, kind="completion")
+
+        summary = make_llm_summarizer(model)([HumanMessage(content='My name is Ann'), AIMessage(content='Hi Ann')])
+
+        self.assertEqual(len(summary.split()), 5)
+        self.assertEqual(LLM_CALLS.value(stage="summarize", model=model.model_name), calls + 1)
+        self.assertEqual(LLM_TOKENS.value(stage="summarize", model=model.model_name, kind="completion"),
+                         completion_tokens + 5)
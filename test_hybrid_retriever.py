@@ -0,0 +1,97 @@
+import asyncio
+import threading
+from unittest import TestCase
+
+from langchain.docstore.document import Document
+
+from bm25_index import BM25Index
+from hybrid_retriever import HybridRetriever, reciprocal_rank_fusion
+
+DOCUMENTS = [
+    "Refunds are issued within 30 days of the purchase.",
+    "The arbitration clause covers all disputes between you and Nifty Bridge.",
+    "Fees are charged monthly.",
+    "Privacy of your data is described in the privacy policy.",
+    "Accounts may be closed at any time.",
+]
+METADATAS = [{"file": "terms.pdf", "chunk": i} for i in range(len(DOCUMENTS))]
+
+
+class FakeVectorStore:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def similarity_search(self, query, k=4):
+        self.queries.append(query)
+        return [Document(page_content=DOCUMENTS[row], metadata=dict(METADATAS[row])) for row in self.rows[:k]]
+
+    async def asimilarity_search(self, query, k=4):
+        return self.similarity_search(query, k)
+
+
+def make_retriever(vector_rows, **kwargs) -> HybridRetriever:
+    index = BM25Index.build([str(i) for i in range(len(DOCUMENTS))], DOCUMENTS, METADATAS)
+    return HybridRetriever(FakeVectorStore(vector_rows), index, k=2, **kwargs)
+
+
+def document(row: int) -> Document:
+    return Document(page_content=DOCUMENTS[row], metadata=dict(METADATAS[row]))
+
+
+class TestReciprocalRankFusion(TestCase):
+    def test_documents_in_both_rankings_first(self):
+        fused = reciprocal_rank_fusion([[document(0), document(1)], [document(2), document(1)]], k=3)
+        self.assertEqual(fused, [document(1), document(0), document(2)])
+
+    def test_k(self):
+        self.assertEqual(reciprocal_rank_fusion([[document(0), document(1)], []], k=1), [document(0)])
+
+
+class TestHybridRetriever(TestCase):
+    def test_confident_lexical_match_skips_vector_search(self):
+        retriever = make_retriever(vector_rows=[3, 4])
+        documents = retriever.get_relevant_documents("Which disputes are in the arbitration clause?")
+
+        self.assertEqual(documents, [document(1)])
+        self.assertEqual(retriever._vector_store.queries, [])
+        self.assertEqual((retriever.lexical_only, retriever.fused), (1, 0))
+
+    def test_vague_question_is_fused(self):
+        retriever = make_retriever(vector_rows=[2, 0])
+        documents = retriever.get_relevant_documents("How much does it cost to get my money back?")
+
+        self.assertEqual(retriever._vector_store.queries, ["How much does it cost to get my money back?"])
+        self.assertEqual(documents, [document(2), document(0)])
+        self.assertEqual((retriever.lexical_only, retriever.fused), (0, 1))
+
+    def test_lexical_and_vector_matches_are_fused(self):
+        # Neither lexical match is clearly better than the other one.
+        retriever = make_retriever(vector_rows=[4, 3])
+        documents = retriever.get_relevant_documents("fees and privacy")
+        self.assertEqual(documents, [document(3), document(4)])
+
+    def test_confidence_can_be_disabled(self):
+        retriever = make_retriever(vector_rows=[3, 1], confidence=float('inf'))
+        documents = retriever.get_relevant_documents("Which disputes are in the arbitration clause?")
+        self.assertEqual(documents, [document(1), document(3)])
+
+    def test_async(self):
+        retriever = make_retriever(vector_rows=[4, 3])
+        documents = asyncio.run(retriever.aget_relevant_documents("fees and privacy"))
+        self.assertEqual(documents, [document(3), document(4)])
+
+    def test_async_lexical_search_is_not_run_on_event_loop(self):
+        retriever = make_retriever(vector_rows=[4, 3])
+        search_lexical = retriever._search_lexical
+        threads = []
+
+        def record_thread(query):
+            threads.append(threading.current_thread())
+            return search_lexical(query)
+
+        retriever._search_lexical = record_thread
+        asyncio.run(retriever.aget_relevant_documents("fees and privacy"))
+
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
@@ -0,0 +1,154 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from langchain.docstore.document import Document
+
+from ingestion import build_lexical_index, chunk_ids, plan_sync, apply_sync, delete_legacy_chunks, get_stored_chunks, get_stored_file_hash, \
+    document_key, prune_removed_files, FILE_KEY, FILE_HASH_KEY
+
+
+class FakeCollection:
+    def __init__(self):
+        self.rows = {}  # ID -> (text, metadata)
+
+    def get(self, where=None, include=None):
+        ids = [chunk_id for chunk_id, (_, metadata) in self.rows.items()
+               if not where or all(metadata.get(key) == value for key, value in where.items())]
+        return {'ids': ids,
+                'metadatas': [self.rows[chunk_id][1] for chunk_id in ids],
+                'documents': [self.rows[chunk_id][0] for chunk_id in ids]}
+
+    def add(self, ids, embeddings, metadatas, documents):
+        for chunk_id, text, metadata in zip(ids, documents, metadatas):
+            self.rows[chunk_id] = (text, dict(metadata))
+
+    def delete(self, ids):
+        for chunk_id in ids:
+            del self.rows[chunk_id]
+
+    def update(self, ids, metadatas):
+        for chunk_id, metadata in zip(ids, metadatas):
+            self.rows[chunk_id] = (self.rows[chunk_id][0], dict(metadata))
+
+
+class FakeVectorStore:
+    def __init__(self):
+        self._collection = FakeCollection()
+        self.embedded = []
+
+    def add_texts(self, texts, metadatas, ids):
+        self.embedded.extend(texts)
+        self._collection.add(ids, None, metadatas, texts)
+
+
+def make_chunks(*texts, file_hash='hash-1'):
+    return [Document(page_content=text, metadata={"page_number": i, FILE_HASH_KEY: file_hash})
+            for i, text in enumerate(texts)]
+
+
+class TestChunkIds(TestCase):
+    def test_ids_depend_on_text_and_file_only(self):
+        first = chunk_ids('a.pdf', make_chunks('one', 'two'))
+        second = chunk_ids('a.pdf', make_chunks('zero', 'one', 'two'))
+
+        self.assertEqual(first, second[1:])
+        self.assertNotEqual(first, chunk_ids('b.pdf', make_chunks('one', 'two')))
+
+    def test_identical_texts_get_different_ids(self):
+        ids = chunk_ids('a.pdf', make_chunks('same', 'same'))
+
+        self.assertEqual(len(set(ids)), 2)
+
+
+class TestDocumentKey(TestCase):
+    def test_key_does_not_depend_on_working_directory(self):
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(root, 'policies'))
+            file = os.path.join(root, 'policies', 'a.pdf')
+            cwd = os.getcwd()
+            try:
+                os.chdir(os.path.join(root, 'policies'))
+                relative_key = document_key('a.pdf', root)
+                os.chdir(root)
+                keys = {relative_key, document_key('./policies/a.pdf', root), document_key(file, root)}
+            finally:
+                os.chdir(cwd)
+
+        self.assertEqual(keys, {os.path.join('policies', 'a.pdf')})
+
+
+class TestSync(TestCase):
+    def setUp(self):
+        self.vector_store = FakeVectorStore()
+
+    def sync(self, chunks, file='a.pdf'):
+        plan = plan_sync(get_stored_chunks(self.vector_store, file), file, chunks)
+        apply_sync(self.vector_store, plan)
+        return plan
+
+    def test_unchanged_document_is_not_embedded_again(self):
+        self.sync(make_chunks('one', 'two'))
+        self.vector_store.embedded.clear()
+
+        plan = self.sync(make_chunks('one', 'two'))
+
+        self.assertFalse(plan.changed)
+        self.assertEqual(plan.unchanged, 2)
+        self.assertEqual(self.vector_store.embedded, [])
+
+    def test_only_new_chunks_are_embedded_and_gone_ones_are_deleted(self):
+        self.sync(make_chunks('one', 'two', 'three'))
+        self.vector_store.embedded.clear()
+
+        plan = self.sync(make_chunks('one', 'three', 'four', file_hash='hash-2'))
+
+        self.assertEqual(self.vector_store.embedded, ['four'])
+        self.assertEqual((len(plan.add_ids), len(plan.update_ids), len(plan.delete_ids)), (1, 2, 1))
+        stored = get_stored_chunks(self.vector_store, 'a.pdf')
+        self.assertEqual(sorted(metadata["page_number"] for metadata in stored.values()), [0, 1, 2])
+        self.assertEqual(get_stored_file_hash(stored), 'hash-2')
+
+    def test_other_files_are_kept(self):
+        self.sync(make_chunks('one'), file='a.pdf')
+        self.sync(make_chunks('two'), file='b.pdf')
+
+        self.sync([], file='a.pdf')
+
+        self.assertEqual(get_stored_chunks(self.vector_store, 'a.pdf'), {})
+        self.assertEqual(len(get_stored_chunks(self.vector_store, 'b.pdf')), 1)
+
+    def test_legacy_chunks_are_deleted(self):
+        self.vector_store.add_texts(['old'], metadatas=[{"page_number": 0}], ids=['random-uuid'])
+        self.sync(make_chunks('one'))
+
+        self.assertEqual(delete_legacy_chunks(self.vector_store), 1)
+        self.assertEqual([metadata[FILE_KEY] for _, metadata in self.vector_store._collection.rows.values()],
+                         ['a.pdf'])
+
+    def test_chunks_of_removed_files_are_pruned(self):
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(root, 'policies'))
+            open(os.path.join(root, 'policies', 'kept.pdf'), 'w').close()
+            for file in ('policies/kept.pdf', 'policies/removed.pdf', 'elsewhere/removed.pdf'):
+                self.sync(make_chunks('one', 'two'), file=os.path.normpath(file))
+
+            pruned = prune_removed_files(self.vector_store, [os.path.join(root, 'policies')], root)
+
+        self.assertEqual(pruned, 2)
+        self.assertEqual(sorted({metadata[FILE_KEY] for _, metadata in self.vector_store._collection.rows.values()}),
+                         [os.path.join('elsewhere', 'removed.pdf'), os.path.join('policies', 'kept.pdf')])
+
+
+class TestBuildLexicalIndex(TestCase):
+    def test_index_has_all_stored_chunks(self):
+        vector_store = FakeVectorStore()
+        apply_sync(vector_store, plan_sync({}, 'a.pdf', make_chunks('refunds policy', 'arbitration clause')))
+        apply_sync(vector_store, plan_sync({}, 'b.pdf', make_chunks('privacy policy')))
+
+        index = build_lexical_index(vector_store)
+
+        self.assertEqual(len(index), 3)
+        row, _ = index.search('arbitration', k=1)[0]
+        self.assertEqual(index.document(row).page_content, 'arbitration clause')
+        self.assertEqual(index.document(row).metadata['file'], 'a.pdf')
@@ -0,0 +1,154 @@
+import asyncio
+import contextvars
+import tempfile
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from concurrency import run_blocking
+from metrics import Counter, Histogram, CallbackMetric, Registry, TimedIterator, TimingMiddleware, REQUEST_SECONDS, \
+    STAGE_SECONDS, span, start_request_timings, get_request_timings, format_server_timing
+
+
+class TestMetrics(TestCase):
+    def test_counter(self):
+        counter = Counter("calls_total", "Calls.")
+        counter.inc(stage="answer")
+        counter.inc(2, stage="answer")
+        counter.inc(stage="condense")
+
+        self.assertEqual(counter.value(stage="answer"), 3.0)
+        self.assertEqual(list(counter.render()), [
+            "# HELP calls_total Calls.",
+            "# TYPE calls_total counter",
+            'calls_total{stage="answer"} 3.0',
+            'calls_total{stage="condense"} 1.0',
+        ])
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("duration_seconds", "Duration.", buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value, stage="answer")
+
+        self.assertEqual(histogram.count(stage="answer"), 4)
+        self.assertEqual(list(histogram.render())[2:], [
+            'duration_seconds_bucket{stage="answer",le="0.1"} 2',
+            'duration_seconds_bucket{stage="answer",le="1.0"} 3',
+            'duration_seconds_bucket{stage="answer",le="+Inf"} 4',
+            'duration_seconds_sum{stage="answer"} 2.65',
+            'duration_seconds_count{stage="answer"} 4',
+        ])
+
+    def test_registry(self):
+        registry = Registry()
+        registry.register(CallbackMetric("cache_hits_total", "Hits.", "counter",
+                                         lambda: {(("cache", 'answer "semantic"'),): 5}))
+        self.assertEqual(registry.render(), '# HELP cache_hits_total Hits.\n# TYPE cache_hits_total counter\n'
+                                            'cache_hits_total{cache="answer \\"semantic\\""} 5.0\n')
+
+
+class TestSharedRegistry(TestCase):
+    def make_worker(self, directory: str, pid: int, calls: int, duration: float) -> Registry:
+        registry = Registry(directory=directory)
+        counter = registry.register(Counter("calls_total", "Calls."))
+        histogram = registry.register(Histogram("duration_seconds", "Duration.", buckets=(1.0,)))
+        counter.inc(calls, stage="answer")
+        histogram.observe(duration)
+        with patch('metrics.os.getpid', return_value=pid):
+            registry.dump()
+        return registry
+
+    def test_metrics_of_workers_are_summed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.make_worker(directory, pid=1, calls=2, duration=0.5)
+            worker = self.make_worker(directory, pid=2, calls=3, duration=2.0)
+
+            with patch('metrics.os.getpid', return_value=2):
+                lines = worker.render().splitlines()
+
+        self.assertIn('calls_total{stage="answer"} 5.0', lines)
+        self.assertIn('duration_seconds_bucket{le="1.0"} 1', lines)
+        self.assertIn('duration_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn('duration_seconds_sum 2.5', lines)
+
+
+class TestRequestTimings(TestCase):
+    def test_spans_of_blocking_calls_are_added_to_the_request(self):
+        def load():
+            with span("history_load"):
+                time.sleep(0.01)
+
+        async def request():
+            timings = start_request_timings()
+            with span("auth"):
+                pass
+            await run_blocking(load)
+            await run_blocking(load)
+            return timings
+
+        observed = STAGE_SECONDS.count(stage="history_load")
+        timings = contextvars.copy_context().run(asyncio.run, request())
+
+        self.assertEqual(set(timings), {"auth", "history_load"})
+        self.assertGreaterEqual(timings["history_load"], 0.02)
+        self.assertEqual(STAGE_SECONDS.count(stage="history_load"), observed + 2)
+
+    def test_spans_outside_of_requests_are_only_observed(self):
+        def embed():
+            with span("embedding"):
+                pass
+            return get_request_timings()
+
+        observed = STAGE_SECONDS.count(stage="embedding")
+        self.assertIsNone(contextvars.Context().run(embed))
+        self.assertEqual(STAGE_SECONDS.count(stage="embedding"), observed + 1)
+
+    def test_timed_iterator(self):
+        def slow():
+            for i in range(3):
+                time.sleep(0.01)
+                yield i
+
+        iterator = TimedIterator(slow())
+        self.assertEqual(list(iterator), [0, 1, 2])
+        self.assertGreaterEqual(iterator.seconds, 0.03)
+
+    def test_format_server_timing(self):
+        self.assertEqual(format_server_timing({"auth": 0.0012, "answer": 1.5}), "auth;dur=1.2, answer;dur=1500.0")
+
+
+class FakeRoute:
+    path = "/api/send"
+
+
+async def app(scope, receive, send):
+    scope["route"] = FakeRoute()
+    with span("answer"):
+        await asyncio.sleep(0.01)
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+    await send({"type": "http.response.body", "body": b"answer"})
+
+
+class TestTimingMiddleware(TestCase):
+    def request(self, headers: list) -> list:
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "method": "POST", "path": "/api/send", "headers": headers}
+        asyncio.run(TimingMiddleware(app, profiling_header="X-Profile")(scope, receive, send))
+        return dict(messages[0]["headers"])
+
+    def test_server_timing_of_profiled_request(self):
+        headers = self.request([(b"x-profile", b"1")])
+        self.assertRegex(headers[b"server-timing"].decode(), r"^answer;dur=\d+\.\d, total;dur=\d+\.\d$")
+
+    def test_no_server_timing_by_default(self):
+        observed = REQUEST_SECONDS.count(path="/api/send", method="POST", status="200")
+        self.assertNotIn(b"server-timing", self.request([]))
+        self.assertNotIn(b"server-timing", self.request([(b"x-profile", b"0")]))
+        self.assertEqual(REQUEST_SECONDS.count(path="/api/send", method="POST", status="200"), observed + 2)
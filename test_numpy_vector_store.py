@@ -0,0 +1,117 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+
+from ingestion import plan_sync, apply_sync, get_stored_chunks
+from numpy_vector_store import NumpyVectorStore
+from utils import warm_up_vector_store
+
+VECTORS = {
+    'refunds': [1.0, 0.0, 0.0],
+    'fees': [0.0, 1.0, 0.0],
+    'privacy': [0.0, 0.0, 1.0],
+    'fees and refunds': [0.6, 0.8, 0.0],
+}
+
+
+class FakeEmbeddings(Embeddings):
+    def embed_documents(self, texts):
+        return [VECTORS[text] for text in texts]
+
+    def embed_query(self, text):
+        return VECTORS[text]
+
+
+class TestNumpyVectorStore(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'numpy')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_store(self) -> NumpyVectorStore:
+        return NumpyVectorStore(persist_directory=self.path, embedding_function=FakeEmbeddings())
+
+    def test_most_similar_first(self):
+        store = self.make_store()
+        store.add_texts(['refunds', 'fees', 'privacy'], metadatas=[{"page_number": i} for i in range(3)])
+
+        results = store.similarity_search_with_score('fees and refunds', k=2)
+
+        self.assertEqual([(document.page_content, document.metadata) for document, _ in results],
+                         [('fees', {"page_number": 1}), ('refunds', {"page_number": 0})])
+        self.assertAlmostEqual(results[0][1], 0.8, places=5)
+        self.assertEqual(len(store.similarity_search('privacy', k=10)), 3)
+
+    def test_batched_search(self):
+        store = self.make_store()
+        store.add_texts(['refunds', 'fees', 'privacy'])
+
+        results = store.search_by_vectors(np.array([VECTORS['privacy'], [2.0, 0.1, 0.0]]), k=1)
+
+        self.assertEqual([[row for row, _ in query_results] for query_results in results], [[2], [0]])
+
+    def test_empty_store(self):
+        self.assertEqual(self.make_store().similarity_search('fees'), [])
+
+    def test_get_embeddings(self):
+        store = self.make_store()
+        store.add_texts(['fees and refunds', 'privacy'])
+
+        stored = store.get(limit=1, include=["embeddings"])
+
+        self.assertEqual(stored['documents'], ['fees and refunds'])
+        np.testing.assert_allclose(stored['embeddings'], [[0.6, 0.8, 0.0]], rtol=1e-6)
+        self.assertNotIn('embeddings', store.get())
+
+    def test_warm_up_does_not_embed(self):
+        store = self.make_store()
+        store.add_texts(['refunds', 'fees'])
+        store.persist()
+
+        embeddings = Mock(spec=Embeddings)
+        warm_up_vector_store(NumpyVectorStore(persist_directory=self.path, embedding_function=embeddings))
+        warm_up_vector_store(NumpyVectorStore(persist_directory=self.tmp_dir.name, embedding_function=embeddings))
+
+        embeddings.embed_query.assert_not_called()
+
+    def test_persisted_store_is_memory_mapped(self):
+        store = self.make_store()
+        store.add_texts(['refunds', 'fees'], ids=['1', '2'])
+        store.persist()
+
+        reopened = self.make_store()
+
+        self.assertIsInstance(reopened._vectors, np.memmap)
+        self.assertEqual(reopened.similarity_search('fees', k=1)[0].page_content, 'fees')
+
+    def test_persist_replaces_vectors_file(self):
+        store = self.make_store()
+        store.add_texts(['refunds'], ids=['1'])
+        store.persist()
+        store.delete(['1'])
+        store.add_texts(['privacy'], ids=['2'])
+        store.persist()
+
+        self.assertEqual(len([name for name in os.listdir(self.path) if name.endswith('.npy')]), 1)
+        self.assertEqual(self.make_store().get()['documents'], ['privacy'])
+
+    def test_incremental_ingestion(self):
+        store = self.make_store()
+        apply_sync(store, plan_sync({}, 'a.pdf', [Document(page_content='refunds'), Document(page_content='fees')]))
+        store.persist()
+
+        store = self.make_store()
+        plan = plan_sync(get_stored_chunks(store, 'a.pdf'), 'a.pdf',
+                         [Document(page_content='fees'), Document(page_content='privacy')])
+        apply_sync(store, plan)
+
+        self.assertEqual((len(plan.add_ids), plan.unchanged, len(plan.delete_ids)), (1, 1, 1))
+        self.assertEqual(sorted(store.get(where={"file": 'a.pdf'})['documents']), ['fees', 'privacy'])
+        self.assertEqual(store.similarity_search('refunds', k=1)[0].page_content, 'fees')
@@ -0,0 +1,107 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch, Mock
+
+from config import EMBEDDING_RETRY_ATTEMPTS
+from persist_document import persist_pdfs, find_pdf_files, parse_pdf, DEFAULT_DOCUMENT
+from test_helpers import FakeEncoding
+from test_ingestion import FakeVectorStore
+
+
+class FlakyEmbeddings:
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("Rate limit")
+        self.embedded.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+@patch('tokens.get_encoding', Mock(return_value=FakeEncoding()))
+class TestPersistPdfs(TestCase):
+    def setUp(self):
+        self.vector_store = FakeVectorStore()
+        self.file = os.path.normpath(DEFAULT_DOCUMENT)
+
+    def test_document_is_parsed_once(self):
+        document = parse_pdf(DEFAULT_DOCUMENT)
+
+        self.assertTrue(document.pages)
+
+    def test_unchanged_document_is_skipped(self):
+        embeddings = FlakyEmbeddings()
+        stats = persist_pdfs([self.file], self.vector_store, embeddings, workers=1, batch_size=5)
+
+        self.assertEqual(stats.files, 1)
+        self.assertEqual(stats.embedded, stats.chunks)
+        self.assertEqual(len(self.vector_store._collection.rows), stats.chunks)
+
+        embeddings.embedded.clear()
+        stats = persist_pdfs([self.file], self.vector_store, embeddings, workers=1, batch_size=5)
+
+        self.assertEqual((stats.files, stats.skipped), (0, 1))
+        self.assertEqual(embeddings.embedded, [])
+
+    def test_file_is_found_by_absolute_path_too(self):
+        embeddings = FlakyEmbeddings()
+        persist_pdfs(find_pdf_files([DEFAULT_DOCUMENT]), self.vector_store, embeddings, workers=1)
+        chunks = len(self.vector_store._collection.rows)
+
+        stats = persist_pdfs(find_pdf_files([os.path.abspath(DEFAULT_DOCUMENT)]), self.vector_store, embeddings,
+                             workers=1)
+
+        self.assertEqual((stats.files, stats.skipped), (0, 1))
+        self.assertEqual(len(self.vector_store._collection.rows), chunks)
+
+    @patch('ingestion.time.sleep')
+    def test_failed_batch_is_retried(self, sleep):
+        embeddings = FlakyEmbeddings(failures=2)
+        stats = persist_pdfs([self.file], self.vector_store, embeddings, workers=1, batch_size=1000)
+
+        self.assertEqual(stats.embedded, stats.chunks)
+        self.assertEqual(sleep.call_count, 2)
+
+    @patch('ingestion.time.sleep')
+    def test_permanently_failed_batch_fails_the_file(self, sleep):
+        embeddings = FlakyEmbeddings(failures=EMBEDDING_RETRY_ATTEMPTS)
+        stats = persist_pdfs([self.file], self.vector_store, embeddings, workers=1, batch_size=5,
+                             max_concurrent_embeddings=1)
+
+        self.assertEqual((stats.files, stats.failed), (0, 1))
+        self.assertEqual(stats.embedded, stats.chunks - 5)
+        self.assertEqual(len(self.vector_store._collection.rows), stats.chunks - 5)
+
+        # Incomplete file is not skipped next time.
+        stats = persist_pdfs([self.file], self.vector_store, embeddings, workers=1, batch_size=5)
+
+        self.assertEqual((stats.files, stats.skipped, stats.failed), (1, 0, 0))
+        self.assertEqual(stats.embedded, 5)
+
+    def test_unreadable_file_is_reported(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            broken_file = os.path.join(tmp_dir, 'broken.pdf')
+            with open(broken_file, 'w') as file:
+                file.write("not a pdf")
+
+            stats = persist_pdfs([broken_file, self.file], self.vector_store, FlakyEmbeddings(), workers=2)
+
+        self.assertEqual((stats.files, stats.failed), (1, 1))
+
+
+class TestFindPdfFiles(TestCase):
+    def test_directories_and_globs(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_dir = os.path.realpath(tmp_dir)
+            os.makedirs(os.path.join(tmp_dir, 'nested'))
+            for name in ('a.pdf', 'b.txt', os.path.join('nested', 'c.pdf')):
+                open(os.path.join(tmp_dir, name), 'w').close()
+
+            self.assertEqual(find_pdf_files([tmp_dir]),
+                             [os.path.join(tmp_dir, 'a.pdf'), os.path.join(tmp_dir, 'nested', 'c.pdf')])
+            self.assertEqual(find_pdf_files([os.path.join(tmp_dir, '*.pdf'), os.path.join(tmp_dir, 'a.pdf')]),
+                             [os.path.join(tmp_dir, 'a.pdf')])
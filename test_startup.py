@@ -0,0 +1,82 @@
+import asyncio
+import json
+from typing import Coroutine, List, Tuple
+from unittest import TestCase
+
+from startup import Readiness, ReadinessGate
+
+
+async def app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"answer"})
+
+
+class TestReadinessGate(TestCase):
+    def request(self, gate: ReadinessGate, path: str) -> Tuple[List[dict], Coroutine]:
+        """
+        :return: Messages, the gate sends, and the request to await.
+        """
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "method": "POST", "path": path, "headers": []}
+        return messages, gate(scope, receive, send)
+
+    def test_request_waits_for_warm_up(self):
+        async def start():
+            readiness = Readiness()
+            messages, request = self.request(ReadinessGate(app, readiness, timeout=5), "/api/send")
+            waiting = asyncio.create_task(request)
+            await asyncio.sleep(0.01)
+            self.assertEqual(messages, [])
+
+            with readiness.step("import"):
+                pass
+            readiness.set_ready()
+            await waiting
+            return readiness, messages
+
+        readiness, messages = asyncio.run(start())
+
+        self.assertEqual(messages[0]["status"], 200)
+        self.assertEqual(readiness.report()["status"], "ready")
+        self.assertEqual(set(readiness.report()["steps"]), {"import"})
+
+    def test_not_ready_in_time(self):
+        async def start():
+            readiness = Readiness()
+            messages, request = self.request(ReadinessGate(app, readiness, timeout=0.01), "/api/send")
+            await request
+            return messages
+
+        messages = asyncio.run(start())
+
+        self.assertEqual(messages[0]["status"], 503)
+        self.assertIn((b"retry-after", b"1"), messages[0]["headers"])
+        self.assertEqual(json.loads(messages[1]["body"]), {"detail": "The server is not ready: starting"})
+
+    def test_failed_warm_up(self):
+        async def start():
+            readiness = Readiness()
+            readiness.set_failed(ImportError("No module named 'langchain'"))
+            messages, request = self.request(ReadinessGate(app, readiness), "/api/send")
+            await request
+            return readiness, messages
+
+        readiness, messages = asyncio.run(start())
+
+        self.assertEqual(messages[0]["status"], 503)
+        self.assertEqual(readiness.report()["error"], "ImportError: No module named 'langchain'")
+
+    def test_health_check_is_not_gated(self):
+        async def start():
+            messages, request = self.request(ReadinessGate(app, Readiness(), timeout=5), "/healthz")
+            await request
+            return messages
+
+        self.assertEqual(asyncio.run(start())[0]["status"], 200)
@@ -0,0 +1,52 @@
+import random
+import re
+from unittest import TestCase
+
+from text_cleaning import compile_rules, clean_page_text, CleaningRule, MERGE_HYPHENATED_WORDS, FIX_NEWLINES, \
+    REMOVE_MULTIPLE_NEWLINES
+from utils import merge_hyphenated_words, fix_newlines, remove_multiple_newlines
+
+# Letters, digits, underscore, non-ASCII letters and digits, and characters, which are not `\w`.
+ALPHABET = ['a', 'b', 'Z', '1', '_', 'é', 'ж', '²', '́', '-', '-', '\n', '\n', '\n', ' ', '.', '\t']
+
+
+def clean_sequentially(text: str) -> str:
+    for cleaning_function in (merge_hyphenated_words, fix_newlines, remove_multiple_newlines):
+        text = cleaning_function(text)
+    return text
+
+
+class TestCleanPageText(TestCase):
+    def test_same_as_cleaning_functions(self):
+        text = "Nifty Bridge is a pro-\ngram\nof the\n\n\nbank.\n\nTerms of ser-\nvice"
+
+        self.assertEqual(clean_page_text(text), clean_sequentially(text))
+        self.assertEqual(clean_page_text(text), "Nifty Bridge is a program of the\nbank.\nTerms of service")
+
+    def test_consecutive_hyphenated_words(self):
+        for text in ("a-\nb-\nc", "a-\nb-\nc-\nd", "ab-\n-\ncd", "-\na", "a-\n", "a-\n\nb", "a-\n-\n-\nb"):
+            with self.subTest(text=text):
+                self.assertEqual(clean_page_text(text), clean_sequentially(text))
+
+    def test_random_texts(self):
+        rng = random.Random(0)
+        for _ in range(20000):
+            text = ''.join(rng.choices(ALPHABET, k=rng.randint(0, 30)))
+            self.assertEqual(clean_page_text(text), clean_sequentially(text), repr(text))
+
+
+class TestCompileRules(TestCase):
+    def test_rules_are_applied_in_order(self):
+        shout = CleaningRule(r"[a-z]+", "WORD")
+        text = "some-\nthing\n\nelse\n"
+
+        for rules in [(shout,), (MERGE_HYPHENATED_WORDS, shout), (shout, FIX_NEWLINES, REMOVE_MULTIPLE_NEWLINES),
+                      (FIX_NEWLINES,), (REMOVE_MULTIPLE_NEWLINES, FIX_NEWLINES)]:
+            expected = text
+            for rule in rules:
+                expected = re.sub(rule.pattern, rule.replacement, expected)
+            with self.subTest(rules=rules):
+                self.assertEqual(compile_rules(rules)(text), expected)
+
+    def test_no_rules(self):
+        self.assertEqual(compile_rules([])("a\nb"), "a\nb")
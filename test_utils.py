@@ -1,8 +1,18 @@
+import asyncio
 from unittest import TestCase
-from unittest.mock import Mock, call
+from unittest.mock import Mock, call, patch
 
+from langchain.docstore.document import Document
+from langchain.schema import HumanMessage, AIMessage
+
+from answer_pipeline import ANSWER_INSTRUCTIONS, AnswerPipeline
 from app_types import PageData
-from utils import merge_hyphenated_words, fix_newlines, clean_text, remove_multiple_newlines
+from config import CHUNK_TOKENS, GPT_3_5_TURBO_TOKEN_LIMIT, MAX_RESPONSE_TOKENS, RETRIEVAL_K
+from history_trimming import MESSAGE_OVERHEAD_TOKENS
+from test_helpers import FakeEncoding
+from tokens import count_tokens
+from utils import merge_hyphenated_words, fix_newlines, clean_text, remove_multiple_newlines, astream_ai_response, \
+    limit_recent_chat_history, limit_tokens_for_request, iter_clean_text, iter_text_chunks
 
 
 class TestMergeHyphenatedWords(TestCase):
@@ -96,3 +106,91 @@ class TestCleanText(TestCase):
             PageData(num=3, text='page three'),
         ]
         self.assertEqual(result, expected_result)
+
+    def test_pages_are_cleaned_lazily(self):
+        cleaning_function = Mock(side_effect=str.upper)
+        pages = iter_clean_text(
+            pages=(PageData(num=i, text=f'page {i}') for i in range(3)),
+            cleaning_functions=[cleaning_function],
+        )
+
+        self.assertEqual(cleaning_function.call_count, 0)
+        self.assertEqual(next(pages), PageData(num=0, text='PAGE 0'))
+        self.assertEqual(cleaning_function.call_count, 1)
+
+
+class TestIterTextChunks(TestCase):
+    def test_chunks_have_page_and_document_metadata(self):
+        chunks = list(iter_text_chunks(
+            pages=iter([PageData(num=1, text='page one'), PageData(num=2, text='page two')]),
+            metadata={"title": "Terms"},
+        ))
+
+        self.assertEqual([chunk.page_content for chunk in chunks], ['page one', 'page two'])
+        self.assertEqual(chunks[1].metadata, {"page_number": 2, "chunk": 0, "source": "p2-0", "title": "Terms"})
+
+
+class FakeStreamingChain:
+    def __init__(self, tokens, answer):
+        self.tokens = tokens
+        self.answer = answer
+
+    async def acall(self, inputs, callbacks=None):
+        for token in self.tokens:
+            for callback in callbacks:
+                await callback.on_llm_new_token(token)
+        return {"answer": self.answer}
+
+
+class TestAstreamAiResponse(TestCase):
+    @staticmethod
+    def collect(chain) -> list:
+        async def consume():
+            return [token async for token in astream_ai_response(chain, chat_history=[], question='question')]
+
+        return asyncio.run(consume())
+
+    def test_tokens_are_streamed(self):
+        chain = FakeStreamingChain(tokens=['', 'Hel', 'lo'], answer='Hello')
+        self.assertEqual(self.collect(chain), ['Hel', 'lo'])
+
+    def test_answer_of_not_streaming_model(self):
+        chain = FakeStreamingChain(tokens=[], answer='Hello')
+        self.assertEqual(self.collect(chain), ['Hello'])
+
+
+@patch('tokens.get_encoding', Mock(return_value=FakeEncoding()))
+class TestLimitTokensForRequest(TestCase):
+    # Budget of history is 80% of 4096 tokens, minus 256 tokens of the response, 1600 tokens of the documents
+    # and the question.
+
+    def test_everything_fits(self):
+        history = [HumanMessage(content='one two'), AIMessage(content='three')]
+        self.assertEqual(limit_tokens_for_request('question', history), history)
+
+    def test_history_stays_contiguous(self):
+        history = [HumanMessage(content='old'), AIMessage(content='word ' * 3100), HumanMessage(content='last')]
+        self.assertEqual(limit_tokens_for_request('question', history), history[2:])
+
+    def test_too_long_question(self):
+        with self.assertRaises(ValueError):
+            limit_tokens_for_request('word ' * 4000, [])
+
+
+@patch('tokens.get_encoding', Mock(return_value=FakeEncoding()))
+class TestLimitRecentChatHistory(TestCase):
+    def test_stored_token_counts_are_used(self):
+        recent_history = [(AIMessage(content='short'), 1), (HumanMessage(content='short'), 3100)]
+        self.assertEqual(limit_recent_chat_history('question', recent_history), [recent_history[0][0]])
+
+    def test_long_history_and_full_size_chunks_fit_the_model(self):
+        question = 'What are the fees?'
+        history = [(HumanMessage(content='word ' * 300), 300) for _ in range(20)]
+        documents = [Document(page_content='word ' * CHUNK_TOKENS) for _ in range(RETRIEVAL_K)]
+
+        limited_history = limit_recent_chat_history(ANSWER_INSTRUCTIONS + question, history)
+        prompt = AnswerPipeline._answer_prompt(question, limited_history, documents)
+
+        self.assertTrue(limited_history)
+        prompt_tokens = sum(count_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS for message in prompt.messages)
+        self.assertLessEqual(prompt_tokens + MAX_RESPONSE_TOKENS, GPT_3_5_TURBO_TOKEN_LIMIT)
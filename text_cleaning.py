@@ -0,0 +1,98 @@
+import re
+from typing import Callable, NamedTuple, Sequence
+
+
+class CleaningRule(NamedTuple):
+    pattern: str
+    replacement: str
+
+
+# Same as utils.merge_hyphenated_words, utils.fix_newlines and utils.remove_multiple_newlines.
+MERGE_HYPHENATED_WORDS = CleaningRule(r"(\w)-\n(\w)", r"\1\2")
+FIX_NEWLINES = CleaningRule(r"(?<!\n)\n(?!\n)", r" ")
+REMOVE_MULTIPLE_NEWLINES = CleaningRule(r"\n{2,}", r"\n")
+
+DEFAULT_RULES = (MERGE_HYPHENATED_WORDS, FIX_NEWLINES, REMOVE_MULTIPLE_NEWLINES)
+
+_MULTIPLE_NEWLINES = re.compile(r"\n{2,}")
+
+
+def _is_word_character(char: str) -> bool:
+    return char.isalnum() or char == '_'  # Same as `\w` of unicode patterns.
+
+
+def _merge_hyphenated_words(text: str) -> str:
+    """
+    Same as applying MERGE_HYPHENATED_WORDS with re.sub, but looks for "-\\n" only, instead of trying
+    the pattern at every character. Second letter of the match is consumed, as by re.sub:
+    "a-\\nb-\\nc" gives "ab-\\nc".
+    """
+    position = text.find('-\n')
+    if position < 0:
+        return text
+
+    parts = []
+    start = 0  # Start of the text, which is not copied yet.
+    free = 0  # Start of the text, which is not consumed by the previous match.
+    while position >= 0:
+        if (position - 1 >= free and position + 2 < len(text)
+                and _is_word_character(text[position - 1]) and _is_word_character(text[position + 2])):
+            parts.append(text[start:position])
+            start = position + 2
+            free = position + 3
+        position = text.find('-\n', position + 2)
+
+    parts.append(text[start:])
+    return ''.join(parts)
+
+
+def _fix_and_remove_multiple_newlines(text: str) -> str:
+    """
+    Same as applying FIX_NEWLINES and then REMOVE_MULTIPLE_NEWLINES with re.sub, in single pass of the regex:
+    text is split by runs of newlines, single newlines within the parts are replaced with spaces.
+    """
+    if '\n' not in text:
+        return text
+    return '\n'.join(part.replace('\n', ' ') for part in _MULTIPLE_NEWLINES.split(text))
+
+
+# Rules (and sequences of rules), which have faster implementations. Output is identical.
+_FUSED_RULES = {
+    (FIX_NEWLINES, REMOVE_MULTIPLE_NEWLINES): _fix_and_remove_multiple_newlines,
+    (MERGE_HYPHENATED_WORDS,): _merge_hyphenated_words,
+}
+_MAX_FUSED_RULES = max(len(rules) for rules in _FUSED_RULES)
+
+
+def compile_rules(rules: Sequence[CleaningRule] = DEFAULT_RULES) -> Callable[[str], str]:
+    """
+    Compiles the rules into single cleaning function, which gives the same text, as applying the rules
+    one by one with re.sub. Patterns are compiled once, and known rules are replaced with faster implementations.
+    :param rules:   Rules, applied in order.
+    :return: Cleaning function, e.g. for utils.clean_text.
+    """
+    steps = []
+    rules = list(rules)
+    index = 0
+    while index < len(rules):
+        for length in range(min(_MAX_FUSED_RULES, len(rules) - index), 0, -1):
+            fused = _FUSED_RULES.get(tuple(rules[index:index + length]))
+            if fused is not None:
+                steps.append(fused)
+                index += length
+                break
+        else:
+            pattern = re.compile(rules[index].pattern)
+            replacement = rules[index].replacement
+            steps.append(lambda text, pattern=pattern, replacement=replacement: pattern.sub(replacement, text))
+            index += 1
+
+    def clean(text: str) -> str:
+        for step in steps:
+            text = step(text)
+        return text
+
+    return clean
+
+
+clean_page_text = compile_rules(DEFAULT_RULES)
@@ -0,0 +1,48 @@
+from functools import lru_cache
+from typing import List, Tuple
+
+import tiktoken
+
+MODEL_NAME = "gpt-3.5-turbo"
+
+
+@lru_cache(maxsize=None)
+def get_encoding() -> tiktoken.Encoding:
+    """
+    :return: Encoding of the chat model. Is loaded once per process.
+    """
+    return tiktoken.encoding_for_model(MODEL_NAME)
+
+
+def count_tokens(text: str) -> int:
+    """
+    :return: Number of tokens in the text, without overhead of the chat message format.
+    """
+    return len(get_encoding().encode(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    :return: Text, cut to at most `max_tokens` tokens.
+    """
+    tokens = get_encoding().encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return get_encoding().decode(tokens[:max_tokens])
+
+
+def count_tokens_batch(texts: List[str]) -> List[int]:
+    """
+    Same as `count_tokens` for every text, but texts are encoded in parallel. Special tokens are encoded as text.
+    """
+    return [len(tokens) for tokens in get_encoding().encode_ordinary_batch(texts)]
+
+
+def split_to_tokens(text: str, max_tokens: int) -> List[Tuple[str, int]]:
+    """
+    :return: Consecutive pieces of the text of at most `max_tokens` tokens, along with numbers of their tokens.
+    """
+    encoding = get_encoding()
+    tokens = encoding.encode_ordinary(text)
+    return [(encoding.decode(tokens[start:start + max_tokens]), len(tokens[start:start + max_tokens]))
+            for start in range(0, len(tokens), max_tokens)]
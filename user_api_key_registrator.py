@@ -3,14 +3,14 @@ import argparse
 import sqlite3
 import sys
 
-from db_services import re_initialize_db, register_new_api_key, get_user_api_keys
+from db_services import re_initialize_db, register_new_api_key, get_user_api_keys, revoke_api_key
 
 from config import USERS_API_KEYS_DB_FILE
 
 
 def main(args):
     with sqlite3.connect(USERS_API_KEYS_DB_FILE) as db_connection:
-        if not (args.list or args.register):
+        if not (args.list or args.register or args.revoke):
             parser.print_usage(sys.stderr)
             print("error: You must provide at least one argument", file=sys.stderr)
             sys.exit(1)
@@ -27,17 +27,26 @@ def main(args):
             key = register_new_api_key(db_connection)
             print('New user registered with key:', key)
 
+        if args.revoke:
+            # Revoke the key. Running servers stop accepting it within a second.
+            if revoke_api_key(db_connection, args.revoke):
+                print('Key revoked:', args.revoke)
+            else:
+                print("error: Key not found:", args.revoke, file=sys.stderr)
+                sys.exit(1)
+
 
 if __name__ == "__main__":
     # Define the argparse parser object
     parser = argparse.ArgumentParser(description='Process command line arguments')
     parser.add_argument('--list', action='store_true', help='List user keys')
     parser.add_argument('--register', action='store_true', help='Register new user')
+    parser.add_argument('--revoke', metavar='KEY', help='Revoke user key')
 
     # Parse the command line arguments
     args = parser.parse_args()
 
     main(args)
 
-# Note. In the future, some functionality might be added, in order to
-# show messages history by provided user key, or whatever. But for now that's not the case.
+# Note. Chat history of the user can be exported by their key with
+# `python chat_history_maintenance.py export --user-key <API_KEY>`.
@@ -1,17 +1,32 @@
-from typing import Callable
+import asyncio
+from typing import Callable, AsyncIterator, Iterable, Iterator, Tuple, Optional
 
-import tiktoken
+from langchain.callbacks.base import AsyncCallbackHandler
 from langchain.chat_models import ChatOpenAI
 from langchain.docstore.document import Document
 from langchain.embeddings import OpenAIEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores import Chroma
-from langchain.chains import ConversationalRetrievalChain
+from langchain.schema import BaseMessage
 
+from answer_cache import SemanticAnswerCache, SharedAnswerCache
+from answer_pipeline import AnswerPipeline
 from app_types import List, PageData, PDFDocument, MessageType
+from bm25_index import BM25Index
+from coalescing import BatchingEmbeddings
+from embedding_cache import CachedEmbeddings
+from fake_models import FakeChatModel, FakeEmbeddings
+from hybrid_retriever import HybridRetriever
+from metrics import TimedEmbeddings
+from numpy_vector_store import NumpyVectorStore
+from history_trimming import trim_chat_history, make_llm_summarizer, TrimPolicy, Summarizer
+from tokens import count_tokens
 import re
 
-from config import VECTOR_STORE_COLLECTION_NAME, VECTOR_STORE_PATH, MAX_RESPONSE_TOKENS, GPT_3_5_TURBO_TOKEN_LIMIT
+from config import VECTOR_STORE_COLLECTION_NAME, VECTOR_STORE_PATH, MAX_RESPONSE_TOKENS, CHAT_HISTORY_TRIM_POLICY, \
+    SUMMARY_MAX_TOKENS, EMBEDDING_CACHE_ENABLED, VECTOR_STORE_BACKEND, NUMPY_VECTOR_STORE_PATH, \
+    RETRIEVAL_MODE, RETRIEVAL_K, CONDENSE_MODEL_NAME, CONDENSE_OPENAI_API_BASE, EMBEDDING_BATCH_WINDOW, \
+    ANSWER_CACHE_BACKEND, MODEL_BACKEND
 
 
 def merge_hyphenated_words(text: str) -> str:
@@ -26,64 +41,176 @@ def remove_multiple_newlines(text: str) -> str:
     return re.sub(r"\n{2,}", r"\n", text)
 
 
-def clean_text(pages: List[PageData], cleaning_functions: List[Callable[[str], str]]) -> List[PageData]:
-    cleaned_pages = []
+def iter_clean_text(pages: Iterable[PageData], cleaning_functions: List[Callable[[str], str]]) -> Iterator[PageData]:
+    """
+    Same as `clean_text`, but lazily: page is cleaned, when it is read from the returned iterator.
+    """
     for page_data in pages:
         text = page_data.text
         for cleaning_function in cleaning_functions:
             text = cleaning_function(text)
 
-        cleaned_pages.append(PageData(num=page_data.num, text=text))
+        yield PageData(num=page_data.num, text=text)
 
-    return cleaned_pages
 
+def clean_text(pages: List[PageData], cleaning_functions: List[Callable[[str], str]]) -> List[PageData]:
+    return list(iter_clean_text(pages, cleaning_functions))
 
-def text_to_chunks(pdf_document: PDFDocument) -> List[Document]:
+
+def iter_text_chunks(pages: Iterable[PageData], metadata: dict) -> Iterator[Document]:
     """
-    Converts list of strings into list of Documents with metadata.
-    :param pdf_document:
-    :return:
+    Same as `text_to_chunks`, but lazily: page is split, when its chunks are read from the returned iterator.
+    So only one page at a time is held by the pipeline, see persist_document.load_chunks.
+    :param pages:       Pages of the document.
+    :param metadata:    Metadata of the document, added to every chunk.
     """
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=2048,
+        separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""],
+        chunk_overlap=200
+    )
 
-    doc_chunks = []
-
-    for page in pdf_document.pages:
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=2048,
-            separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""],
-            chunk_overlap=200
-        )
+    for page in pages:
         split_chunks = text_splitter.split_text(page.text)
         for i, each_chunk in enumerate(split_chunks):
-            doc_chunk = Document(
+            yield Document(
                 page_content=each_chunk,
                 metadata={
                     "page_number":page.num,
                     "chunk": i,
                     "source": f"p{page.num}-{i}",
-                    **pdf_document.metadata,
+                    **metadata,
                 }
             )
 
-            doc_chunks.append(doc_chunk)
 
-    return doc_chunks
+def text_to_chunks(pdf_document: PDFDocument) -> List[Document]:
+    """
+    Converts list of strings into list of Documents with metadata.
+    :param pdf_document:
+    :return:
+    """
+    return list(iter_text_chunks(pdf_document.pages, pdf_document.metadata))
+
 
+def make_chat_model(model_name: str, temperature: float, max_tokens: int, streaming: bool = False, **kwargs):
+    """
+    Chat model of MODEL_BACKEND: ChatOpenAI with these settings, or fake_models.FakeChatModel.
+    """
+    if MODEL_BACKEND == 'fake':
+        return FakeChatModel(model_name=f"fake-{model_name}", streaming=streaming)
+    if MODEL_BACKEND != 'openai':
+        raise ValueError(f"Unknown model backend: {MODEL_BACKEND}")
+    return ChatOpenAI(model_name=model_name, temperature=temperature, max_tokens=max_tokens, streaming=streaming,
+                      **kwargs)
 
-def make_chain():
-    model = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0.5, max_tokens=MAX_RESPONSE_TOKENS)
-    embedding = OpenAIEmbeddings()
-    vector_store = Chroma(
+
+def make_embeddings():
+    """
+    Embeddings, shared by ingestion (persist_document.py), retrieval and the answer cache.
+    Embeddings of MODEL_BACKEND (OpenAI embeddings by default), cached on disk (see embedding_cache.CachedEmbeddings)
+    unless disabled. Queries, missing in the cache, are embedded in batches with queries of concurrent requests,
+    see coalescing.BatchingEmbeddings. Calls, which reach the model, are counted and timed (see metrics.py).
+    """
+    if MODEL_BACKEND == 'fake':
+        model_embeddings = FakeEmbeddings()
+    elif MODEL_BACKEND == 'openai':
+        model_embeddings = OpenAIEmbeddings()
+    else:
+        raise ValueError(f"Unknown model backend: {MODEL_BACKEND}")
+    embeddings = TimedEmbeddings(model_embeddings)
+    if EMBEDDING_BATCH_WINDOW > 0:
+        embeddings = BatchingEmbeddings(embeddings)
+    if not EMBEDDING_CACHE_ENABLED:
+        return embeddings
+    return CachedEmbeddings(embeddings, namespace=f"{MODEL_BACKEND}:{model_embeddings.model}")
+
+
+def make_vector_store(embedding):
+    """
+    Opens the persisted vector store of VECTOR_STORE_BACKEND.
+    :param embedding: Embeddings to embed queries (and added texts) with.
+    """
+    if VECTOR_STORE_BACKEND == 'numpy':
+        return NumpyVectorStore(persist_directory=NUMPY_VECTOR_STORE_PATH, embedding_function=embedding)
+    if VECTOR_STORE_BACKEND != 'chroma':
+        raise ValueError(f"Unknown vector store backend: {VECTOR_STORE_BACKEND}")
+    return Chroma(
         collection_name=VECTOR_STORE_COLLECTION_NAME,
         embedding_function=embedding,
         persist_directory=VECTOR_STORE_PATH
     )
 
-    return ConversationalRetrievalChain.from_llm(
-        model,
-        retriever=vector_store.as_retriever(),
-        return_source_documents=True
-    )
+
+def warm_up_vector_store(vector_store):
+    """
+    Searches by a stored vector once, so that the first question does not wait for the index to load: Chroma loads
+    it from disk on the first query, and vectors of the numpy store are memory-mapped, so they are read lazily.
+    Nothing is embedded.
+    """
+    collection = vector_store if isinstance(vector_store, NumpyVectorStore) else vector_store._collection
+    stored = collection.get(limit=1, include=["embeddings"])
+    if stored["embeddings"]:
+        vector_store.similarity_search_by_vector(stored["embeddings"][0], k=RETRIEVAL_K)
+
+
+def make_retriever(vector_store):
+    """
+    :return: Hybrid (lexical and vector) retriever, if RETRIEVAL_MODE is 'hybrid' and the lexical index is built,
+             and vector store retriever otherwise.
+    """
+    if RETRIEVAL_MODE == 'hybrid':
+        index = BM25Index.load()
+        if index is not None:
+            return HybridRetriever(vector_store, index)
+    return vector_store.as_retriever(search_kwargs={"k": RETRIEVAL_K})
+
+
+def make_answer_cache(embed):
+    """
+    Answer cache of ANSWER_CACHE_BACKEND.
+    :param embed: Blocking function, that embeds the question.
+    """
+    if ANSWER_CACHE_BACKEND == 'memory':
+        return SemanticAnswerCache(embed=embed)
+    if ANSWER_CACHE_BACKEND != 'sqlite':
+        raise ValueError(f"Unknown answer cache backend: {ANSWER_CACHE_BACKEND}")
+    return SharedAnswerCache(embed=embed)
+
+
+def make_chain(model=None, embedding=None, answer_model=None):
+    """
+    Builds the retrieval pipeline (see answer_pipeline.AnswerPipeline). Building is expensive (vector store is
+    opened from disk), so the server builds it once and shares it, see chain_manager.ChainManager.
+    :param model:           Chat model to rephrase follow-up questions with. CONDENSE_MODEL_NAME by default.
+    :param embedding:       Embeddings to query vector store with. `make_embeddings()` by default.
+    :param answer_model:    Chat model to answer with. Same as `model` if it is given, and streaming
+                             gpt-3.5-turbo of MODEL_BACKEND otherwise, so that answer tokens can be streamed to the client.
+    """
+    if answer_model is None:
+        answer_model = model or make_chat_model(model_name="gpt-3.5-turbo", temperature=0.5,
+                                                max_tokens=MAX_RESPONSE_TOKENS, streaming=True)
+    if model is None:
+        api_base = {"openai_api_base": CONDENSE_OPENAI_API_BASE} if CONDENSE_OPENAI_API_BASE else {}
+        model = make_chat_model(model_name=CONDENSE_MODEL_NAME, temperature=0, max_tokens=MAX_RESPONSE_TOKENS,
+                                **api_base)
+    if embedding is None:
+        embedding = make_embeddings()
+    vector_store = make_vector_store(embedding)
+    warm_up_vector_store(vector_store)
+
+    # Only answer model streams, so streamed tokens never contain the rephrased question.
+    return AnswerPipeline(retriever=make_retriever(vector_store), answer_model=answer_model, condense_model=model)
+
+
+def make_history_summarizer(model=None) -> Summarizer:
+    """
+    Builds summarizer of chat history, which does not fit the request (see history_trimming.TrimPolicy.SUMMARIZE).
+    :param model: Chat model to summarize with. gpt-3.5-turbo of MODEL_BACKEND by default.
+    """
+    if model is None:
+        model = make_chat_model(model_name="gpt-3.5-turbo", temperature=0, max_tokens=SUMMARY_MAX_TOKENS)
+    return make_llm_summarizer(model)
 
 
 def generate_ai_response(chain, chat_history: list, question: str) -> str:
@@ -99,38 +226,96 @@ def generate_ai_response(chain, chat_history: list, question: str) -> str:
     return answer
 
 
-def limit_tokens_for_request(question: str, chat_history: List[MessageType]) -> List[MessageType]:
+async def agenerate_ai_response(chain, chat_history: list, question: str) -> str:
     """
-    :param question:        The question to the model. Is used to count tokens only. WIll stay the same.
-    :param chat_history:    Collection of previous messages within the discussion.
-                             In case of too many messages, older ones will be cut off, leaving newer ones.
-    :return: limited history
-    :raises ValueError in case, if question has too many tokens provided.
+    Same as `generate_ai_response`, but does not block the event loop while the model answers.
+    """
+    response = await chain.acall(
+        {
+            "question": question,
+            'chat_history': chat_history
+        }
+    )
+    answer = response["answer"]
+
+    return answer
+
+
+class TokenQueueCallbackHandler(AsyncCallbackHandler):
+    """
+    Puts tokens of streaming models into the queue, as they arrive.
     """
 
-    result_chat_history: List[MessageType] = []
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
 
-    encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+    async def on_llm_new_token(self, token: str, **kwargs) -> None:
+        self.queue.put_nowait(token)
 
-    # Counting necessary token waste.
-    tokens_count = MAX_RESPONSE_TOKENS  # Expected that tokens to be wasted by the model to respond user.
-    tokens_count += 2  # every reply (in the end) is primed with <im_start>assistant
 
-    # Counting question tokens.
-    tokens_count += 4  # Every message follows <im_start>[role/name]\n(content)<im_end>\n
-    tokens_count += len(encoding.encode(question))
+async def astream_ai_response(chain, chat_history: list, question: str) -> AsyncIterator[str]:
+    """
+    Same as `agenerate_ai_response`, but yields tokens of the answer as soon as the model generates them.
+    If the answer model does not stream, the whole answer is yielded at once.
+    """
+    handler = TokenQueueCallbackHandler()
+    task = asyncio.ensure_future(chain.acall(
+        {
+            "question": question,
+            'chat_history': chat_history
+        },
+        callbacks=[handler],
+    ))
+    task.add_done_callback(lambda _: handler.queue.put_nowait(None))
+
+    try:
+        streamed = False
+        while (token := await handler.queue.get()) is not None:
+            if token:
+                streamed = True
+                yield token
+
+        response = task.result()
+        if not streamed:
+            yield response["answer"]
+    finally:
+        if not task.done():  # Client has gone away. Stop generation.
+            task.cancel()
 
-    # Counting chat history tokens.
-    for message in reversed(chat_history):
-        current_message_tokens = len(encoding.encode(message.content))
-        current_message_tokens += 4  # Every message follows <im_start>[role/name]\n(content)<im_end>\n
-        current_message_tokens += 1  # role is always required, and always 1 token
 
-        if tokens_count + current_message_tokens < GPT_3_5_TURBO_TOKEN_LIMIT * 0.8:  # 80% of limit, for safe.
-            result_chat_history.insert(0, message.copy())
-            tokens_count += current_message_tokens
+def limit_tokens_for_request(question: str, chat_history: List[MessageType]) -> List[MessageType]:
+    """
+    :param question:        The question to the model. Is used to count tokens only. WIll stay the same.
+    :param chat_history:    Collection of previous messages within the discussion.
+                             In case of too many messages, older ones will be cut off, leaving newer ones.
+                             History stays contiguous: once a message does not fit, all older ones are cut off too.
+    :return: limited history
+    :raises ValueError in case, if question has too many tokens provided.
+    """
+    recent_chat_history = ((message, count_tokens(message.content)) for message in reversed(chat_history))
+    return trim_chat_history(question_tokens=count_tokens(question),
+                             recent_chat_history=recent_chat_history,
+                             policy=TrimPolicy.RECENCY)
 
-    if tokens_count >= GPT_3_5_TURBO_TOKEN_LIMIT * 0.9:
-        raise ValueError("Too much tokens for model")
 
-    return result_chat_history
+def limit_recent_chat_history(question: str,
+                              recent_chat_history: Iterable[Tuple[MessageType, int]],
+                              policy: TrimPolicy = CHAT_HISTORY_TRIM_POLICY,
+                              summarize: Optional[Summarizer] = None) -> List[BaseMessage]:
+    """
+    Same as `limit_tokens_for_request`, but chat history is taken newest messages first, and is read
+    only until the token budget is exhausted. So lazily loaded history
+    (see db_services.iter_chat_history_newest_first) is read from the database only as far as needed.
+    Messages are not encoded again: numbers of their tokens, counted when they were saved, are used.
+    :param question:            The question to the model. Is used to count tokens only.
+    :param recent_chat_history: Previous messages within the discussion, newest first,
+                                 along with numbers of tokens in their texts.
+    :param policy:              What to do with messages, which do not fit, see history_trimming.TrimPolicy.
+    :param summarize:           Summarizer of messages, which do not fit. Required by summarize policy.
+    :return: limited history, oldest messages first.
+    :raises ValueError in case, if question has too many tokens provided.
+    """
+    return trim_chat_history(question_tokens=count_tokens(question),
+                             recent_chat_history=recent_chat_history,
+                             policy=policy,
+                             summarize=summarize)